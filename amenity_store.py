@@ -0,0 +1,604 @@
+# Preprocessed amenity store
+#
+# amenities-vancouver.json.gz keeps every OSM tag of a place in one dict per
+# row, and the filters used to walk those dicts on every run (len(tags) for
+# popularity, tags.get("wikidata") for enrichment). build_store() streams the
+# file once, a chunk at a time, keeps the rows StoreFilters lets through and
+# derives plain columns from their tags:
+#
+#   tag_count          number of tags
+#   has_wikidata       has a wikidata or brand:wikidata tag
+#   wikidata_id        the wikidata tag, else brand:wikidata, missing if neither
+#   has_opening_hours  has an opening_hours tag
+#   cuisine            categorical cuisine
+#   has_address        has any addr:* tag
+#   is_chain           a place of a chain (see build_store)
+#
+# The amenity type and cuisine are categoricals: int16 codes per row, with the
+# names saved once in meta.json.
+#
+# Every column is saved as a .npy file in a directory next to a meta.json, and
+# the tags themselves as a TagStore in its tags/ subdirectory instead of one
+# dict per row. Rows are sorted by TILE_DEG tile, so a tour can read only the
+# tiles around its start (see TileIndex). load_or_build_store() reads that
+# directory, rebuilding it first when the source file or the filters have
+# changed, so the filters at query time become column comparisons. The
+# coordinates are also saved as Coordinates arrays (radians and float32
+# degrees), which the planner maps instead of copying lat and lon out of the
+# frames.
+#
+import dataclasses
+import gzip
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from coordinates import Coordinates
+from tag_store import TagStore, TagStoreBuilder
+
+try:
+    from orjson import loads
+except ImportError:  # About 3 times slower, but always there
+    from json import loads
+
+STORE_DIR = "amenity_store"
+VERSION = 10
+RAW_COLUMNS = ["lat", "lon", "timestamp", "amenity", "name", "tags"]
+CHUNK_ROWS = 50_000  # Lines parsed at a time
+STRING_COLUMNS = ["timestamp", "name", "wikidata_id", "brand_id"]
+# Saved as int16 codes, with the category names in meta.json
+CATEGORY_COLUMNS = ["amenity", "cuisine"]
+NUMERIC_COLUMNS = {
+    "lat": np.float64,
+    "lon": np.float64,
+    "tag_count": np.int16,
+    "has_wikidata": np.bool_,
+    "has_opening_hours": np.bool_,
+    "has_address": np.bool_,
+    "is_chain": np.bool_,
+}
+# Brands with at least this many places in the data count as chains
+CHAIN_MIN_LOCATIONS = 3
+TILE_DEG = 0.02  # About 2.2 km north-south, 1.5 km east-west in Vancouver
+_OFFSET = 1 << 30
+METERS_PER_DEG = 111_195
+
+
+# Feature columns derived from the tags, as queries on the tag store
+def tag_features(tags):
+    has_wikidata = tags.has_key("wikidata")
+    cuisine_codes, cuisines = tags.value_codes("cuisine")
+    return {
+        "tag_count": tags.count(),
+        "has_wikidata": has_wikidata | tags.has_key("brand:wikidata"),
+        "wikidata_id": np.where(
+            has_wikidata, tags.values("wikidata"), tags.values("brand:wikidata")
+        ),
+        "has_opening_hours": tags.has_key("opening_hours"),
+        "cuisine": pd.Categorical.from_codes(cuisine_codes, cuisines),
+        "has_address": tags.has_prefix("addr:"),
+    }
+
+
+# Casefolded names without punctuation, so "Tim_Hortons", "Tim Hortons" and
+# "TIM HORTONS" are the same name. Missing names stay missing.
+def normalize_names(names):
+    return (
+        pd.Series(names, dtype="str")
+        .str.casefold()
+        .str.replace(r"['’]", "", regex=True)
+        .str.replace(r"[\W_]+", " ", regex=True)
+        .str.strip()
+    )
+
+
+# normalize_names() of one name, without building a Series
+def normalize_name(name):
+    name = re.sub(r"['’]", "", name.casefold())
+    return re.sub(r"[\W_]+", " ", name).strip()
+
+
+# Which of chains (normalized names) every name starts with as whole words,
+# so "Starbucks - Whiterock" and "Tim Hortons Express" are found under
+# "starbucks" and "tim hortons". Missing where a name starts with none.
+def chain_prefixes(names, chains):
+    names = normalize_names(names)
+    if not chains:
+        return pd.Series(np.nan, index=names.index, dtype=object)
+    # Longest first, so a chain isn't cut short by another that starts it
+    alternatives = sorted(chains, key=len, reverse=True)
+    pattern = "^(" + "|".join(map(re.escape, alternatives)) + ")(?: |$)"
+    return names.str.extract(pattern, expand=False)
+
+
+# What ingestion keeps: named places of one of these amenity types (None for
+# any), inside bounds (min_lat, max_lat, min_lon, max_lon; None for anywhere)
+# and not named after one of chain_names
+@dataclass(frozen=True)
+class StoreFilters:
+    amenities: tuple = None
+    chain_names: tuple = ()
+    bounds: tuple = None
+
+    def digest(self):
+        normalized = dataclasses.replace(
+            self, chain_names=sorted(set(normalize_names(list(self.chain_names))))
+        )
+        text = json.dumps(dataclasses.asdict(normalized), sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+
+# One frame of at most chunk_rows parsed lines at a time
+def read_chunks(source, chunk_rows=CHUNK_ROWS, columns=RAW_COLUMNS):
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rb") as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                return
+            records = [loads(line) for line in lines if line.strip()]
+            yield pd.DataFrame.from_records(records, columns=columns)
+
+
+def _tag_values(chunk, key):
+    return chunk["tags"].map(
+        lambda tags: tags.get(key) if isinstance(tags, dict) else None
+    )
+
+
+# Tile of every point: its row and column of TILE_DEG cells, packed in one
+# int64 so sorting by key groups each tile's places together
+def tile_keys(lat, lon, tile_deg=TILE_DEG):
+    rows = np.floor(np.asarray(lat) / tile_deg).astype(np.int64) + _OFFSET
+    cols = np.floor(np.asarray(lon) / tile_deg).astype(np.int64) + _OFFSET
+    return rows << 32 | cols
+
+
+# The store's rows are sorted by tile. Tile i (key keys[i]) holds rows
+# offsets[i]:offsets[i + 1], so the places of a few tiles can be read from
+# the memory-mapped columns without touching the rest.
+class TileIndex:
+    def __init__(self, keys, offsets, tile_deg):
+        self.keys = keys
+        self.offsets = offsets
+        self.tile_deg = tile_deg
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def load(cls, directory):
+        meta = _read_meta(directory)
+        return cls(
+            np.load(os.path.join(directory, "tile_keys.npy")),
+            np.load(os.path.join(directory, "tile_offsets.npy")),
+            meta["tile_deg"],
+        )
+
+    # Tiles overlapping the box around a circle of radius_m around (lat, lon)
+    def within(self, lat, lon, radius_m):
+        dlat = radius_m / METERS_PER_DEG
+        dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+        first = tile_keys(lat - dlat, lon - dlon, self.tile_deg)
+        last = tile_keys(lat + dlat, lon + dlon, self.tile_deg)
+        rows, cols = self.keys >> 32, self.keys & 0xFFFFFFFF
+        inside = (
+            (rows >= first >> 32)
+            & (rows <= last >> 32)
+            & (cols >= first & 0xFFFFFFFF)
+            & (cols <= last & 0xFFFFFFFF)
+        )
+        return np.flatnonzero(inside)
+
+    # Tile of every store row
+    def tiles_of(self, rows):
+        return np.searchsorted(self.offsets, rows, side="right") - 1
+
+    # Store rows of the given tiles
+    def rows(self, tiles):
+        ranges = [
+            np.arange(self.offsets[tile], self.offsets[tile + 1]) for tile in tiles
+        ]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+
+def store_path(source, store_dir=STORE_DIR):
+    name = os.path.basename(source).split(".")[0]
+    return os.path.join(store_dir, name)
+
+
+def _source_stamp(source):
+    stat = os.stat(source)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+# Streams the JSON lines file into the store in directory. Each chunk is
+# filtered as soon as it is parsed, so only the rows kept (and one chunk) are
+# ever in memory.
+#
+# Chains: a place whose name, brand or official_name is one of chain_names
+# (after normalizing) is dropped. Brands are told apart by their
+# brand:wikidata id, else their normalized brand, else (for places without
+# brand tags, like most Blenz Coffee shops) their normalized name. A brand
+# seen on a dropped place, or on CHAIN_MIN_LOCATIONS stored places or more,
+# is a chain. So is a name that starts with one of chain_names, when a
+# dropped place of that chain had the same amenity type: "Starbucks -
+# Whiterock" is a cafe like the Starbucks, but "Scotiabank Theatre" isn't a
+# bank. Since that is only known after the last chunk, the stored places of
+# such chains are kept with is_chain set. Only stored places are counted, so
+# a refresh can take a replaced place's brand off again.
+def build_store(source, directory, filters=StoreFilters(), chunk_rows=CHUNK_ROWS):
+    chains = set(normalize_names(list(filters.chain_names)))
+    brands = Brands()
+    parts = []
+    tags = TagStoreBuilder()
+    rows_read = 0
+    for chunk in read_chunks(source, chunk_rows):
+        rows_read += len(chunk)
+        keep, brand_id, named_chain = _filter_chunk(chunk, filters, chains)
+        brands.counts.update(brand_id[keep].dropna())
+        brands.add_named_chains(chunk[named_chain], brand_id[named_chain], chains)
+        tags.add(chunk["tags"][keep])
+        parts.append(
+            chunk[keep].drop(columns="tags").assign(brand_id=brand_id[keep].to_numpy())
+        )
+
+    data = pd.concat(parts, ignore_index=True)
+    data["is_chain"] = brands.is_chain(data, chains)
+    meta = {
+        "rows_read": rows_read,
+        "source": _source_stamp(source),
+        "filters": filters.digest(),
+        "refreshes": [],
+    }
+    return write_store(directory, data, tags.build(), meta, brands)
+
+
+# How many places every brand has, which brands were seen on a place named
+# after a chain and the amenity types of those places, by chain name. Kept in
+# brands.json so a refresh can update them.
+class Brands:
+    def __init__(self, counts=None, named_chains=(), chain_types=()):
+        self.counts = Counter(counts or {})
+        self.named_chains = set(named_chains)
+        self.chain_types = {tuple(chain_type) for chain_type in chain_types}
+
+    def chains(self):
+        frequent = [b for b, n in self.counts.items() if n >= CHAIN_MIN_LOCATIONS]
+        return self.named_chains.union(frequent)
+
+    # Records the places of a chunk named after one of chains, with their
+    # brand ids
+    def add_named_chains(self, places, brand_id, chains):
+        self.named_chains.update(brand_id.dropna())
+        prefix = chain_prefixes(places["name"], chains)
+        named = prefix.notna().to_numpy()
+        self.chain_types.update(
+            zip(prefix[named], places["amenity"][named].astype(str))
+        )
+
+    # Whether every place of data (with its brand_id) is of a chain: a chain's
+    # brand, or named after one of chains with a type that chain has
+    def is_chain(self, data, chains):
+        prefix = chain_prefixes(data["name"], chains).to_numpy(dtype=object)
+        types = zip(prefix, np.asarray(data["amenity"], dtype=str))
+        of_chain = [chain_type in self.chain_types for chain_type in types]
+        return data["brand_id"].isin(self.chains()).to_numpy() | np.array(
+            of_chain, dtype=bool
+        )
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "counts": self.counts,
+                    "named_chains": sorted(self.named_chains),
+                    "chain_types": sorted(self.chain_types),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            saved = json.load(f)
+        return cls(saved["counts"], saved["named_chains"], saved["chain_types"])
+
+
+# Rows of a parsed chunk that pass filters, the brand of every row and
+# whether it is named after one of chains
+def _filter_chunk(chunk, filters, chains):
+    brand = normalize_names(_tag_values(chunk, "brand"))
+    brand_id = pd.Series(_tag_values(chunk, "brand:wikidata"), dtype="str")
+    brand_id = brand_id.fillna(brand).fillna(normalize_names(chunk["name"]))
+    named_chain = (
+        normalize_names(chunk["name"]).isin(chains).to_numpy()
+        | brand.isin(chains).to_numpy()
+        | normalize_names(_tag_values(chunk, "official_name")).isin(chains).to_numpy()
+    )
+    keep = chunk["name"].notna().to_numpy() & ~named_chain
+    if filters.amenities is not None:
+        keep &= chunk["amenity"].isin(filters.amenities).to_numpy()
+    if filters.bounds is not None:
+        min_lat, max_lat, min_lon, max_lon = filters.bounds
+        keep &= chunk["lat"].between(min_lat, max_lat).to_numpy()
+        keep &= chunk["lon"].between(min_lon, max_lon).to_numpy()
+    return keep, brand_id, named_chain
+
+
+# Writes the rows of data and their tags, sorted by tile, with the feature
+# columns derived from the tags. The files go to a temporary directory first,
+# so a process loading the store never sees half of it.
+def write_store(directory, data, tags, meta, brands):
+    keys = tile_keys(data["lat"], data["lon"])
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    data = data.iloc[order].reset_index(drop=True)
+    tags = tags.take(order)
+    features = tag_features(tags)
+    final, directory = directory, f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(directory, exist_ok=True)
+
+    for name, dtype in NUMERIC_COLUMNS.items():
+        values = data[name] if name in data.columns else features[name]
+        np.save(os.path.join(directory, f"{name}.npy"), np.asarray(values, dtype))
+    for name in STRING_COLUMNS:
+        values = data[name] if name in data.columns else features[name]
+        # Missing strings are saved as "" and read back as NaN
+        values = pd.Series(values, dtype=object).fillna("").astype(str)
+        np.save(os.path.join(directory, f"{name}.npy"), values.to_numpy(dtype=str))
+    categories = {}
+    for name in CATEGORY_COLUMNS:
+        values = data[name] if name in data.columns else features[name]
+        values = pd.Categorical(values)
+        categories[name] = list(values.categories)
+        np.save(os.path.join(directory, f"{name}.npy"), values.codes.astype(np.int16))
+    tags.save(os.path.join(directory, "tags"))
+    Coordinates.from_frame(data).save(directory)
+    brands.save(os.path.join(directory, "brands.json"))
+    tile_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    np.save(os.path.join(directory, "tile_keys.npy"), keys[tile_starts])
+    np.save(
+        os.path.join(directory, "tile_offsets.npy"),
+        np.r_[tile_starts, len(keys)].astype(np.int64),
+    )
+
+    meta = dict(
+        meta,
+        version=VERSION,
+        rows=len(data),
+        categories=categories,
+        tile_deg=TILE_DEG,
+        tiles=len(tile_starts),
+    )
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(final, ignore_errors=True)
+    try:
+        os.replace(directory, final)
+    except OSError:
+        # Another process built the same store at the same time
+        shutil.rmtree(directory, ignore_errors=True)
+    return meta
+
+
+# Places are matched by position (to about 1 cm) and amenity type, since the
+# extracts carry no OSM ids. A renamed place is still the same place.
+def _identities(data):
+    return pd.DataFrame(
+        {
+            "lat_e7": np.rint(np.asarray(data["lat"], dtype=float) * 1e7),
+            "lon_e7": np.rint(np.asarray(data["lon"], dtype=float) * 1e7),
+            "amenity": np.asarray(data["amenity"], dtype=object),
+            "time": pd.to_datetime(
+                data["timestamp"], utc=True, errors="coerce", format="ISO8601"
+            ).to_numpy(),
+        }
+    )
+
+
+# Applies a newer extract or a diff of one (JSON lines like the source; a line
+# with "deleted": true removes its place) to the store in directory. A place
+# of the update replaces the stored places with the same identity when it is
+# newer than all of them, or is added when there are none, and then has to
+# pass filters like any other. Only the update is parsed: the stored rows and
+# tags are reused, and only the replaced and added places' tiles change.
+def refresh_store(directory, update, filters=StoreFilters(), chunk_rows=CHUNK_ROWS):
+    meta = _read_meta(directory)
+    if meta is None or meta.get("version") != VERSION:
+        raise ValueError(f"No current amenity store in {directory}, build it first")
+    if meta["filters"] != filters.digest():
+        raise ValueError("The store was built with other filters, rebuild it")
+    data = load_store(directory)
+    brands = Brands.load(os.path.join(directory, "brands.json"))
+    chains = set(normalize_names(list(filters.chain_names)))
+    stored = _identities(data).assign(row=np.arange(len(data)))
+    replaced = np.zeros(len(data), dtype=bool)
+    parts = []
+    tags = TagStoreBuilder()
+    rows_read = 0
+    for chunk in read_chunks(update, chunk_rows, RAW_COLUMNS + ["deleted"]):
+        rows_read += len(chunk)
+        keep, brand_id, named_chain = _filter_chunk(chunk, filters, chains)
+        matches = (
+            _identities(chunk)
+            .assign(position=np.arange(len(chunk)))
+            .merge(stored, on=["lat_e7", "lon_e7", "amenity"], how="left")
+        )
+        # NaT (no timestamp) compares as older than anything
+        matches["newer"] = (
+            matches["row"].isna()
+            | (matches["time_x"] > matches["time_y"]).to_numpy()
+            | matches["time_y"].isna()
+        )
+        newer = matches.groupby("position")["newer"].all().to_numpy()
+        rows = matches.loc[
+            matches["newer"].to_numpy() & newer[matches["position"]], "row"
+        ]
+        replaced[rows.dropna().astype(np.int64)] = True
+
+        deleted = chunk["deleted"].eq(True).to_numpy()
+        named = newer & named_chain
+        brands.add_named_chains(chunk[named], brand_id[named], chains)
+        keep &= newer & ~deleted
+        brands.counts.update(brand_id[keep].dropna())
+        tags.add(chunk["tags"][keep])
+        parts.append(
+            chunk[keep]
+            .drop(columns=["tags", "deleted"])
+            .assign(brand_id=brand_id[keep].to_numpy())
+        )
+
+    brands.counts.subtract(data["brand_id"][replaced].dropna())
+    brands.counts = +brands.counts  # Drops brands with no places left
+    kept = np.flatnonzero(~replaced)
+    added = pd.concat(parts, ignore_index=True)
+    columns = [name for name in RAW_COLUMNS if name != "tags"] + ["brand_id"]
+    combined = pd.concat([data.iloc[kept][columns], added], ignore_index=True)
+    combined["is_chain"] = brands.is_chain(combined, chains)
+    changed = np.r_[
+        tile_keys(data["lat"][replaced], data["lon"][replaced]),
+        tile_keys(added["lat"], added["lon"]),
+    ]
+    refresh = {
+        "update": os.path.abspath(update),
+        "update_stamp": _source_stamp(update),
+        "rows_read": rows_read,
+        "removed": int(replaced.sum()),
+        "added": len(added),
+        "tiles_changed": len(np.unique(changed)),
+    }
+    meta = dict(meta, refreshes=meta["refreshes"] + [refresh])
+    all_tags = load_tags(directory).take(kept).concat(tags.build())
+    write_store(directory, combined, all_tags, meta, brands)
+    return refresh
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# filters=None doesn't check which filters the store was built with
+def is_current(source, directory, filters=None):
+    meta = _read_meta(directory)
+    return (
+        meta is not None
+        and meta.get("version") == VERSION
+        and meta.get("source") == _source_stamp(source)
+        and (filters is None or meta["filters"] == filters.digest())
+    )
+
+
+# Frame of every row of the store, or of the given rows only (read from the
+# memory-mapped columns). Either way the index is the store row.
+def load_store(directory, rows=None):
+    meta = _read_meta(directory)
+
+    def column(name):
+        if rows is None:
+            return np.load(os.path.join(directory, f"{name}.npy"))
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")[rows]
+
+    columns = {}
+    for name in NUMERIC_COLUMNS:
+        columns[name] = column(name)
+    for name in STRING_COLUMNS:
+        values = column(name).astype(object)
+        values[values == ""] = np.nan
+        columns[name] = values
+    for name in CATEGORY_COLUMNS:
+        columns[name] = pd.Categorical.from_codes(
+            column(name), meta["categories"][name]
+        )
+    return pd.DataFrame(columns, index=rows)
+
+
+# Tags of the store's rows, memory-mapped. Row i of the store is index i of
+# the frame load_store() returns, which filtering keeps.
+def load_tags(directory):
+    return TagStore.load(os.path.join(directory, "tags"))
+
+
+# Coordinates of the store's rows, memory-mapped. Row i is index i of the
+# frame load_store() returns.
+def load_coordinates(directory):
+    return Coordinates.load(directory)
+
+
+# Store for source, built (or rebuilt, when source or the filters changed) on
+# first use. log gets the progress message.
+def load_or_build_store(source, store_dir=STORE_DIR, filters=StoreFilters(), log=print):
+    directory = store_path(source, store_dir)
+    if not is_current(source, directory, filters):
+        log(f"Preprocessing {source}...")
+        build_store(source, directory, filters)
+    return load_store(directory)
+
+
+def load_or_build_tags(source, store_dir=STORE_DIR, filters=StoreFilters()):
+    directory = store_path(source, store_dir)
+    if not is_current(source, directory, filters):
+        build_store(source, directory, filters)
+    return load_tags(directory)
+
+
+def load_or_build_tile_index(source, store_dir=STORE_DIR, filters=StoreFilters()):
+    directory = store_path(source, store_dir)
+    if not is_current(source, directory, filters):
+        print(f"Preprocessing {source}...")
+        build_store(source, directory, filters)
+    return TileIndex.load(directory)
+
+
+def load_or_build_coordinates(source, store_dir=STORE_DIR, filters=StoreFilters()):
+    directory = store_path(source, store_dir)
+    if not is_current(source, directory, filters):
+        print(f"Preprocessing {source}...")
+        build_store(source, directory, filters)
+    return load_coordinates(directory)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the amenity store")
+    parser.add_argument("source", nargs="?", default="amenities-vancouver.json.gz")
+    parser.add_argument("--store-dir", default=STORE_DIR)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument(
+        "--refresh",
+        metavar="UPDATE",
+        help="apply a newer extract or diff (JSON lines) to the existing store",
+    )
+    args = parser.parse_args()
+    from main import amenity_store_filters
+
+    directory = store_path(args.source, args.store_dir)
+    if args.refresh:
+        refresh = refresh_store(
+            directory, args.refresh, amenity_store_filters(), args.chunk_rows
+        )
+        print(
+            f"Refreshed {directory} from {refresh['rows_read']} places: "
+            f"{refresh['removed']} removed or replaced, {refresh['added']} added, "
+            f"{refresh['tiles_changed']} tiles changed"
+        )
+    else:
+        meta = build_store(
+            args.source, directory, amenity_store_filters(), args.chunk_rows
+        )
+        print(f"Stored {meta['rows']} of {meta['rows_read']} amenities in {directory}")
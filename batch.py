@@ -0,0 +1,422 @@
+# Batch mode: plans many tours from a JSON lines file
+#
+# Each line is one tour request, for example
+#   {"id": "downtown-food", "tour_length": 2, "theme": "food",
+#    "num_amenities": 10, "address": "800 Robson St Vancouver BC",
+#    "transportation": "walk", "rental": "no", "hotel": true}
+# Coordinates can be given as "coordinates": [lat, lon] instead of an address,
+# and places the tour has to visit as "must_visit": ["Science World", ...].
+#
+# The amenity data, OpenStreetMap downloads and street graphs are loaded once
+# and reused by every request, so each extra tour only costs its planning.
+#
+# With --workers, requests are planned in parallel by a pool of processes. The
+# parent loads everything once and writes the street graphs (as CompactGraph
+# arrays) and the amenity columns to .npy files in a temporary directory;
+# workers memory-map them, so they share one copy instead of each holding its
+# own graph. Must-visit places are looked up once in the parent too, and only
+# their rows are shared, so no worker loads the whole amenity store or builds
+# the name index.
+#
+import argparse
+import dataclasses
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import numpy as np
+import pandas as pd
+
+from compact_graph import CompactGraph
+from coordinates import Coordinates
+from main import SOLVERS, geocode, save_tour
+from plan_cache import CachedPlanner, PlanCache
+from planner import TourPlanner, TourRequest
+
+
+# Batches often start many tours from the same address
+@lru_cache(maxsize=None)
+def locate(address):
+    return geocode(address)
+
+
+def _positive_int(raw, field):
+    try:
+        value = int(raw[field])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"'{field}' must be a positive integer") from None
+    if value <= 0:
+        raise ValueError(f"'{field}' must be a positive integer")
+    return value
+
+
+# [lat, lon] as a pair of floats
+def _coordinates(value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError("'coordinates' must be [lat, lon]")
+    try:
+        return tuple(float(part) for part in value)
+    except (TypeError, ValueError):
+        raise ValueError("'coordinates' must be [lat, lon]") from None
+
+
+def _yes_no(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() == "yes"
+
+
+# Checks one request the same way input_field() checks answers, and returns
+# it as a TourRequest with the start location resolved to coordinates.
+# options (solver, score, deadline_ms, ...) are the same for the whole batch.
+def parse_request(raw, options=None):
+    if not isinstance(raw, dict):
+        raise ValueError("a request must be a JSON object")
+    tour_length = _positive_int(raw, "tour_length")
+    num_amenities = _positive_int(raw, "num_amenities")
+    theme = str(raw.get("theme", "random")).strip().lower()
+    transportation = str(raw.get("transportation", "walk")).strip().lower()
+
+    if "coordinates" in raw:
+        start_coords = _coordinates(raw["coordinates"])
+    elif "address" in raw:
+        if not isinstance(raw["address"], str):
+            raise ValueError("'address' must be a string")
+        start_coords = locate(raw["address"])
+        if start_coords is None:
+            raise ValueError(f"could not find address {raw['address']!r}")
+    else:
+        raise ValueError("either 'address' or 'coordinates' is required")
+
+    must_visit = raw.get("must_visit", [])
+    if isinstance(must_visit, (str, int)):
+        must_visit = [must_visit]
+    if not isinstance(must_visit, list):
+        raise ValueError("'must_visit' must be a list of place names or ids")
+
+    request = TourRequest(
+        tour_length,
+        theme,
+        num_amenities,
+        start_coords,
+        transportation,
+        want_rental=_yes_no(raw.get("rental", "no")),
+        stay_hotel=_yes_no(raw.get("hotel", False)),
+        must_visit=tuple(must_visit),
+        **(options or {}),
+    )
+    request.validate()
+    return request
+
+
+# Numeric and string columns of an amenity frame as .npy files, and its
+# Coordinates for find_nearest_amenities(). The tags dicts are not shared; the
+# scores only need their tag count and Wikidata link, which frames from the
+# amenity store already have as columns.
+FRAME_COLUMNS = ["lat", "lon", "tag_count", "has_wikidata", "name", "amenity", "row"]
+
+
+def _save_frame(frame, directory):
+    os.makedirs(directory, exist_ok=True)
+    if frame is None:
+        return
+    columns = {"lat": frame["lat"], "lon": frame["lon"], "name": frame["name"]}
+    if "amenity" in frame.columns:
+        columns["amenity"] = frame["amenity"]
+        # Amenity store row, to find the frame's places by tile
+        columns["row"] = frame.index.to_series()
+    if "tag_count" in frame.columns:
+        columns["tag_count"] = frame["tag_count"]
+        columns["has_wikidata"] = frame["has_wikidata"]
+    elif "tags" in frame.columns:
+        columns["tag_count"] = frame["tags"].apply(len)
+        columns["has_wikidata"] = frame["tags"].apply(
+            lambda tags: "wikidata" in tags or "brand:wikidata" in tags
+        )
+    for name, column in columns.items():
+        values = column.to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+    Coordinates.from_frame(frame).save(directory)
+
+
+# Frame over the memory-mapped columns, None if none were saved. Numeric
+# columns stay backed by the mapped files.
+def _load_frame(directory):
+    columns = {}
+    for name in FRAME_COLUMNS:
+        path = os.path.join(directory, f"{name}.npy")
+        if os.path.exists(path):
+            columns[name] = np.load(path, mmap_mode="r")
+    if not columns:
+        return None
+    return pd.DataFrame(columns, copy=False)
+
+
+# TourPlanner reading what the parent process saved instead of loading it
+class SharedPlanner(TourPlanner):
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def _frame(self, name):
+        return self._load(
+            ("frame", name), lambda: _load_frame(os.path.join(self.directory, name))
+        )
+
+    def restaurants(self, log=print):
+        frame = self._frame("restaurants")
+        return frame if frame is not None else pd.DataFrame()
+
+    def rentals(self, log=print):
+        frame = self._frame("rentals")
+        return frame if frame is not None else pd.DataFrame()
+
+    def lodging(self, log=print):
+        return self._frame("lodging")
+
+    def candidates(self, theme):
+        return self._frame(f"candidates-{theme}")
+
+    # Requests reach the workers with their must-visit places as amenity
+    # indexes (see _resolve_must_visit), read from the shared rows. Any other
+    # request is looked up like in the parent.
+    def must_visit(self, request):
+        shared = self._frame("must_visit")
+        places = list(request.must_visit)
+        if shared is None or not places:
+            return super().must_visit(request)
+        if not all(isinstance(place, int) for place in places):
+            return super().must_visit(request)
+        rows = pd.Index(shared["row"]).get_indexer(places)
+        if (rows < 0).any():
+            return super().must_visit(request)
+        return shared.iloc[rows]
+
+    # Saved with the candidates, by position like the loaded frame's index
+    def coordinates(self, theme):
+        return self._load(
+            ("coordinates", theme),
+            lambda: Coordinates.load(
+                os.path.join(self.directory, f"candidates-{theme}")
+            ),
+        )
+
+    # The shared candidates in the tiles, picked by their store row, so
+    # nearby_candidates() chooses the same ones as in the parent
+    def _tile_candidates(self, theme, tiles):
+        candidates = self.candidates(theme)
+        in_tiles = np.isin(self.tile_index().tiles_of(candidates["row"]), tiles)
+        return candidates[in_tiles]
+
+    def graph(self, transportation, log=print):
+        return self._load(
+            ("graph", transportation),
+            lambda: CompactGraph.load(
+                os.path.join(self.directory, f"graph-{transportation}")
+            ),
+        )
+
+
+# The request with its must-visit places as the amenity indexes they resolve
+# to. Unchanged when one can't be found, so the worker planning it reports why.
+def _resolve_must_visit(planner, request):
+    if not request.must_visit:
+        return request
+    try:
+        rows = planner.must_visit(request).index
+    except ValueError:
+        return request
+    return dataclasses.replace(request, must_visit=tuple(int(row) for row in rows))
+
+
+# Rows of the amenities the requests' must-visit indexes point at, for
+# SharedPlanner.must_visit()
+def _share_must_visit(planner, requests, directory):
+    rows = {
+        place
+        for request in requests
+        for place in request.must_visit
+        if isinstance(place, int)
+    }
+    if rows:
+        amenities = planner.amenities()
+        rows = [row for row in sorted(rows) if row in amenities.index]
+        _save_frame(amenities.loc[rows], os.path.join(directory, "must_visit"))
+
+
+# Writes everything the requests need into directory, loading each part once
+def share_planner(planner, requests, directory):
+    if not all(request.schedule_only for request in requests):
+        _save_frame(planner.restaurants(), os.path.join(directory, "restaurants"))
+    if any(request.want_rental for request in requests):
+        _save_frame(planner.rentals(), os.path.join(directory, "rentals"))
+    if any(request.stay_hotel for request in requests):
+        _save_frame(planner.lodging(), os.path.join(directory, "lodging"))
+    for theme in {request.theme for request in requests}:
+        _save_frame(
+            planner.candidates(theme), os.path.join(directory, f"candidates-{theme}")
+        )
+    _share_must_visit(planner, requests, directory)
+    for mode in {request.transportation for request in requests}:
+        print(f"Sharing {mode} street network with the workers...")
+        compact = CompactGraph.from_networkx(planner.graph(mode))
+        compact.save(os.path.join(directory, f"graph-{mode}"))
+
+
+# Parses every line of the file, reporting and dropping bad requests
+def read_requests(requests_path, options=None):
+    requests = []
+    with open(requests_path) as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+                request_id = str(line_no)
+                if isinstance(raw, dict):
+                    request_id = str(raw.get("id", line_no))
+                requests.append((request_id, parse_request(raw, options)))
+            except ValueError as e:
+                print(f"Skipping request on line {line_no}: {e}")
+    return requests
+
+
+# True if the tour was planned and saved. Any error is reported and only
+# fails this request, in the serial and the parallel batch alike.
+def plan_and_save(planner, request_id, request, out_dir):
+    print(f"Planning tour {request_id}...")
+    try:
+        itinerary = planner.plan(request)
+        if itinerary.truncated:
+            print(
+                f"Tour {request_id}: deadline reached, best-so-far results "
+                "were used for: " + ", ".join(itinerary.truncated)
+            )
+        save_tour(
+            itinerary,
+            map_path=os.path.join(out_dir, f"{request_id}_map.html"),
+            csv_path=os.path.join(out_dir, f"{request_id}_schedule.csv"),
+        )
+    except Exception as e:
+        print(f"Error planning tour {request_id}: {e}")
+        return False
+    return True
+
+
+# Set in each worker process by _init_worker
+_shared = None
+
+
+def _init_worker(directory, plan_cache=None):
+    global _shared
+    _shared = SharedPlanner(directory)
+    if plan_cache:
+        _shared = CachedPlanner(_shared, PlanCache(cache_dir=plan_cache))
+
+
+def _plan_shared(request_id, request, out_dir):
+    return plan_and_save(_shared, request_id, request, out_dir)
+
+
+# Plans every request in the file and writes <id>_schedule.csv and
+# <id>_map.html for each one into out_dir. A bad request is reported and
+# skipped without stopping the rest of the batch. With plan_cache (a
+# directory), starts are snapped to a small grid and equivalent requests reuse
+# one plan, also across runs.
+def run_batch(requests_path, out_dir="tours", planner=None, plan_cache=None, **options):
+    planner = planner or TourPlanner()
+    if plan_cache:
+        planner = CachedPlanner(planner, PlanCache(cache_dir=plan_cache))
+    os.makedirs(out_dir, exist_ok=True)
+    requests = read_requests(requests_path, options)
+    planned = 0
+    for request_id, request in requests:
+        planned += plan_and_save(planner, request_id, request, out_dir)
+
+    print(f"Planned {planned} tours into {out_dir}/")
+    if plan_cache:
+        print(f"Plan cache: {planner.cache.stats()}")
+    return planned
+
+
+# Same outputs as run_batch, with the requests spread over worker processes
+# that share the parent's graphs and amenities through memory-mapped files.
+# Workers share plan_cache through its directory only, so equivalent requests
+# planned at the same time in two workers are both computed.
+def run_batch_parallel(
+    requests_path,
+    out_dir="tours",
+    workers=None,
+    planner=None,
+    plan_cache=None,
+    **options,
+):
+    planner = planner or TourPlanner()
+    os.makedirs(out_dir, exist_ok=True)
+    requests = read_requests(requests_path, options)
+    if not requests:
+        print(f"Planned 0 tours into {out_dir}/")
+        return 0
+    requests = [
+        (request_id, _resolve_must_visit(planner, request))
+        for request_id, request in requests
+    ]
+
+    with tempfile.TemporaryDirectory(prefix="tour-share-") as directory:
+        share_planner(planner, [request for _, request in requests], directory)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(directory, plan_cache),
+        ) as pool:
+            done = pool.map(
+                _plan_shared,
+                [request_id for request_id, _ in requests],
+                [request for _, request in requests],
+                [out_dir] * len(requests),
+            )
+            planned = sum(done)
+
+    print(f"Planned {planned} tours into {out_dir}/")
+    return planned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan many tours from a JSONL file")
+    parser.add_argument("requests", help="JSON lines file with one tour per line")
+    parser.add_argument("--out", default="tours", help="directory for the outputs")
+    parser.add_argument("--solver", choices=SOLVERS, default="nearest")
+    parser.add_argument("--score", default="tags")
+    parser.add_argument("--deadline-ms", type=int, default=None)
+    parser.add_argument("--restarts", type=int, default=1)
+    parser.add_argument("--travel-matrix", action="store_true")
+    parser.add_argument(
+        "--plan-cache",
+        default=None,
+        help="directory of finished plans to reuse for equivalent requests",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="plan tours in this many processes sharing one copy of the graphs",
+    )
+    args = parser.parse_args()
+    run = run_batch
+    if args.workers is not None:
+        run = partial(run_batch_parallel, workers=args.workers)
+    run(
+        args.requests,
+        args.out,
+        plan_cache=args.plan_cache,
+        solver=args.solver,
+        score=args.score,
+        deadline_ms=args.deadline_ms,
+        restarts=args.restarts,
+        use_travel_matrix=args.travel_matrix,
+    )
@@ -0,0 +1,168 @@
+# Benchmarks for every planning stage at scaled sizes
+#
+# Times each stage on seeded offline fixtures (see fixtures.py) at several
+# numbers of POIs or stops, and compares the results with planner_baseline.json.
+# A case more than --threshold slower than its baseline is reported as a
+# regression and the script exits with status 1.
+#
+#   python benchmarks/bench_planner.py                 compare with the baseline
+#   python benchmarks/bench_planner.py --update        record a new baseline
+#   python benchmarks/bench_planner.py --only daily    run matching cases only
+#   python benchmarks/bench_planner.py --quick         skip the largest sizes
+#
+# Baselines are only comparable on the machine that recorded them.
+#
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtures  # noqa: E402
+from main import (  # noqa: E402
+    create_tour_map,
+    daily_schedule,
+    filter_amenities_by_theme,
+    filter_popular_amenities,
+    find_nearest_amenities,
+    get_street_route,
+)
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "planner_baseline.json"
+)
+POI_SIZES = [1_000, 17_000, 170_000]
+STOP_SIZES = [10, 100, 1_000]
+# Cases this big are skipped by --quick
+QUICK_LIMIT = 20_000
+# Each case is repeated until it has run this long (or MAX_REPEATS times)
+MIN_SECONDS = 0.5
+MAX_REPEATS = 5
+
+
+# daily_schedule arguments for a walking tour long enough that no stop is cut
+# off at the end
+def _schedule_args(stops, seed):
+    route_points, chosen = fixtures.tour(stops, seed)
+    return route_points, chosen, "walk", stops // 8 + 1, None
+
+
+# name -> (sizes, setup(size, seed) -> args, stage(*args))
+def cases(graph):
+    return {
+        "filter_amenities_by_theme": (
+            POI_SIZES,
+            lambda size, seed: (fixtures.pois(size, seed), "food"),
+            filter_amenities_by_theme,
+        ),
+        "filter_popular_amenities": (
+            POI_SIZES,
+            lambda size, seed: (fixtures.pois(size, seed),),
+            filter_popular_amenities,
+        ),
+        "find_nearest_amenities/10_stops": (
+            POI_SIZES,
+            lambda size, seed: (fixtures.pois(size, seed), fixtures.START, 10),
+            find_nearest_amenities,
+        ),
+        "find_nearest_amenities/1000_pois": (
+            STOP_SIZES,
+            lambda size, seed: (fixtures.pois(1_000, seed), fixtures.START, size),
+            find_nearest_amenities,
+        ),
+        "daily_schedule": (
+            STOP_SIZES,
+            _schedule_args,
+            daily_schedule,
+        ),
+        "get_street_route": (
+            STOP_SIZES,
+            lambda size, seed: (graph, fixtures.tour(size, seed)[0]),
+            get_street_route,
+        ),
+        "create_tour_map": (
+            STOP_SIZES,
+            lambda size, seed: (
+                daily_schedule(*_schedule_args(size, seed)),
+                fixtures.tour(size, seed)[0],
+            ),
+            create_tour_map,
+        ),
+    }
+
+
+# Best time of several runs, the least disturbed by everything else running
+def time_case(setup, run, size, seed):
+    args = setup(size, seed)
+    times = []
+    while len(times) < MAX_REPEATS and sum(times) < MIN_SECONDS:
+        started = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main(only=None, quick=False, update=False, threshold=0.25, seed=0, graph=None):
+    results = {}
+    street_graph = fixtures.street_graph(graph, seed)
+    for name, (sizes, setup, run) in cases(street_graph).items():
+        if only and only not in name:
+            continue
+        for size in sizes:
+            if quick and size > QUICK_LIMIT:
+                continue
+            key = f"{name}[{size}]"
+            results[key] = time_case(setup, run, size, seed)
+            print(f"{key:48} {results[key] * 1000:10.1f} ms", flush=True)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if update:
+        baseline.update({key: round(seconds, 6) for key, seconds in results.items()})
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"Baseline updated for {len(results)} cases")
+        return 0
+
+    regressions = []
+    for key, seconds in results.items():
+        if key not in baseline:
+            continue
+        change = seconds / baseline[key] - 1
+        if change > threshold:
+            regressions.append((key, baseline[key], seconds, change))
+    for key, before, after, change in regressions:
+        print(
+            f"Regression: {key} {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+            f"(+{change:.0%})"
+        )
+    if not regressions:
+        print(f"No case more than {threshold:.0%} slower than the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Planner stage benchmarks")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="slowdown over the baseline reported as a regression (0.25 = 25%%)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--graph", help="saved osmnx graph (GraphML) instead of the synthetic grid"
+    )
+    args = parser.parse_args()
+    sys.exit(
+        main(args.only, args.quick, args.update, args.threshold, args.seed, args.graph)
+    )
@@ -0,0 +1,89 @@
+# Offline, seeded inputs for the planner benchmarks
+#
+# POIs are sampled from the amenity store of amenities-vancouver.json.gz, so
+# they carry its feature columns and the amenity_bits load_amenities() adds:
+# smaller sizes are a random subset, larger ones repeat rows with a few metres
+# of jitter so the set keeps the city's real density and tag mix. The street
+# network is a synthetic grid over downtown Vancouver unless a saved osmnx
+# graph (GraphML) is given, so nothing is downloaded.
+#
+import math
+import os
+
+import networkx as nx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AMENITIES_PATH = os.path.join(ROOT, "amenities-vancouver.json.gz")
+START = (49.2827, -123.1207)  # Downtown Vancouver
+JITTER_DEG = 0.0005
+
+_amenities = None
+
+
+def amenities():
+    global _amenities
+    if _amenities is None:
+        from amenity_store import load_or_build_store
+        from main import amenity_bits, amenity_store_filters
+
+        _amenities = load_or_build_store(
+            AMENITIES_PATH,
+            os.path.join(ROOT, "amenity_store"),
+            amenity_store_filters(),
+        )
+        _amenities["amenity_bits"] = amenity_bits(_amenities)
+    return _amenities
+
+
+def pois(size, seed=0):
+    data = amenities()
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(data), size=size, replace=size > len(data))
+    sample = data.iloc[rows].reset_index(drop=True)
+    if size > len(data):
+        sample["lat"] += rng.uniform(-JITTER_DEG, JITTER_DEG, size)
+        sample["lon"] += rng.uniform(-JITTER_DEG, JITTER_DEG, size)
+    return sample
+
+
+# Named amenities near the start, in visiting order, with the start prepended
+# to the route points the way plan_stops() builds them
+def tour(stops, seed=0):
+    data = pois(max(stops * 4, 1000), seed)
+    data = data[~data["name"].isna()]
+    distance = np.hypot(data["lat"] - START[0], data["lon"] - START[1])
+    chosen = data.loc[distance.nsmallest(stops).index].reset_index(drop=True)
+    route_points = [list(START)] + chosen[["lat", "lon"]].values.tolist()
+    return route_points, chosen
+
+
+# Grid of size x size intersections, about 200 m apart, around the start.
+# Edge lengths vary by up to 30% like real blocks.
+def grid_graph(size=80, step=0.002, seed=0):
+    rng = np.random.default_rng(seed)
+    lat0 = START[0] - step * size / 2
+    lon0 = START[1] - step * size / 2
+    G = nx.MultiGraph()
+    G.graph["crs"] = "epsg:4326"
+    for i in range(size):
+        for j in range(size):
+            G.add_node(i * size + j, y=lat0 + i * step, x=lon0 + j * step)
+    north = step * 111_195
+    east = north * math.cos(math.radians(START[0]))
+    for i in range(size):
+        for j in range(size):
+            node = i * size + j
+            if i + 1 < size:
+                G.add_edge(node, node + size, length=north * rng.uniform(1, 1.3))
+            if j + 1 < size:
+                G.add_edge(node, node + 1, length=east * rng.uniform(1, 1.3))
+    return G
+
+
+def street_graph(graphml_path=None, seed=0):
+    if graphml_path:
+        import osmnx as ox
+
+        return ox.load_graphml(graphml_path).to_undirected()
+    return grid_graph(seed=seed)
@@ -0,0 +1,93 @@
+# Start-up time benchmark for the CLI entry point
+#
+# Runs `python -X importtime -c "import main"` a few times and compares the
+# median import time of main.py with the budget in startup_budget.json. It
+# also fails if any of the modules main.py must only import on first use
+# (folium, osmnx, ...) got imported at start-up.
+#
+#   python benchmarks/startup.py            check against the budget
+#   python benchmarks/startup.py --update   record the current time as budget
+#
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "startup_budget.json"
+)
+# Room left above the measured time when recording a new budget
+HEADROOM = 1.5
+
+
+# {module: (self_us, cumulative_us)} from one run of -X importtime
+def import_times(entry):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(entry, runs):
+    # The first run writes the .pyc files, it isn't timed
+    import_times(entry)
+    samples = [import_times(entry) for _ in range(runs)]
+    total_ms = statistics.median(s[entry][1] for s in samples) / 1000
+    return total_ms, samples[-1]
+
+
+def main(runs=5, update=False):
+    with open(BUDGET_PATH) as f:
+        budget = json.load(f)
+    entry = budget["entry"]
+    total_ms, times = measure(entry, runs)
+
+    print(f"import {entry}: {total_ms:.0f} ms (median of {runs})")
+    slowest = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (_, cumulative_us) in slowest[1:11]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if update:
+        budget["max_ms"] = round(total_ms * HEADROOM)
+        with open(BUDGET_PATH, "w") as f:
+            json.dump(budget, f, indent=2)
+            f.write("\n")
+        print(f"Budget set to {budget['max_ms']} ms")
+        return 0
+
+    failed = False
+    if total_ms > budget["max_ms"]:
+        print(f"Over budget: {total_ms:.0f} ms > {budget['max_ms']} ms")
+        failed = True
+    eager = sorted(
+        name
+        for name in times
+        if name.split(".")[0] in budget["lazy_modules"] and "." not in name
+    )
+    if eager:
+        print("Imported at start-up but should be lazy: " + ", ".join(eager))
+        failed = True
+    if not failed:
+        print(f"Within budget of {budget['max_ms']} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start-up import time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--update", action="store_true")
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.update))
@@ -0,0 +1,223 @@
+# Compact street graph stored as flat arrays
+#
+# A networkx graph of Metro Vancouver takes hundreds of MB of Python objects
+# per process. CompactGraph keeps the same network as a few numpy arrays in
+# CSR form (node coordinates, edge offsets, edge targets, edge lengths) plus a
+# sorted grid for nearest-node lookups. Saved as .npy files, the arrays can be
+# memory-mapped by any number of worker processes, which then share one copy
+# through the page cache instead of each building its own graph.
+#
+import heapq
+import json
+import math
+import os
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+GRID_CELL_DEG = 0.002  # About 200 m north-south
+_OFFSET = 1 << 30
+ARRAYS = [
+    "node_ids",
+    "lat",
+    "lon",
+    "indptr",
+    "indices",
+    "lengths",
+    "grid_keys",
+    "grid_order",
+]
+
+
+def _grid_keys(lat, lon, cell_lat, cell_lon):
+    rows = np.floor(np.asarray(lat) / cell_lat).astype(np.int64) + _OFFSET
+    cols = np.floor(np.asarray(lon) / cell_lon).astype(np.int64) + _OFFSET
+    return rows << 32 | cols
+
+
+class CompactGraph:
+    def __init__(self, arrays, cell_lat, cell_lon):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.cell_lat = cell_lat
+        self.cell_lon = cell_lon
+        self.lat_rad = None
+
+    def __len__(self):
+        return len(self.lat)
+
+    # Builds the arrays from an (undirected) osmnx graph. Parallel edges keep
+    # the shortest length, like nx.shortest_path with weight="length".
+    @classmethod
+    def from_networkx(cls, G):
+        node_ids = np.array(list(G.nodes), dtype=np.int64)
+        position = {node: i for i, node in enumerate(G.nodes)}
+        lat = np.array([G.nodes[n]["y"] for n in G.nodes], dtype=np.float64)
+        lon = np.array([G.nodes[n]["x"] for n in G.nodes], dtype=np.float64)
+
+        best = {}
+        for u, v, data in G.edges(data=True):
+            a, b = position[u], position[v]
+            length = float(data.get("length", 0.0))
+            for key in ((a, b), (b, a)):
+                if length < best.get(key, math.inf):
+                    best[key] = length
+        edges = np.array(sorted(best), dtype=np.int64).reshape(-1, 2)
+        lengths = np.array([best[tuple(e)] for e in edges.tolist()], dtype=np.float32)
+        counts = np.bincount(edges[:, 0], minlength=len(node_ids))
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        cell_lat = GRID_CELL_DEG
+        cell_lon = GRID_CELL_DEG / math.cos(math.radians(lat.mean() if len(lat) else 0))
+        keys = _grid_keys(lat, lon, cell_lat, cell_lon)
+        order = np.argsort(keys, kind="stable")
+
+        arrays = {
+            "node_ids": node_ids,
+            "lat": lat,
+            "lon": lon,
+            "indptr": indptr,
+            "indices": edges[:, 1].astype(np.int32),
+            "lengths": lengths,
+            "grid_keys": keys[order],
+            "grid_order": order.astype(np.int64),
+        }
+        return cls(arrays, cell_lat, cell_lon)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"cell_lat": self.cell_lat, "cell_lon": self.cell_lon}, f)
+
+    # mmap_mode="r" maps the files instead of reading them, so every process
+    # that loads the same directory shares the same physical pages
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAYS
+        }
+        return cls(arrays, meta["cell_lat"], meta["cell_lon"])
+
+    def _meters_to(self, lat, lon, nodes):
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2 = np.radians(self.lat[nodes])
+        lon2 = np.radians(self.lon[nodes])
+        h = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(h))
+
+    # Closest node to (lat, lon) and its distance in meters. Searches grid
+    # cells ring by ring, then one ring more to catch closer corner nodes.
+    def nearest_node(self, lat, lon, max_rings=50):
+        key = int(_grid_keys(lat, lon, self.cell_lat, self.cell_lon))
+        row, col = key >> 32, key & 0xFFFFFFFF
+        found = []
+        stop_at = None
+        for ring in range(max_rings + 1):
+            for r in range(row - ring, row + ring + 1):
+                edge_row = r in (row - ring, row + ring)
+                cols = (
+                    range(col - ring, col + ring + 1)
+                    if edge_row
+                    else (col - ring, col + ring)
+                )
+                for c in cols:
+                    cell = r << 32 | c
+                    lo = np.searchsorted(self.grid_keys, cell, side="left")
+                    hi = np.searchsorted(self.grid_keys, cell, side="right")
+                    if hi > lo:
+                        found.append(self.grid_order[lo:hi])
+            if stop_at is not None:
+                break
+            if found:
+                stop_at = ring + 1
+
+        nodes = np.concatenate(found) if found else np.arange(len(self.lat))
+        meters = self._meters_to(lat, lon, nodes)
+        best = int(np.argmin(meters))
+        return int(nodes[best]), float(meters[best])
+
+    def nearest_nodes(self, lats, lons, max_rings=50):
+        pairs = [self.nearest_node(lat, lon, max_rings) for lat, lon in zip(lats, lons)]
+        nodes = np.array([node for node, _ in pairs], dtype=np.int64)
+        meters = np.array([dist for _, dist in pairs], dtype=np.float64)
+        return nodes, meters
+
+    def _neighbours(self, u):
+        start, end = self.indptr[u], self.indptr[u + 1]
+        return zip(self.indices[start:end].tolist(), self.lengths[start:end].tolist())
+
+    # A* search by length with the great-circle distance as heuristic.
+    # Returns (meters, [node, ...]) or None if target can't be reached.
+    def shortest_path(self, source, target):
+        if source == target:
+            return 0.0, [source]
+        if self.lat_rad is None:
+            self.lat_rad = np.radians(self.lat)
+            self.lon_rad = np.radians(self.lon)
+            self.cos_lat = np.cos(self.lat_rad)
+        t_lat, t_lon, t_cos = (
+            float(self.lat_rad[target]),
+            float(self.lon_rad[target]),
+            float(self.cos_lat[target]),
+        )
+
+        def remaining(v):
+            h = (
+                math.sin((self.lat_rad[v] - t_lat) / 2) ** 2
+                + self.cos_lat[v] * t_cos * math.sin((self.lon_rad[v] - t_lon) / 2) ** 2
+            )
+            # Slightly under the true distance so the heuristic never overshoots
+            return 0.999 * 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+        dist = {source: 0.0}
+        prev = {}
+        done = set()
+        heap = [(remaining(source), 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                path = [u]
+                while u != source:
+                    u = prev[u]
+                    path.append(u)
+                return d, path[::-1]
+            if u in done:
+                continue
+            done.add(u)
+            for v, length in self._neighbours(u):
+                nd = d + length
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd + remaining(v), nd, v))
+        return None
+
+    # Dijkstra from one node, {node: meters} for every node within cutoff.
+    # Stops early, with the nodes settled so far, once deadline expires.
+    def single_source_lengths(self, source, cutoff=math.inf, deadline=None):
+        dist = {source: 0.0}
+        done = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if deadline is not None and len(done) % 1024 == 0 and deadline.expired():
+                break
+            for v, length in self._neighbours(u):
+                nd = d + length
+                if nd <= cutoff and nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def coords(self, nodes):
+        return [[float(self.lat[n]), float(self.lon[n])] for n in nodes]
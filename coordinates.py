@@ -0,0 +1,71 @@
+# Coordinates of a set of places as flat arrays
+#
+#   radians   (n, 2) float64 lat, lon in radians, what the distance kernels
+#             work on, so they never convert degrees again
+#   degrees   (n, 2) float32 lat, lon in degrees, half the size, for lookups
+#             that don't need better than about a metre (tiles, boxes)
+#
+# Saved as .npy files next to the amenity store (or a worker's shared frames),
+# both are memory-mapped like CompactGraph's arrays, so every process planning
+# tours reads the same pages. A selection of places is an index array into
+# them, not a copy of their rows.
+#
+import os
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+ARRAYS = {
+    "radians": ("coords_rad.npy", np.float64),
+    "degrees": ("coords_deg.npy", np.float32),
+}
+
+
+class Coordinates:
+    def __init__(self, radians, degrees):
+        self.radians = radians
+        self.degrees = degrees
+
+    def __len__(self):
+        return len(self.radians)
+
+    @classmethod
+    def from_latlon(cls, lat, lon):
+        degrees = np.column_stack(
+            [np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)]
+        )
+        return cls(np.radians(degrees), degrees.astype(np.float32))
+
+    # Coordinates of a frame's lat and lon columns, by position
+    @classmethod
+    def from_frame(cls, frame):
+        return cls.from_latlon(frame["lat"], frame["lon"])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, (filename, dtype) in ARRAYS.items():
+            values = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+            np.save(os.path.join(directory, filename), values)
+
+    # None when directory has no saved coordinates
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        arrays = {}
+        for name, (filename, _) in ARRAYS.items():
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path):
+                return None
+            arrays[name] = np.load(path, mmap_mode=mmap_mode)
+        return cls(**arrays)
+
+    # Great-circle distance in km from (lat, lon) in degrees to the given rows
+    # (all rows when None), the same formula as main.haversine
+    def distances_km(self, lat, lon, rows=None):
+        points = self.radians if rows is None else self.radians[rows]
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2, lon2 = points[:, 0], points[:, 1]
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+        return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
@@ -0,0 +1,44 @@
+# Time budget for the planning pipeline
+#
+# Each stage checks expired() in its main loop and, once time is up, returns
+# the best result it has so far and records itself in `truncated`.
+#
+import time
+
+
+class Deadline:
+    def __init__(self, seconds=None, truncated=None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        # Shared with child deadlines so the whole pipeline reports in one list
+        self.truncated = truncated if truncated is not None else []
+
+    @classmethod
+    def from_ms(cls, milliseconds):
+        return cls(None if milliseconds is None else milliseconds / 1000)
+
+    def remaining(self):
+        if self.expires_at is None:
+            return float("inf")
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    # Gives a stage a share of the time that is left, so that an early stage
+    # can't use up the whole budget and leave nothing for the later ones
+    def child(self, fraction):
+        if self.expires_at is None:
+            return Deadline(truncated=self.truncated)
+        return Deadline(self.remaining() * fraction, truncated=self.truncated)
+
+    def truncate(self, stage):
+        if stage not in self.truncated:
+            self.truncated.append(stage)
+
+
+# Stages take deadline=None to mean no time limit
+def out_of_time(deadline, stage):
+    if deadline is not None and deadline.expired():
+        deadline.truncate(stage)
+        return True
+    return False
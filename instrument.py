@@ -0,0 +1,231 @@
+# Stage timing for the planning pipeline
+#
+# Pipeline stages are wrapped in `with stage("name") as s:` and may set
+# s.rows to the number of rows they produced. While a Recorder is active each
+# stage records its wall time, CPU time of the thread running it, growth of
+# the process's peak RSS and the bytes sent and received over the network
+# while it ran. Without an active Recorder, stage() returns a shared no-op
+# object, so the wrapped code pays for one global lookup.
+#
+#   with Recorder() as recorder:
+#       ...
+#   recorder.save("tour_report.json")
+#
+# RSS and network bytes are counted for the whole process, so stages running
+# at the same time (prefetch threads) share them.
+#
+import json
+import socket
+import ssl
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+_recorder = None
+_local = threading.local()
+
+
+def peak_rss_kb():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _NoStage:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class _Stage:
+    def __init__(self, recorder, name, rows):
+        self.recorder = recorder
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        parents = getattr(_local, "stack", None)
+        if parents is None:
+            parents = _local.stack = []
+        self.path = "/".join(parents + [self.name])
+        parents.append(self.name)
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.rss_started = peak_rss_kb()
+        self.sent_started, self.received_started = _network.totals()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        sent, received = _network.totals()
+        _local.stack.pop()
+        self.recorder.add(
+            {
+                "stage": self.path,
+                "thread": threading.current_thread().name,
+                "wall_s": round(time.perf_counter() - self.started, 6),
+                "cpu_s": round(time.thread_time() - self.cpu_started, 6),
+                "peak_rss_delta_kb": peak_rss_kb() - self.rss_started,
+                "rows": self.rows,
+                "net_bytes_sent": sent - self.sent_started,
+                "net_bytes_received": received - self.received_started,
+                "failed": exc_type is not None,
+            }
+        )
+        return False
+
+
+def stage(name, rows=None):
+    recorder = _recorder
+    if recorder is None:
+        return _NO_STAGE
+    return _Stage(recorder, name, rows)
+
+
+# Byte counters around the socket methods HTTP clients use, installed only
+# while a Recorder is active. For TLS sockets the decrypted bytes are counted:
+# SSLSocket.sendall goes through send, and recv/recv_into through read.
+_PATCHES = [
+    (socket.socket, "send"),
+    (socket.socket, "sendall"),
+    (socket.socket, "recv"),
+    (socket.socket, "recv_into"),
+    (ssl.SSLSocket, "send"),
+    (ssl.SSLSocket, "read"),
+]
+
+
+class _NetworkCounter:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self._originals = []
+
+    def totals(self):
+        return self.sent, self.received
+
+    def install(self):
+        if self._originals:
+            return
+        for cls, name in _PATCHES:
+            # None when the method is inherited (from the C socket type)
+            own = cls.__dict__.get(name)
+            self._originals.append((cls, name, own))
+            setattr(cls, name, self._wrap(name, getattr(cls, name)))
+
+    def uninstall(self):
+        for cls, name, own in reversed(self._originals):
+            if own is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, own)
+        self._originals = []
+
+    def _wrap(self, name, original):
+        counter = self
+
+        def counted(sock, *args, **kwargs):
+            result = original(sock, *args, **kwargs)
+            if name == "sendall":
+                counter.sent += len(args[0])
+            elif name == "send":
+                counter.sent += result
+            elif isinstance(result, int):  # recv_into, or read into a buffer
+                counter.received += result
+            else:
+                counter.received += len(result)
+            return result
+
+        return counted
+
+
+_network = _NetworkCounter()
+
+
+# Optional profiler around the whole run. pyinstrument is a sampling profiler
+# and is used when it is installed; otherwise cProfile, which costs more.
+class _Profiler:
+    def __init__(self, path):
+        self.path = path
+        try:
+            import pyinstrument
+
+            self.sampler = pyinstrument.Profiler()
+            self.profile = None
+        except ImportError:
+            import cProfile
+
+            self.sampler = None
+            self.profile = cProfile.Profile()
+
+    def start(self):
+        if self.sampler is not None:
+            self.sampler.start()
+        else:
+            self.profile.enable()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.path += ".html"
+            with open(self.path, "w") as f:
+                f.write(self.sampler.output_html())
+        else:
+            self.profile.disable()
+            self.path += ".prof"
+            self.profile.dump_stats(self.path)
+        return self.path
+
+
+class Recorder:
+    # profile_path: where to write the profile (extension added by the
+    # profiler), or None to not profile
+    def __init__(self, profile_path=None):
+        self.records = []
+        self._lock = threading.Lock()
+        self.profiler = _Profiler(profile_path) if profile_path else None
+        self.profile_written = None
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def __enter__(self):
+        global _recorder
+        self.started = time.perf_counter()
+        _network.install()
+        _recorder = self
+        if self.profiler is not None:
+            self.profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _recorder
+        if self.profiler is not None:
+            self.profile_written = self.profiler.stop()
+        _recorder = None
+        _network.uninstall()
+        self.wall_s = time.perf_counter() - self.started
+        return False
+
+    def report(self):
+        return {
+            "total_wall_s": round(self.wall_s, 6),
+            "peak_rss_kb": peak_rss_kb(),
+            "profile": self.profile_written,
+            "stages": self.records,
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
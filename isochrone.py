@@ -0,0 +1,63 @@
+# Candidates a tour can reach from its start
+#
+# Stop selection used to consider every candidate of the theme, also ones
+# that can't be reached (like Bowen Island by street), and routing then had to
+# find that out. The isochrone is one bounded Dijkstra search of the street
+# network from the start. It only needs to reach as far as the candidates do:
+# DETOUR times the farthest one in a straight line, and never more than the
+# mode covers (SPEEDS in main.py) in one day. Candidates that don't snap to a
+# node it reached, within that distance, are dropped before any stop is
+# picked. Like the travel matrix it works on a networkx graph or a
+# CompactGraph.
+#
+import math
+
+import numpy as np
+
+from deadline import out_of_time
+from travel_matrix import DAY_MINUTES, MAX_SNAP_METERS, lengths_from, snap_points
+
+# Street distance a candidate may be from the start, as a multiple of its
+# straight-line distance, so places around an inlet still count as reached
+DETOUR = 2
+
+
+# Meters the search covers for candidates up to farthest_meters from the
+# start in a straight line, rounded up to a whole km so nearby starts and
+# candidate sets share a search
+def search_meters(speed_kmh, farthest_meters):
+    meters = math.ceil(DETOUR * farthest_meters / 1000 + 1) * 1000
+    return min(meters, speed_kmh * 1000 / 60 * DAY_MINUTES)
+
+
+# Network node nearest to (lat, lon) and the meters to it, None if the start
+# is too far from the network to tell
+def start_node(G, lat, lon):
+    nodes, snap = snap_points(G, [lat], [lon], MAX_SNAP_METERS)
+    if snap[0] > MAX_SNAP_METERS:
+        return None
+    return int(nodes[0]), float(snap[0])
+
+
+# Meters from the start node to every node reached within max_meters. None
+# when the deadline ran out before the search finished.
+def reachable_nodes(G, node, max_meters, deadline=None):
+    if out_of_time(deadline, "isochrone"):
+        return None
+    lengths = lengths_from(G, node, max_meters, deadline)
+    if out_of_time(deadline, "isochrone"):
+        return None
+    return lengths
+
+
+# Which of the points (lats, lons) are within max_meters of the start, given
+# the nodes reached from its node and the meters onto the network (start_node)
+def reachable_mask(G, reached, snap_meters, lats, lons, max_meters):
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if len(lats) == 0:
+        return np.ones(0, dtype=bool)
+    nodes, snap = snap_points(G, lats, lons, MAX_SNAP_METERS)
+    meters = np.array([reached.get(node, np.inf) for node in nodes.tolist()])
+    # Walking onto the network at both ends counts towards the distance
+    return (snap <= MAX_SNAP_METERS) & (meters + snap + snap_meters <= max_meters)
@@ -4,18 +4,24 @@
 #   Steven Duong 301552606
 #   Jun Hyeok Park 301461661
 #
+import argparse
+from functools import partial
 import pandas as pd
 import numpy as np
 import math
-import folium as fl
-import osmnx as ox
-import networkx as nx
-from SPARQLWrapper import SPARQLWrapper, JSON
-from geopy.geocoders import Nominatim
 from datetime import datetime, timedelta
-from folium.plugins import TimestampedGeoJson
-
-geolocator = Nominatim(user_agent="CMPT353-Project")
+from optimizer import orienteering_tour, improve_route_order, SCORES
+from parallel import parallel_orienteering_tour
+from deadline import Deadline, out_of_time
+from travel_matrix import load_or_build_travel_matrix
+from routing import StreetRouter
+from instrument import stage
+
+# folium, osmnx, networkx and geopy take seconds to import, so each one is
+# imported inside the functions that use it. Starting up, answering the
+# prompts or planning without a map never loads them (see
+# benchmarks/startup.py).
+_geolocator = None
 
 # Constants
 MIN_LAT = 49.0053233
@@ -23,8 +29,48 @@ MAX_LAT = 49.4598489
 MIN_LON = -123.4772643
 MAX_LON = -122.0016829
 
+# Predetermined average speeds for different modes of travel in km/h
+SPEEDS = {"walk": 5, "bike": 15, "drive": 50}
+
+THEMES = [
+    "food",
+    "nature",
+    "history",
+    "science",
+    "art",
+    "entertainment",
+    "bar crawl",
+    "random",
+]
+TRANSPORT_MODES = ["walk", "drive", "bike"]
+# How the stops are picked and ordered (see plan_stops)
+SOLVERS = ["nearest", "nearest-2opt", "orienteering"]
+
+
+# Looks up an address, returns (lat, lon) or None if it can't be found
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        from geopy.geocoders import Nominatim
+
+        _geolocator = Nominatim(user_agent="CMPT353-Project")
+    return _geolocator
+
+
+def geocode(address):
+    location = get_geolocator().geocode(address)
+    if location:
+        return float(location.latitude), float(location.longitude)
+    return None
 
-def input_field():
+
+def in_bounds(lat, lon):
+    return (MIN_LAT <= lat <= MAX_LAT) and (MIN_LON <= lon <= MAX_LON)
+
+
+# on_transport is called with the mode of transportation as soon as it is
+# answered, so its street network can start loading during the last prompts
+def input_field(on_transport=None):
     # Ask user how long their tour is
     while True:
         tour_length = input("Enter length of tour in days: ").strip()
@@ -38,16 +84,7 @@ def input_field():
             print("Invalid input. Please enter a valid number.")
 
     # Ask for theme
-    themes = [
-        "food",
-        "nature",
-        "history",
-        "science",
-        "art",
-        "entertainment",
-        "bar crawl",
-        "random",
-    ]
+    themes = THEMES
     while True:
         theme = input(f"Enter a theme ({', '.join(themes)}): ").strip().lower()
         if theme in themes:
@@ -76,11 +113,11 @@ def input_field():
         address = input(
             "Please enter your current address (Ex. 1234 Mountain Drive Vancouver BC V1N 5Z6): "
         )
-        location = geolocator.geocode(address)
+        location = geocode(address)
         if location:
-            start_lat, start_lon = float(location.latitude), float(location.longitude)
+            start_lat, start_lon = location
 
-            if (MIN_LAT <= start_lat <= MAX_LAT) and (MIN_LON <= start_lon <= MAX_LON):
+            if in_bounds(start_lat, start_lon):
                 break
             else:
                 print(
@@ -90,7 +127,7 @@ def input_field():
             print("Invalid address. Please try again.")
 
     # Ask for mode of transportation
-    transport_modes = ["walk", "drive", "bike"]
+    transport_modes = TRANSPORT_MODES
     options = ["yes", "no"]
     while True:
         transportation = (
@@ -101,6 +138,8 @@ def input_field():
             .lower()
         )
         if transportation in transport_modes:
+            if on_transport is not None:
+                on_transport(transportation)
             if transportation == "walk":
                 while True:
                     want_rental = (
@@ -151,114 +190,270 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * c
 
 
+# Minutes to travel between two [lat, lon] points. Uses the network travel
+# matrix when there is one connecting both points, otherwise the straight-line
+# distance at the average speed.
+def leg_minutes(a, b, speed, travel=None):
+    if travel is not None:
+        minutes = travel.minutes(a, b)
+        if minutes is not None and np.isfinite(minutes):
+            return minutes
+    return max((haversine(a[0], a[1], b[0], b[1]) / speed) * 60, 1)
+
+
+# Minutes from one point to every row of a dataframe with lat and lon columns,
+# inf for rows the travel matrix says can't be reached
+def minutes_to_rows(location, rows, speed, travel=None):
+    if travel is not None:
+        minutes = travel.minutes_from(location, rows["lat"], rows["lon"])
+        if minutes is not None:
+            return minutes
+    distance = haversine(location[0], location[1], rows["lat"], rows["lon"])
+    return np.maximum((np.asarray(distance) / speed) * 60, 1)
+
+
 # Finds a route by pathing to the nearest neighbour based on ['lat, lon'] pairs
-def find_nearest_amenities(amenities, start_coords, num_amenities):
-    amenities_copy = amenities.copy()
+# When a travel matrix is given, "nearest" means shortest network travel time
+# and a place is only picked from a stop the network reaches it from.
+# coordinates, when given, holds the places' coordinates at their index (like
+# the amenity store's); the search then only keeps an index array of the
+# places left.
+#
+# pinned are places the tour must visit (rows like the amenities', see
+# TourPlanner.must_visit). They are picked like any other place when they are
+# the nearest, and once only as many stops are left as there are pinned
+# places, only those are, so the tour is filled in around them. A pinned
+# place the matrix has no travel time to is timed by straight line at
+# speed_kmh, the speed of the tour's mode, so it is never left out.
+def find_nearest_amenities(
+    amenities,
+    start_coords,
+    num_amenities,
+    deadline=None,
+    travel=None,
+    coordinates=None,
+    pinned=None,
+    speed_kmh=5,
+):
+    from coordinates import Coordinates
+
+    if pinned is None:
+        pinned = amenities.iloc[:0]
+    if coordinates is None:
+        coordinates = Coordinates.from_frame(amenities)
+        remaining = np.arange(len(amenities))
+    else:
+        remaining = amenities.index.to_numpy()
+    positions = np.arange(len(amenities))
+    lat, lon = amenities["lat"].to_numpy(), amenities["lon"].to_numpy()
+    pin_lat, pin_lon = pinned["lat"].to_numpy(), pinned["lon"].to_numpy()
+    pins_left = np.arange(len(pinned))
+    if len(pinned):
+        # A pinned place is not picked a second time as a candidate
+        is_pinned = pd.MultiIndex.from_arrays([lat, lon]).isin(
+            pd.MultiIndex.from_arrays([pin_lat, pin_lon])
+        )
+        remaining, positions = remaining[~is_pinned], positions[~is_pinned]
     route = []
     current_location = start_coords
 
-    for _ in range(num_amenities):
-        if amenities_copy.empty:
+    for _ in range(max(num_amenities, len(pinned))):
+        # Always pick at least one stop so the rest of the pipeline has a tour,
+        # and every pinned place
+        if (route and out_of_time(deadline, "find_nearest_amenities")) or (
+            num_amenities - len(route) <= len(pins_left)
+        ):
+            remaining, positions = remaining[:0], positions[:0]
+        if len(remaining) == 0 and len(pins_left) == 0:
             break
 
-        amenities_copy["distance"] = amenities_copy.apply(
-            lambda row: haversine(
-                current_location[0], current_location[1], row["lat"], row["lon"]
-            ),
-            axis=1,
-        )
-        nearest_amenity = amenities_copy.nsmallest(1, "distance").iloc[0]
+        if travel is not None:
+            distance = minutes_to_rows(
+                current_location,
+                {"lat": lat[positions], "lon": lon[positions]},
+                speed_kmh,
+                travel,
+            )
+        else:
+            distance = coordinates.distances_km(
+                current_location[0], current_location[1], remaining
+            )
+        if len(pins_left):
+            pin_points = {"lat": pin_lat[pins_left], "lon": pin_lon[pins_left]}
+            if travel is not None:
+                pin_distance = minutes_to_rows(
+                    current_location, pin_points, speed_kmh, travel
+                )
+                straight = minutes_to_rows(current_location, pin_points, speed_kmh)
+                pin_distance = np.where(
+                    np.isfinite(pin_distance), pin_distance, straight
+                )
+            else:
+                pin_distance = haversine(
+                    current_location[0],
+                    current_location[1],
+                    pin_points["lat"],
+                    pin_points["lon"],
+                )
+        # A place the network can't reach from here (inf) is only left out of
+        # this step; it may well be reachable from the next stop
+        can_pick = len(remaining) and np.isfinite(distance).any()
+        if not can_pick and len(pins_left) == 0:
+            break
 
-        route.append(nearest_amenity)
-        current_location = (nearest_amenity["lat"], nearest_amenity["lon"])
+        if len(pins_left) and (not can_pick or pin_distance.min() < distance.min()):
+            nearest = np.argmin(pin_distance)
+            route.append(len(amenities) + pins_left[nearest])
+            current_location = (
+                pin_lat[pins_left[nearest]],
+                pin_lon[pins_left[nearest]],
+            )
+            pins_left = np.delete(pins_left, nearest)
+            continue
 
-        amenities_copy = amenities_copy.drop(nearest_amenity.name)
+        nearest = np.argmin(distance)
 
-    return pd.DataFrame(route)
+        route.append(positions[nearest])
+        current_location = (lat[positions[nearest]], lon[positions[nearest]])
 
+        remaining = np.delete(remaining, nearest)
+        positions = np.delete(positions, nearest)
 
-def filter_amenities_by_theme(amenities, selected_theme):
-    themes = {
-        "nature": [
-            "park",
-            "watering_place",
-            "fountain",
-            "ranger_station",
-            "hunting_stand",
-            "observation_platform",
-            "water_point",
-        ],
-        "food": [
-            "cafe",
-            "bbq",
-            "restaurant",
-            "pub",
-            "bar",
-            "food_court",
-            "ice_cream",
-            "juice_bar",
-            "bistro",
-            "biergarten",
-        ],
-        "history": ["place_of_worship", "monastery", "courthouse", "townhall", "clock"],
-        "science": ["research_institute", "science", "ATLAS_clean_room"],
-        "art": ["arts_centre", "theatre", "studio"],
-        "entertainment": [
-            "cinema",
-            "nightclub",
-            "stripclub",
-            "gambling",
-            "casino",
-            "marketplace",
-            "spa",
-            "events_venue",
-            "internet_cafe",
-            "lounge",
-            "shop|clothes",
-            "leisure",
-            "Observation Platform",
-            "photo_booth",
-        ],
-        "mode of travel": [
-            "car_rental",
-            "bicycle_rental",
-            "car_sharing",
-            "taxi",
-            "bus_station",
-            "ferry_terminal",
-            "seaplane_terminal",
-            "motorcycle_rental",
-            "parking",
-            "charging_station",
-            "EVSE",
-        ],
-        "bar crawl": [
-            "bar",
-            "pub",
-            "nightclub",
-            "cocktail_bar",
-            "brewpub",
-            "wine_bar",
-            "lounge",
-            "sports_bar",
-        ],
-    }
-
-    if selected_theme in themes:
-        relevant_amenities = themes[selected_theme]
-        return amenities[amenities["amenity"].isin(relevant_amenities)]
+    if len(pinned) == 0:
+        return amenities.iloc[route]
+    route = np.array(route, dtype=np.int64)
+    from_pins = route >= len(amenities)
+    stops = pd.concat(
+        [
+            amenities.iloc[route[~from_pins]],
+            pinned.iloc[route[from_pins] - len(amenities)],
+        ]
+    )
+    # Back into visiting order: candidates were taken first, then pinned places
+    order = np.where(
+        from_pins,
+        np.count_nonzero(~from_pins) + np.cumsum(from_pins) - 1,
+        np.cumsum(~from_pins) - 1,
+    )
+    return stops.iloc[order]
+
+
+# Amenity types of every theme ("random" takes any type)
+THEME_AMENITIES = {
+    "nature": [
+        "park",
+        "watering_place",
+        "fountain",
+        "ranger_station",
+        "hunting_stand",
+        "observation_platform",
+        "water_point",
+    ],
+    "food": [
+        "cafe",
+        "bbq",
+        "restaurant",
+        "pub",
+        "bar",
+        "food_court",
+        "ice_cream",
+        "juice_bar",
+        "bistro",
+        "biergarten",
+    ],
+    "history": ["place_of_worship", "monastery", "courthouse", "townhall", "clock"],
+    "science": ["research_institute", "science", "ATLAS_clean_room"],
+    "art": ["arts_centre", "theatre", "studio"],
+    "entertainment": [
+        "cinema",
+        "nightclub",
+        "stripclub",
+        "gambling",
+        "casino",
+        "marketplace",
+        "spa",
+        "events_venue",
+        "internet_cafe",
+        "lounge",
+        "shop|clothes",
+        "leisure",
+        "Observation Platform",
+        "photo_booth",
+    ],
+    "mode of travel": [
+        "car_rental",
+        "bicycle_rental",
+        "car_sharing",
+        "taxi",
+        "bus_station",
+        "ferry_terminal",
+        "seaplane_terminal",
+        "motorcycle_rental",
+        "parking",
+        "charging_station",
+        "EVSE",
+    ],
+    "bar crawl": [
+        "bar",
+        "pub",
+        "nightclub",
+        "cocktail_bar",
+        "brewpub",
+        "wine_bar",
+        "lounge",
+        "sports_bar",
+    ],
+}
+
+# Bits of the amenity_bits column load_amenities() adds: one per theme, then
+# one for interesting amenity types and one for chains
+THEME_BITS = {theme: 1 << i for i, theme in enumerate(THEME_AMENITIES)}
+INTERESTING_BIT = 1 << len(THEME_AMENITIES)
+CHAIN_BIT = INTERESTING_BIT << 1
+
+
+# amenity_bits of every row. The theme and interesting bits depend only on the
+# amenity type, so they are worked out once per category and looked up by the
+# categorical codes.
+def amenity_bits(data):
+    amenity = pd.Categorical(data["amenity"])
+    interesting = set(interesting_amenities)
+    by_type = np.zeros(len(amenity.categories) + 1, dtype=np.uint16)  # -1: none
+    for code, name in enumerate(amenity.categories):
+        for theme, members in THEME_AMENITIES.items():
+            if name in members:
+                by_type[code] |= THEME_BITS[theme]
+        if name in interesting:
+            by_type[code] |= INTERESTING_BIT
+    bits = by_type[amenity.codes]
+    if "is_chain" in data.columns:
+        chain = data["is_chain"].to_numpy()
     else:
+        chain = data["name"].isin(chain_names).to_numpy()
+    bits[chain] |= CHAIN_BIT
+    return bits
+
+
+def filter_amenities_by_theme(amenities, selected_theme):
+    if selected_theme not in THEME_AMENITIES:
         return amenities  # Show all if no theme is selected
+    if "amenity_bits" in amenities.columns:
+        in_theme = amenities["amenity_bits"] & THEME_BITS[selected_theme]
+        return amenities[in_theme != 0]
+    return amenities[amenities["amenity"].isin(THEME_AMENITIES[selected_theme])]
 
 
 # Goes through a list of places, searching for hotels in each place and extracting their name and coordinates
-def get_hotels(places):
+# Progress and errors go to log (print), like in get_restaurants and get_rental
+def get_hotels(places, log=print):
+    import osmnx as ox
 
     df_list = []
+    failed = False
     tags = {"tourism": "hotel"}
 
     for place in places:
-        print(f"Retrieving hotels for {place}...")
+        log(f"Retrieving hotels for {place}...")
         try:
             gdf = ox.features_from_place(place, tags)
 
@@ -276,28 +471,34 @@ def get_hotels(places):
             else:
                 gdf = gdf[gdf["name"].notna()]
             hotels_df = gdf[["name", "lat", "lon"]].reset_index(drop=True)
-            print(f"Retrieved {len(hotels_df)} hotels for {place}.")
+            log(f"Retrieved {len(hotels_df)} hotels for {place}.")
             df_list.append(hotels_df)
 
         except Exception as e:
-            print(f"Error retrieving hotels for {place}: {e}")
+            log(f"Error retrieving hotels for {place}: {e}")
+            failed = True
 
     if df_list:
         combined = pd.concat(df_list, ignore_index=True)
-        print(f"Total hotels retrieved: {len(combined)}")
-        return combined
+        log(f"Total hotels retrieved: {len(combined)}")
     else:
-        return pd.DataFrame()
+        combined = pd.DataFrame()
+    # TourPlanner doesn't keep what a failed fetch returned (fetch_failed), so
+    # the next tour tries again
+    combined.attrs["fetch_failed"] = failed
+    return combined
 
 
 # Goes through a list of places, searching for restaurants in each place and extracting their name and coordinates
-def get_restaurants(places):
+def get_restaurants(places, log=print):
+    import osmnx as ox
 
     df_list = []
+    failed = False
     tags = {"amenity": ["bbq", "restaurant", "pub", "bar", "bistro"]}
 
     for place in places:
-        print(f"Retrieving restaurants for {place}...")
+        log(f"Retrieving restaurants for {place}...")
         try:
             gdf = ox.features_from_place(place, tags)
 
@@ -316,30 +517,34 @@ def get_restaurants(places):
                 gdf = gdf[gdf["name"].notna()]
 
             restaurants_df = gdf[["name", "lat", "lon"]].reset_index(drop=True)
-            print(f"Retrieved {len(restaurants_df)} restaurants for {place}.")
+            log(f"Retrieved {len(restaurants_df)} restaurants for {place}.")
             df_list.append(restaurants_df)
 
         except Exception as e:
-            print(f"Error retrieving restaurants for {place}: {e}")
+            log(f"Error retrieving restaurants for {place}: {e}")
+            failed = True
 
     if df_list:
         combined = pd.concat(df_list, ignore_index=True)
-        print(f"Total restaurants retrieved: {len(combined)}")
-        return combined
+        log(f"Total restaurants retrieved: {len(combined)}")
     else:
-        return pd.DataFrame()
+        combined = pd.DataFrame()
+    combined.attrs["fetch_failed"] = failed
+    return combined
 
 
 # If the user selects that they are walking, then find some place of transportation.
-def get_rental(places):
+def get_rental(places, log=print):
+    import osmnx as ox
 
     df_list = []
+    failed = False
     tags = {
         "amenity": ["car_rental", "bicycle_rental", "bus_station", "motorcycle_rental"]
     }
 
     for place in places:
-        print(f"Retrieving rentals for {place}...")
+        log(f"Retrieving rentals for {place}...")
         try:
             gdf = ox.features_from_place(place, tags)
 
@@ -358,51 +563,71 @@ def get_rental(places):
                 gdf = gdf[gdf["name"].notna()]
 
             rentals_df = gdf[["name", "lat", "lon"]].reset_index(drop=True)
-            print(f"Retrieved {len(rentals_df)} rentals for {place}.")
+            log(f"Retrieved {len(rentals_df)} rentals for {place}.")
             df_list.append(rentals_df)
 
         except Exception as e:
-            print(f"Error retrieving rentals for {place}: {e}")
+            log(f"Error retrieving rentals for {place}: {e}")
+            failed = True
 
     if df_list:
         combined = pd.concat(df_list, ignore_index=True)
-        print(f"Total rentals retrieved: {len(combined)}")
-        return combined
+        log(f"Total rentals retrieved: {len(combined)}")
     else:
-        return pd.DataFrame()
+        combined = pd.DataFrame()
+    combined.attrs["fetch_failed"] = failed
+    return combined
 
 
-# Creates a daily schedule for the tour based on time constraints
+# Creates a daily schedule for the tour based on time constraints. `travel` can
+# be anything with a minutes(a, b) method, like a TravelMatrix or StreetRouter,
+# to use network travel times instead of straight-line estimates.
+#
+# Every stop records in "point" the index of its route point; for the hotel at
+# the end of a day it is the route point the next day starts from. Passing
+# first_day, start_index and start_location continues a schedule from the
+# morning of first_day, so an edited tour only reschedules the days after the
+# edit.
 def daily_schedule(
-    route_points, amenities, transportation, tour_length, lodging_points
+    route_points,
+    amenities,
+    transportation,
+    tour_length,
+    lodging_points,
+    deadline=None,
+    travel=None,
+    first_day=1,
+    start_index=1,
+    start_location=None,
 ):
-    # Predetermined average speeds for different modes of travel in km/h
-    speeds = {"walk": 5, "bike": 15, "drive": 50}
-
     # Rough amounts of time spent at different amenity types in minutes
     time_spent = {"hotel": 720, "restaurant": 60, "rental": 20, "default": 60}
 
     schedule = []
-    current_day = 1
+    current_day = first_day
 
     # for this system, date doesn't matter, only time
     day_start = datetime(2025, 1, 1, 9, 0)  # Tour days begin 9am
     day_end = datetime(2025, 1, 1, 21, 0)  # Tour days end at 9pm
+    day_start += timedelta(days=first_day - 1)
+    day_end += timedelta(days=first_day - 1)
     current_time = day_start
-    current_location = route_points[0]
-
-    schedule.append(
-        {
-            "day": current_day,
-            "name": "Start Location",
-            "type": "start",
-            "lat": current_location[0],
-            "lon": current_location[1],
-            "arrival": current_time,
-            "departure": current_time,
-            "travel_time": 0,
-        }
-    )
+    current_location = start_location or route_points[0]
+
+    if first_day == 1:
+        schedule.append(
+            {
+                "day": current_day,
+                "name": "Start Location",
+                "type": "start",
+                "lat": current_location[0],
+                "lon": current_location[1],
+                "arrival": current_time,
+                "departure": current_time,
+                "travel_time": 0,
+                "point": 0,
+            }
+        )
 
     # Meal targets for each day (breakfast, lunch, dinner)
     meal_times = {
@@ -419,18 +644,26 @@ def daily_schedule(
     meals_taken = {"breakfast": False, "lunch": False, "dinner": False}
     restaurants_count = 0
 
+    # Taking a row out of a frame with categorical columns is slow, so the
+    # columns read for every stop are taken out once
+    def column(name):
+        return amenities[name].to_numpy(dtype=object) if name in amenities else None
+
+    types, kinds, names = column("type"), column("amenity"), column("name")
+
     # Iterate through each stop (starting from index 1)
-    for i in range(1, len(route_points)):
-        if current_day >= tour_length:
+    for i in range(start_index, len(route_points)):
+        if current_day > tour_length:
             break
+        # Out of time, so the remaining stops are still scheduled, just with
+        # straight-line travel times instead of routed ones
+        if travel is not None and out_of_time(deadline, "daily_schedule"):
+            travel = None
 
         next_point = route_points[i]
         # Calculate travel time (in minutes) from current_location to next_point
-        distance = haversine(
-            current_location[0], current_location[1], next_point[0], next_point[1]
-        )
-        speed = speeds.get(transportation, 5)
-        travel_minutes = max((distance / speed) * 60, 1)
+        speed = SPEEDS.get(transportation, 5)
+        travel_minutes = leg_minutes(current_location, next_point, speed, travel)
         travel_time = timedelta(minutes=travel_minutes)
         arrival_time = current_time + travel_time
 
@@ -438,15 +671,15 @@ def daily_schedule(
         if arrival_time > day_end or (day_end - current_time) < timedelta(minutes=15):
 
             if lodging_points is not None and not lodging_points.empty:
-                lodging_points["hotel_distance"] = lodging_points.apply(
-                    lambda row: haversine(
-                        current_location[0], current_location[1], row["lat"], row["lon"]
-                    ),
-                    axis=1,
+                lodging_points["hotel_minutes"] = minutes_to_rows(
+                    current_location, lodging_points, speed, travel
                 )
-                nearest_hotel = lodging_points.nsmallest(1, "hotel_distance").iloc[0]
-                hotel_travel_minutes = max(
-                    (nearest_hotel["hotel_distance"] / speed) * 60, 1
+                nearest_hotel = lodging_points.nsmallest(1, "hotel_minutes").iloc[0]
+                hotel_travel_minutes = leg_minutes(
+                    current_location,
+                    [nearest_hotel["lat"], nearest_hotel["lon"]],
+                    speed,
+                    travel,
                 )
                 hotel_travel_time = timedelta(minutes=hotel_travel_minutes)
                 hotel_arrival = current_time + hotel_travel_time
@@ -466,6 +699,7 @@ def daily_schedule(
                     "arrival": hotel_arrival,
                     "departure": hotel_departure,
                     "travel_time": hotel_travel_minutes,
+                    "point": i,
                 }
             )
             current_day += 1
@@ -488,22 +722,18 @@ def daily_schedule(
             current_time = day_start
 
             # Recalc travel from new day's start to next_point.
-            distance = haversine(
-                current_location[0], current_location[1], next_point[0], next_point[1]
-            )
-            travel_minutes = max((distance / speed) * 60, 1)
+            travel_minutes = leg_minutes(current_location, next_point, speed, travel)
             travel_time = timedelta(minutes=travel_minutes)
             arrival_time = current_time + travel_time
 
         # Gets amenity info.If type is missing, use original amenity type
         if i < len(amenities):
-            amenity_info = amenities.iloc[i]
-            og_type = amenity_info.get("type", None)
+            og_type = None if types is None else types[i]
             if og_type is None or (isinstance(og_type, float) and np.isnan(og_type)):
-                amenity_type = amenity_info.get("amenity", "default")
+                amenity_type = "default" if kinds is None else kinds[i]
             else:
                 amenity_type = og_type
-            amenity_name = amenity_info.get("name", f"Point {i}")
+            amenity_name = f"Point {i}" if names is None else names[i]
         else:
             amenity_type = "default"
             amenity_name = f"Point {i}"
@@ -536,15 +766,15 @@ def daily_schedule(
         # Ensures tour stops at 9pm and ends at a hotel for last amenity
         if amenity_type != "hotel" and departure_time > day_end:
             if lodging_points is not None and not lodging_points.empty:
-                lodging_points["hotel_distance"] = lodging_points.apply(
-                    lambda row: haversine(
-                        current_location[0], current_location[1], row["lat"], row["lon"]
-                    ),
-                    axis=1,
+                lodging_points["hotel_minutes"] = minutes_to_rows(
+                    current_location, lodging_points, speed, travel
                 )
-                nearest_hotel = lodging_points.nsmallest(1, "hotel_distance").iloc[0]
-                hotel_travel_minutes = max(
-                    (nearest_hotel["hotel_distance"] / speed) * 60, 1
+                nearest_hotel = lodging_points.nsmallest(1, "hotel_minutes").iloc[0]
+                hotel_travel_minutes = leg_minutes(
+                    current_location,
+                    [nearest_hotel["lat"], nearest_hotel["lon"]],
+                    speed,
+                    travel,
                 )
                 hotel_travel_time = timedelta(minutes=hotel_travel_minutes)
                 hotel_arrival = current_time + hotel_travel_time
@@ -564,6 +794,8 @@ def daily_schedule(
                     "arrival": hotel_arrival,
                     "departure": hotel_departure,
                     "travel_time": hotel_travel_minutes,
+                    # This stop is skipped, the next day starts after it
+                    "point": i + 1,
                 }
             )
 
@@ -595,6 +827,7 @@ def daily_schedule(
                 "lon": next_point[1],
                 "arrival": arrival_time,
                 "departure": departure_time,
+                "point": i,
             }
         )
 
@@ -607,6 +840,8 @@ def daily_schedule(
 
 
 def get_combined_graph(places, network_type):
+    import networkx as nx
+    import osmnx as ox
 
     graphs = []
     for place in places:
@@ -627,6 +862,8 @@ def get_combined_graph(places, network_type):
 
 
 def create_tour_map(schedule, route):
+    import folium as fl
+    from folium.plugins import TimestampedGeoJson
 
     map_center = [schedule[0]["lat"], schedule[0]["lon"]]
     tour_map = fl.Map(location=map_center, zoom_start=13)
@@ -744,40 +981,17 @@ def create_tour_map(schedule, route):
     return tour_map
 
 
-# Finds proper paths between points using street network graph
-def get_street_route(G, points_list):
-    full_route = []
-    for i in range(len(points_list) - 1):
-        start_lat, start_lon = points_list[i]
-        end_lat, end_lon = points_list[i + 1]
-        start_node = ox.distance.nearest_nodes(G, start_lon, start_lat)
-        end_node = ox.distance.nearest_nodes(G, end_lon, end_lat)
-        if not nx.has_path(G, start_node, end_node):
-            print(
-                f"No route found between {points_list[i]} and {points_list[i+1]}. Skipping."
-            )
-            continue
-        try:
-            path_nodes = nx.shortest_path(G, start_node, end_node, weight="length")
-        except Exception as e:
-            print(
-                f"Error finding path between {points_list[i]} and {points_list[i+1]}: {e}"
-            )
-            continue
-        segment = []
-        for node in path_nodes:
-            node_data = G.nodes[node]
-            segment.append([node_data["y"], node_data["x"]])
-        if i > 0 and segment:
-            segment = segment[1:]
-        full_route.extend(segment)
-
-    return full_route
+# Finds proper paths between points using street network graph. Once the
+# deadline is reached the remaining legs are drawn as straight lines.
+def get_street_route(G, points_list, deadline=None):
+    return StreetRouter(G, deadline=deadline).route(points_list)
 
 
 # Filters "popular" amenities based on number of tags
 def filter_popular_amenities(data, min_tags=5):
-    if "tags" in data.columns:
+    if "tag_count" in data.columns:
+        return data[data["tag_count"] >= min_tags]
+    elif "tags" in data.columns:
         return data[data["tags"].apply(lambda tags: len(tags) >= min_tags)]
     else:
         print("No 'tags' column found in data.")
@@ -864,7 +1078,6 @@ interesting_amenities = [
 chain_names = [
     "Starbucks",
     "Tim Hortons",
-    "Tim_Hortons",
     "McDonald's",
     "Subway",
     "A&W",
@@ -931,61 +1144,226 @@ chain_names = [
 ]
 
 
-def main():
-    original_data = pd.read_json(
-        "amenities-vancouver.json.gz", compression="gzip", lines=True
+# What the amenity store keeps of the raw data: named, interesting, non-chain
+# places in the region
+def amenity_store_filters():
+    from amenity_store import StoreFilters
+
+    return StoreFilters(
+        amenities=tuple(interesting_amenities),
+        chain_names=tuple(chain_names),
+        bounds=(MIN_LAT, MAX_LAT, MIN_LON, MAX_LON),
     )
-    data = original_data[~original_data["name"].isna()]
-    data = data[data["amenity"].isin(interesting_amenities)]
-    data = data[~data["name"].isin(chain_names)]
-    # Get inputs
-    (
-        tour_length,
-        theme,
-        num_amenities,
-        start_coords,
-        transportation,
-        want_rental,
-        stay_hotel,
-    ) = input_field()
 
+
+# Loads the named, interesting, non-chain amenities. They come from the
+# preprocessed store, which is filtered while it is built, already has the tag
+# feature columns and flags chains by brand as well as by chain_names. They
+# get an amenity_bits column marking their themes.
+def load_amenities(path="amenities-vancouver.json.gz", log=print):
+    from amenity_store import load_or_build_store
+
+    with stage("load_amenity_store") as s:
+        original_data = load_or_build_store(
+            path, filters=amenity_store_filters(), log=log
+        )
+        s.rows = len(original_data)
+    return _keep_interesting(original_data)
+
+
+def _keep_interesting(data):
+    data["amenity_bits"] = amenity_bits(data)
+    checked = INTERESTING_BIT | CHAIN_BIT
+    interesting = (data["amenity_bits"] & checked) == INTERESTING_BIT
+    return data[interesting & data["name"].notna()]
+
+
+# Index of the tiles the amenity store is split into (amenity_store.TileIndex)
+def load_amenity_tile_index(path="amenities-vancouver.json.gz"):
+    from amenity_store import load_or_build_tile_index
+
+    return load_or_build_tile_index(path, filters=amenity_store_filters())
+
+
+# The amenities load_amenities(path) returns that are in the given tiles of
+# index, read without loading the rest of the store
+def load_amenity_tiles(tiles, path="amenities-vancouver.json.gz", index=None):
+    from amenity_store import load_store, store_path
+
+    if index is None:
+        index = load_amenity_tile_index(path)
+    with stage("load_amenity_tiles") as s:
+        data = load_store(store_path(path), index.rows(tiles))
+        s.rows = len(data)
+    return _keep_interesting(data)
+
+
+# Coordinates of the amenities load_amenities(path) returns, by their index,
+# memory-mapped from the amenity store
+def load_amenity_coordinates(path="amenities-vancouver.json.gz"):
+    from amenity_store import load_or_build_coordinates
+
+    return load_or_build_coordinates(path, filters=amenity_store_filters())
+
+
+# OSM tags of the amenities load_amenities(path) returns, by their index
+def load_amenity_tags(path="amenities-vancouver.json.gz"):
+    from amenity_store import load_or_build_tags
+
+    return load_or_build_tags(path, filters=amenity_store_filters())
+
+
+# Candidate stops for a theme: amenities of that theme with 5 or more tags.
+# The filters combine masks, so the rows are only taken once.
+def _candidate_mask(data, theme, min_tags=5):
     if theme == "random":
         # Filters out big chains
-        data = data[data["amenity"] != "fast_food"]
-        popular_amenities = filter_popular_amenities(
-            data, min_tags=5
-        )  # Popular amenities have 5 or more tags
+        keep = (data["amenity"] != "fast_food").to_numpy()
+    elif theme not in THEME_AMENITIES:
+        keep = np.ones(len(data), dtype=bool)
+    elif "amenity_bits" in data.columns:
+        keep = (data["amenity_bits"].to_numpy() & THEME_BITS[theme]) != 0
     else:
-        filtered_amenities = filter_amenities_by_theme(data, theme)
-        popular_amenities = filter_popular_amenities(
-            filtered_amenities, min_tags=5
-        )  # Popular amenities have 5 or more tags
-
-    nearest_amenities = find_nearest_amenities(
-        popular_amenities, start_coords, num_amenities
+        keep = data["amenity"].isin(THEME_AMENITIES[theme]).to_numpy()
+    # Popular amenities have 5 or more tags
+    if "tag_count" in data.columns:
+        keep = keep & (data["tag_count"].to_numpy() >= min_tags)
+    elif "tags" in data.columns:
+        tag_count = data["tags"].apply(len).to_numpy()
+        keep = keep & (tag_count >= min_tags)
+    return keep
+
+
+# Index of the candidate stops, e.g. rows of the amenity store's Coordinates
+def candidate_rows(data, theme):
+    return data.index.to_numpy()[_candidate_mask(data, theme)]
+
+
+def select_candidates(data, theme):
+    return data[_candidate_mask(data, theme)]
+
+
+# Hotels from OpenStreetMap combined with housing co-ops from our data
+def get_lodging(data, log=print):
+    housing = data[data["amenity"] == "housing co-op"]
+    hotels = get_hotels(regions, log)
+
+    if not hotels.empty or not housing.empty or hotels.attrs["fetch_failed"]:
+        # Combine hotels and housing
+        lodging = pd.concat([housing, hotels], ignore_index=True)
+        lodging.attrs["fetch_failed"] = hotels.attrs["fetch_failed"]
+        return lodging
+    return None
+
+
+# Street network for the mode of travel, reduced to its largest connected part
+def load_street_graph(transportation, log=print):
+    import networkx as nx
+    import osmnx as ox
+
+    log("Downloading street network... This could take a minute...")
+    with stage("graph_from_place") as s:
+        Graph = ox.graph_from_place(regions, network_type=transportation, simplify=True)
+        s.rows = len(Graph)
+    with stage("connected_components") as s:
+        G_undirected = Graph.to_undirected()
+        largest_component = max(nx.connected_components(G_undirected), key=len)
+        s.rows = len(largest_component)
+        return G_undirected.subgraph(largest_component).copy()
+
+
+# Network travel times between every place the tour could stop at, read
+# from disk after the first run so planning itself does no routing. Only
+# places within max_meters of each other by street get a travel time.
+def get_travel_matrix(
+    Graph, transportation, popular_amenities, lodging_points, rentals, max_meters=None
+):
+    places = [popular_amenities[["lat", "lon"]]]
+    if lodging_points is not None:
+        places.append(lodging_points[["lat", "lon"]])
+    if rentals is not None:
+        places.append(rentals[["lat", "lon"]])
+    places = pd.concat(places).round(6).drop_duplicates()
+    return load_or_build_travel_matrix(
+        Graph,
+        places["lat"].to_numpy(),
+        places["lon"].to_numpy(),
+        transportation,
+        SPEEDS.get(transportation, 5),
+        max_meters=max_meters,
     )
 
+
+# Picks the stops of a tour and the order to visit them in, with rentals and
+# hotels inserted. Returns the route points (start first) and the amenity rows
+# daily_schedule() reads names and types from. coordinates and the pinned
+# places the tour must visit are passed on to find_nearest_amenities().
+# restaurants=None means they weren't fetched, and stops are added as if
+# there were some.
+def plan_stops(
+    popular_amenities,
+    start_coords,
+    tour_length,
+    num_amenities,
+    transportation,
+    want_rental,
+    stay_hotel,
+    restaurants,
+    rentals,
+    lodging_points,
+    solver="nearest",
+    score="tags",
+    deadline=None,
+    restarts=1,
+    travel=None,
+    coordinates=None,
+    pinned=None,
+):
+    deadline = deadline or Deadline()
+
+    with stage("select_stops") as s:
+        if solver == "orienteering":
+            # Best scoring stops that fit in the days, capped at num_amenities.
+            # With several restarts, run them on all cores and keep the best tour.
+            tour_solver = orienteering_tour
+            if restarts > 1:
+                tour_solver = partial(parallel_orienteering_tour, restarts=restarts)
+            nearest_amenities = tour_solver(
+                popular_amenities,
+                start_coords,
+                tour_length,
+                SPEEDS.get(transportation, 5),
+                max_stops=num_amenities,
+                score=score,
+                deadline=deadline.child(0.3),
+            )
+            num_amenities = len(nearest_amenities)
+        else:
+            nearest_amenities = find_nearest_amenities(
+                popular_amenities,
+                start_coords,
+                num_amenities,
+                deadline.child(0.2),
+                travel,
+                coordinates,
+                pinned,
+                SPEEDS.get(transportation, 5),
+            )
+            # The 2-opt pass works on straight-line distances, so it would only
+            # undo the network-aware order
+            if solver == "nearest-2opt" and travel is None:
+                nearest_amenities = improve_route_order(
+                    nearest_amenities, start_coords, deadline.child(0.2)
+                )
+        s.rows = len(nearest_amenities)
+    if nearest_amenities.empty:
+        raise ValueError("no places to visit, try another theme or start")
+
     route_points = [[start_coords[0], start_coords[1]]] + nearest_amenities[
         ["lat", "lon"]
     ].values.tolist()
 
-    restaurants = get_restaurants(regions)
-
-    # Adds a rental if transportation is walking
-    if transportation == "walk" and want_rental == "yes":
-        rentals = get_rental(regions)
-
-    if stay_hotel:
-        housing = data[data["amenity"] == "housing co-op"]
-        hotels = get_hotels(regions)
-
-        if not hotels.empty or not housing.empty:
-            # Combine hotels and housing
-            lodging_points = pd.concat([housing, hotels], ignore_index=True)
-    else:
-        lodging_points = None
-
-    if not restaurants.empty:
+    if restaurants is None or not restaurants.empty:
         updated_route_points = [route_points[0]]  # Start point remains the same
         updated_amenities = pd.DataFrame([nearest_amenities.iloc[0]])  # First point
 
@@ -994,13 +1372,10 @@ def main():
 
         # (Optionally, still add a rental if needed)
         if want_rental == "yes":
-            rentals["distance"] = rentals.apply(
-                lambda row: haversine(
-                    start_coords[0], start_coords[1], row["lat"], row["lon"]
-                ),
-                axis=1,
+            distance = haversine(
+                start_coords[0], start_coords[1], rentals["lat"], rentals["lon"]
             )
-            nearest_rental = rentals.nsmallest(1, "distance").iloc[0]
+            nearest_rental = rentals.iloc[np.argmin(distance)].copy()
             updated_route_points.append([nearest_rental["lat"], nearest_rental["lon"]])
             nearest_rental["type"] = "rental"
             updated_amenities = pd.concat(
@@ -1023,15 +1398,19 @@ def main():
             # End of the day: Reset counters and add a hotel if needed
             if day_index >= amenities_per_day:
                 day_index = 0
-                if stay_hotel and not lodging_points.empty:
+                if (
+                    stay_hotel
+                    and lodging_points is not None
+                    and not lodging_points.empty
+                ):
                     last_point = updated_route_points[-1]
-                    lodging_points["distance"] = lodging_points.apply(
-                        lambda row: haversine(
-                            last_point[0], last_point[1], row["lat"], row["lon"]
-                        ),
-                        axis=1,
+                    distance = haversine(
+                        last_point[0],
+                        last_point[1],
+                        lodging_points["lat"],
+                        lodging_points["lon"],
                     )
-                    nearest_lodging = lodging_points.nsmallest(1, "distance").iloc[0]
+                    nearest_lodging = lodging_points.iloc[np.argmin(distance)].copy()
                     updated_route_points.append(
                         [nearest_lodging["lat"], nearest_lodging["lon"]]
                     )
@@ -1044,32 +1423,177 @@ def main():
         route_points = updated_route_points
         nearest_amenities = updated_amenities
 
-    print("Creating Map... This could take a minute...")
-    Graph = ox.graph_from_place(regions, network_type=transportation, simplify=True)
-    G_undirected = Graph.to_undirected()
-    largest_component = max(nx.connected_components(G_undirected), key=len)
-    Graph = G_undirected.subgraph(largest_component).copy()
+    return route_points, nearest_amenities
 
-    schedule = daily_schedule(
-        route_points, nearest_amenities, transportation, tour_length, lodging_points
-    )
-
-    scheduled_coords = [[stop["lat"], stop["lon"]] for stop in schedule]
-    route = get_street_route(Graph, scheduled_coords)
 
-    tour_map = create_tour_map(schedule, route)
-    tour_map.save("nearest_amenities_tour.html")
+# Saves the map and a csv file with the amenity order of a planned Itinerary.
+# map_path=None only writes the csv, without importing folium.
+def save_tour(
+    itinerary,
+    map_path="nearest_amenities_tour.html",
+    csv_path="tour_schedule.csv",
+):
+    if map_path is not None:
+        with stage("create_tour_map"):
+            tour_map = create_tour_map(itinerary.schedule, itinerary.route)
+            tour_map.save(map_path)
 
     # Saves into a csv file for amenity order.
-    schedule_df = pd.DataFrame(schedule)
-
-    schedule_df["arrival"] = schedule_df["arrival"].dt.strftime("%H:%M")
-    schedule_df["departure"] = schedule_df["departure"].dt.strftime("%H:%M")
+    with stage("save_csv"):
+        itinerary.to_frame().to_csv(csv_path, index=False)
+
+
+def main(
+    solver="nearest",
+    score="tags",
+    deadline_ms=None,
+    restarts=1,
+    use_travel_matrix=False,
+    no_map=False,
+    report_path=None,
+    profile_path=None,
+    must_visit=(),
+):
+    from instrument import Recorder
+
+    options = (solver, score, deadline_ms, restarts, use_travel_matrix, no_map)
+    # Stage timings are only recorded when a report was asked for
+    if report_path is None and profile_path is None:
+        return plan_and_save(*options, must_visit)
+    with Recorder(profile_path) as recorder:
+        plan_and_save(*options, must_visit)
+    if report_path is not None:
+        recorder.save(report_path)
+        print(f"Stage report written to {report_path}")
+    if recorder.profile_written:
+        print(f"Profile written to {recorder.profile_written}")
+
+
+def plan_and_save(
+    solver, score, deadline_ms, restarts, use_travel_matrix, no_map, must_visit=()
+):
+    # planner.py builds on the functions in this file, so it can only be
+    # imported once they exist
+    from planner import TourPlanner, TourRequest
+    from prefetch import Prefetcher
+
+    planner = TourPlanner()
+    # Downloads start now and carry on while the questions are answered
+    prefetcher = Prefetcher(planner, street_networks=not no_map).start()
+    # Get inputs
+    with stage("prompts"):
+        (
+            tour_length,
+            theme,
+            num_amenities,
+            start_coords,
+            transportation,
+            want_rental,
+            stay_hotel,
+        ) = input_field(on_transport=prefetcher.on_transport)
+
+    request = TourRequest(
+        tour_length,
+        theme,
+        num_amenities,
+        start_coords,
+        transportation,
+        want_rental=want_rental == "yes",
+        stay_hotel=stay_hotel,
+        solver=solver,
+        score=score,
+        deadline_ms=deadline_ms,
+        restarts=restarts,
+        use_travel_matrix=use_travel_matrix,
+        schedule_only=no_map,
+        must_visit=tuple(must_visit),
+    )
+    with stage("plan"):
+        itinerary = planner.plan(request)
 
-    schedule_df = schedule_df[["name", "arrival", "departure"]]
+    if itinerary.truncated:
+        print(
+            "Deadline reached, best-so-far results were used for: "
+            + ", ".join(itinerary.truncated)
+        )
 
-    schedule_df.to_csv("tour_schedule.csv", index=False)
+    save_tour(itinerary, map_path=None if no_map else "nearest_amenities_tour.html")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="CMPT 353 personalized tour planner")
+    parser.add_argument(
+        "--solver",
+        choices=SOLVERS,
+        default="nearest",
+        help="nearest: visit the closest amenities, nearest-2opt: the same, "
+        "reordered by 2-opt to cut down on backtracking, orienteering: maximize "
+        "the score of the amenities that fit in the tour days",
+    )
+    parser.add_argument(
+        "--score",
+        choices=sorted(SCORES),
+        default="tags",
+        help="what the orienteering solver maximizes",
+    )
+    parser.add_argument(
+        "--deadline-ms",
+        type=int,
+        default=None,
+        help="time budget for planning in milliseconds, stages past the budget "
+        "return their best result so far and routes fall back to straight lines",
+    )
+    parser.add_argument(
+        "--restarts",
+        type=int,
+        default=1,
+        help="independent orienteering searches to run in parallel, the best "
+        "tour is kept (same seed and restarts always give the same tour)",
+    )
+    parser.add_argument(
+        "--travel-matrix",
+        action="store_true",
+        help="choose and schedule stops by street network travel time, using a "
+        "travel matrix cached in travel_cache/ (built on the first run)",
+    )
+    parser.add_argument(
+        "--no-map",
+        action="store_true",
+        help="only write tour_schedule.csv: skips the street network download "
+        "and the map, travel times are straight-line estimates",
+    )
+    parser.add_argument(
+        "--report",
+        nargs="?",
+        const="tour_report.json",
+        default=None,
+        help="write wall time, CPU time, memory and network bytes of every "
+        "stage to this JSON file (default tour_report.json)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="tour_profile",
+        default=None,
+        help="profile the whole run (pyinstrument if installed, else cProfile)",
+    )
+    parser.add_argument(
+        "--must-visit",
+        action="append",
+        default=[],
+        metavar="PLACE",
+        help="name (or Wikidata id) of a place the tour has to visit, can be "
+        "given several times",
+    )
+    args = parser.parse_args()
+    main(
+        solver=args.solver,
+        score=args.score,
+        deadline_ms=args.deadline_ms,
+        restarts=args.restarts,
+        use_travel_matrix=args.travel_matrix,
+        no_map=args.no_map,
+        report_path=args.report,
+        profile_path=args.profile,
+        must_visit=args.must_visit,
+    )
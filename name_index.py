@@ -0,0 +1,116 @@
+# Name search over the amenities
+#
+# Every name and official_name is normalized like the amenity store's names
+# (casefolded, no punctuation) and split into the trigrams of "  name ", so
+# the two padded trigrams at the start make names beginning with the query
+# rank higher. Like TagStore, the trigrams are interned and the entries
+# holding each are kept in CSR form:
+#
+#   trigrams   trigram -> id
+#   indptr     entries of trigram i are entries[indptr[i]:indptr[i + 1]]
+#   sizes      number of distinct trigrams of every entry
+#
+# A query looks up its own few trigrams and counts the ones every entry
+# shares with one bincount, so it never compares names one by one. Matches
+# are ranked by the Dice similarity of the two trigram sets, with exact names
+# and names starting with the query first.
+#
+import numpy as np
+
+from amenity_store import normalize_name, normalize_names
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    def __init__(self, rows, names, normalized, trigram_ids, indptr, entries, sizes):
+        self.rows = rows
+        self.names = names
+        self.normalized = normalized
+        self.trigram_ids = trigram_ids
+        self.indptr = indptr
+        self.entries = entries
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Index of the names in each of name_columns (arrays of names or None,
+    # aligned with rows). A row is found by any of its names.
+    @classmethod
+    def build(cls, rows, *name_columns):
+        entry_rows, names, normalized = [], [], []
+        for column in name_columns:
+            keys = normalize_names(column)
+            for row, name, key in zip(rows, column, keys):
+                if isinstance(name, str) and key:
+                    entry_rows.append(row)
+                    names.append(name)
+                    normalized.append(key)
+
+        trigram_ids = {}
+        postings = []
+        sizes = np.zeros(len(names), dtype=np.int32)
+        for entry, key in enumerate(normalized):
+            grams = trigrams(key)
+            sizes[entry] = len(grams)
+            for gram in grams:
+                postings.append((trigram_ids.setdefault(gram, len(trigram_ids)), entry))
+
+        postings = np.array(postings, dtype=np.int32).reshape(-1, 2)
+        postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+        indptr = np.zeros(len(trigram_ids) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(postings[:, 0], minlength=len(trigram_ids)), out=indptr[1:]
+        )
+        return cls(
+            entry_rows,
+            names,
+            normalized,
+            trigram_ids,
+            indptr,
+            postings[:, 1].copy(),
+            sizes,
+        )
+
+    # The best matches of query as (row, name, score), best first, one per
+    # row. score is the Dice similarity (0-1), plus 1 for the exact name and
+    # 0.5 for names starting with the query.
+    def search(self, query, limit=5):
+        key = normalize_name(query)
+        if not key:
+            return []
+        grams = trigrams(key)
+        ids = [self.trigram_ids[gram] for gram in grams if gram in self.trigram_ids]
+        if not ids:
+            return []
+        hits = np.concatenate(
+            [self.entries[self.indptr[i] : self.indptr[i + 1]] for i in ids]
+        )
+        shared = np.bincount(hits, minlength=len(self))
+        matched = np.flatnonzero(shared)
+        scores = 2 * shared[matched] / (len(grams) + self.sizes[matched])
+        # An exact name or one starting with the query shares every trigram of
+        # it but the last, so only those and the most similar names are ranked
+        ranked = shared[matched] >= len(grams) - 1
+        if len(matched) > limit:
+            ranked[np.argpartition(-scores, limit)[:limit]] = True
+        else:
+            ranked[:] = True
+        matched, scores = matched[ranked], scores[ranked]
+
+        results = {}
+        for entry, score in zip(matched, scores):
+            normalized = self.normalized[entry]
+            if normalized == key:
+                score += 1
+            elif normalized.startswith(key):
+                score += 0.5
+            row = self.rows[entry]
+            if row not in results or score > results[row][1]:
+                results[row] = (self.names[entry], float(score))
+        ranked = sorted(results.items(), key=lambda item: -item[1][1])
+        return [(row, name, score) for row, (name, score) in ranked[:limit]]
@@ -0,0 +1,481 @@
+# Orienteering-style tour optimizer
+#
+# find_nearest_amenities() always visits the N closest places. The solver here
+# instead picks the stops that maximize a score (tag count, Wikidata presence)
+# while keeping every day inside the same 9:00-21:00 window and travel speeds
+# that daily_schedule() uses.
+#
+import math
+import numpy as np
+import pandas as pd
+from deadline import out_of_time
+
+EARTH_RADIUS_KM = 6371
+DAY_MINUTES = 12 * 60  # Tour days run from 9am to 9pm
+VISIT_MINUTES = 60  # Same as time_spent["default"] in daily_schedule
+
+
+# Popular amenities carry more tags, so the tag count doubles as a score
+def tag_count_score(amenities):
+    if "tag_count" in amenities.columns:
+        return amenities["tag_count"].to_numpy(dtype=float)
+    return amenities["tags"].apply(len).to_numpy(dtype=float)
+
+
+# Places linked to Wikidata are worth a lot more, tag count only breaks ties
+def wikidata_score(amenities):
+    if "has_wikidata" in amenities.columns:
+        has_wikidata = amenities["has_wikidata"]
+    else:
+        has_wikidata = amenities["tags"].apply(
+            lambda tags: "wikidata" in tags or "brand:wikidata" in tags
+        )
+    tag_count = tag_count_score(amenities)
+    tie_break = tag_count / (tag_count.max() + 1) if len(tag_count) else tag_count
+    return has_wikidata.to_numpy(dtype=float) + tie_break
+
+
+SCORES = {"tags": tag_count_score, "wikidata": wikidata_score}
+
+
+# Buckets points into a lat/lon grid so that only amenities around the current
+# stop get their distance computed, instead of the whole candidate set.
+class GridIndex:
+    def __init__(self, lats, lons, target_per_cell=8):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+
+        # Size cells so that each holds roughly target_per_cell points, and
+        # stretch them in longitude so they are close to square on the ground
+        lat_span = max(np.ptp(self.lats), 1e-3) if len(self.lats) else 1.0
+        lon_span = max(np.ptp(self.lons), 1e-3) if len(self.lons) else 1.0
+        cells = max(len(self.lats) / target_per_cell, 1)
+        mean_lat = np.mean(self.lats) if len(self.lats) else 0.0
+        self.lon_scale = math.cos(math.radians(mean_lat))
+        self.cell_lat = math.sqrt(lat_span * lon_span * self.lon_scale / cells)
+        self.cell_lon = self.cell_lat / self.lon_scale
+
+        rows = np.floor(self.lats / self.cell_lat).astype(np.int64)
+        cols = np.floor(self.lons / self.cell_lon).astype(np.int64)
+        buckets = {}
+        for idx, key in enumerate(zip(rows.tolist(), cols.tolist())):
+            buckets.setdefault(key, []).append(idx)
+        self.cells = {key: np.array(idx) for key, idx in buckets.items()}
+
+        if len(rows):
+            self.row_range = (rows.min(), rows.max())
+            self.col_range = (cols.min(), cols.max())
+        else:
+            self.row_range = self.col_range = (0, -1)
+
+    def cell_of(self, lat, lon):
+        return (
+            math.floor(lat / self.cell_lat),
+            math.floor(lon / self.cell_lon),
+        )
+
+    # Indices stored in the cells forming the square ring at distance `ring`
+    def _ring(self, row, col, ring):
+        if ring == 0:
+            cell = self.cells.get((row, col))
+            return [cell] if cell is not None else []
+
+        found = []
+        for r in range(row - ring, row + ring + 1):
+            if not self.row_range[0] <= r <= self.row_range[1]:
+                continue
+            if r in (row - ring, row + ring):
+                cols = range(col - ring, col + ring + 1)
+            else:
+                cols = (col - ring, col + ring)
+            for c in cols:
+                cell = self.cells.get((r, c))
+                if cell is not None:
+                    found.append(cell)
+        return found
+
+    # Returns indices of at least k points around (lat, lon) when there are
+    # that many, skipping masked-out points and never looking past max_km
+    def nearby(self, lat, lon, k, available=None, max_km=None):
+        row, col = self.cell_of(lat, lon)
+        max_ring = max(
+            abs(row - self.row_range[0]),
+            abs(row - self.row_range[1]),
+            abs(col - self.col_range[0]),
+            abs(col - self.col_range[1]),
+        )
+        if max_km is not None:
+            cell_km = self.cell_lat * math.pi / 180 * EARTH_RADIUS_KM
+            max_ring = min(max_ring, int(max_km / cell_km) + 1)
+
+        found = []
+        count = 0
+        extra_ring = None
+        for ring in range(max_ring + 1):
+            for cell in self._ring(row, col, ring):
+                if available is not None:
+                    cell = cell[available[cell]]
+                if len(cell):
+                    found.append(cell)
+                    count += len(cell)
+            # Once we have enough points, one more ring catches the corners
+            # that may be closer than points already found
+            if extra_ring is not None:
+                break
+            if count >= k:
+                extra_ring = ring + 1
+
+        if not found:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(found)
+
+
+# Beam search + iterated local search over a candidate set given as arrays.
+# Stops are referred to by index; the start location is stored as one extra
+# point at index `origin` that is never visited.
+class TourSolver:
+    def __init__(
+        self,
+        lats,
+        lons,
+        scores,
+        start_coords,
+        speed_kmh,
+        visit_minutes=VISIT_MINUTES,
+        day_minutes=DAY_MINUTES,
+        beam_width=8,
+        branching=6,
+    ):
+        lats = np.append(np.asarray(lats, dtype=float), start_coords[0])
+        lons = np.append(np.asarray(lons, dtype=float), start_coords[1])
+        self.origin = len(lats) - 1
+        self.lat_rad = np.radians(lats)
+        self.lon_rad = np.radians(lons)
+        self.cos_lat = np.cos(self.lat_rad)
+        self.scores = np.append(np.asarray(scores, dtype=float), 0.0)
+        self.index = GridIndex(lats[:-1], lons[:-1])
+
+        self.speed_kmh = speed_kmh
+        self.visit_minutes = visit_minutes
+        self.day_minutes = day_minutes
+        self.beam_width = beam_width
+        self.branching = branching
+        self._legs = {}
+
+    # Travel minutes from stop a to each of the stops in b, same formula as
+    # daily_schedule (haversine / speed, at least one minute)
+    def travel_minutes(self, a, b):
+        dlat = self.lat_rad[b] - self.lat_rad[a]
+        dlon = self.lon_rad[b] - self.lon_rad[a]
+        h = (
+            np.sin(dlat / 2) ** 2
+            + self.cos_lat[a] * self.cos_lat[b] * np.sin(dlon / 2) ** 2
+        )
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+        return np.maximum(km / self.speed_kmh * 60, 1)
+
+    def leg(self, a, b):
+        key = (a, b) if a < b else (b, a)
+        minutes = self._legs.get(key)
+        if minutes is None:
+            minutes = float(self.travel_minutes(a, b))
+            self._legs[key] = minutes
+        return minutes
+
+    def day_minutes_used(self, start, path):
+        minutes = 0.0
+        current = start
+        for stop in path:
+            minutes += self.leg(current, stop) + self.visit_minutes
+            current = stop
+        return minutes
+
+    def day_starts(self, days):
+        starts = []
+        current = self.origin
+        for path in days:
+            starts.append(current)
+            if path:
+                current = path[-1]
+        return starts
+
+    def feasible(self, days):
+        return all(
+            self.day_minutes_used(start, path) <= self.day_minutes
+            for start, path in zip(self.day_starts(days), days)
+        )
+
+    def total_score(self, days):
+        return float(sum(self.scores[path].sum() for path in days if path))
+
+    # Higher score first, then less time spent travelling
+    def rank(self, days):
+        return (self.total_score(days), -self.total_minutes(days))
+
+    def total_minutes(self, days):
+        return sum(
+            self.day_minutes_used(start, path)
+            for start, path in zip(self.day_starts(days), days)
+        )
+
+    # Unvisited candidates near `stop` that still fit in `minutes_left`
+    def _candidates(self, stop, visited, minutes_left, k):
+        reach_km = (minutes_left - self.visit_minutes) / 60 * self.speed_kmh
+        if reach_km < 0:
+            return np.array([], dtype=np.int64), np.array([])
+        lat = math.degrees(self.lat_rad[stop])
+        lon = math.degrees(self.lon_rad[stop])
+        cand = self.index.nearby(lat, lon, k, available=~visited, max_km=reach_km)
+        if not len(cand):
+            return cand, np.array([])
+        cost = self.travel_minutes(stop, cand) + self.visit_minutes
+        keep = cost <= minutes_left
+        return cand[keep], cost[keep]
+
+    # Beam search for one day: each state is extended by the `branching` best
+    # score-per-minute candidates, and only the best `beam_width` survive.
+    # With noise > 0 the ratios are jittered so that restarts explore
+    # different tours.
+    def build_day(self, start, visited, max_stops, deadline=None, rng=None, noise=0.0):
+        beam = [(0.0, 0.0, [])]
+        best = beam[0]
+        for _ in range(max_stops):
+            if out_of_time(deadline, "orienteering_tour"):
+                break
+            expansions = {}
+            for score, minutes, path in beam:
+                mask = visited.copy()
+                mask[path] = True
+                stop = path[-1] if path else start
+                cand, cost = self._candidates(
+                    stop, mask, self.day_minutes - minutes, self.branching * 4
+                )
+                if not len(cand):
+                    continue
+                ratio = self.scores[cand] / cost
+                if noise:
+                    ratio = ratio * rng.uniform(1 - noise, 1 + noise, len(ratio))
+                for j in np.argsort(-ratio, kind="stable")[: self.branching]:
+                    new_path = path + [int(cand[j])]
+                    key = (frozenset(new_path), new_path[-1])
+                    state = (score + self.scores[cand[j]], minutes + cost[j], new_path)
+                    if key not in expansions or state[:2] > expansions[key][:2]:
+                        expansions[key] = state
+            if not expansions:
+                break
+            beam = sorted(expansions.values(), key=lambda s: (-s[0], s[1]))
+            beam = beam[: self.beam_width]
+            if (beam[0][0], -beam[0][1]) > (best[0], -best[1]):
+                best = beam[0]
+        return best[2]
+
+    def construct(self, tour_length, max_stops, deadline=None, rng=None, noise=0.0):
+        visited = np.zeros(len(self.scores), dtype=bool)
+        visited[self.origin] = True
+        days = []
+        start = self.origin
+        remaining = max_stops
+        for _ in range(tour_length):
+            path = []
+            if remaining:
+                path = self.build_day(start, visited, remaining, deadline, rng, noise)
+            days.append(path)
+            visited[path] = True
+            remaining -= len(path)
+            if path:
+                start = path[-1]
+        return days
+
+    # 2-opt on one day. The last stop of a day is where the next day starts,
+    # so it only moves on the final day.
+    def two_opt(self, start, path, fixed_end, deadline=None):
+        improved = True
+        while improved:
+            improved = False
+            route = [start] + path
+            last = len(route) - (2 if fixed_end else 1)
+            for i in range(1, last):
+                # Every reversal leaves a valid route, so we can stop anywhere
+                if out_of_time(deadline, "improve"):
+                    improved = False
+                    break
+                for j in range(i + 1, last + 1):
+                    a, b = route[i - 1], route[i]
+                    c = route[j]
+                    d = route[j + 1] if j + 1 < len(route) else None
+                    before = self.leg(a, b) + (self.leg(c, d) if d is not None else 0)
+                    after = self.leg(a, c) + (self.leg(b, d) if d is not None else 0)
+                    if after < before - 1e-9:
+                        route[i : j + 1] = route[i : j + 1][::-1]
+                        improved = True
+            path[:] = route[1:]
+
+    # Cheapest-insertion of unvisited candidates by score per added minute,
+    # until nothing else fits in any day
+    def insert(self, days, max_stops):
+        visited = np.zeros(len(self.scores), dtype=bool)
+        visited[self.origin] = True
+        for path in days:
+            visited[path] = True
+
+        while sum(len(path) for path in days) < max_stops:
+            best = None
+            starts = self.day_starts(days)
+            for d, path in enumerate(days):
+                used = self.day_minutes_used(starts[d], path)
+                slack = self.day_minutes - used
+                route = [starts[d]] + path
+                # Non-final days keep their last stop, it anchors the next day
+                end = len(route) if d == len(days) - 1 else len(route) - 1
+                for pos in range(max(end, 1)):
+                    a = route[pos]
+                    b = route[pos + 1] if pos + 1 < len(route) else None
+                    cand, cost = self._candidates(
+                        a,
+                        visited,
+                        slack + (self.leg(a, b) if b is not None else 0),
+                        self.branching,
+                    )
+                    if not len(cand):
+                        continue
+                    added = cost.copy()
+                    if b is not None:
+                        added += self.travel_minutes(b, cand) - self.leg(a, b)
+                    ok = added <= slack
+                    if not ok.any():
+                        continue
+                    ratio = np.where(ok, self.scores[cand] / np.maximum(added, 1), -1)
+                    j = int(np.argmax(ratio))
+                    if best is None or ratio[j] > best[0]:
+                        best = (ratio[j], d, pos, int(cand[j]))
+            if best is None:
+                break
+            _, d, pos, stop = best
+            days[d].insert(pos, stop)
+            visited[stop] = True
+        return days
+
+    def local_search(self, days, max_stops):
+        starts = self.day_starts(days)
+        for d, path in enumerate(days):
+            if len(path) > 2:
+                self.two_opt(starts[d], path, fixed_end=d < len(days) - 1)
+        return self.insert(days, max_stops)
+
+    # Drops a random run of stops from one day so the local search can
+    # rebuild that part of the tour differently
+    def perturb(self, days, rng):
+        non_empty = [d for d, path in enumerate(days) if path]
+        if not non_empty:
+            return days
+        d = non_empty[rng.integers(len(non_empty))]
+        path = days[d]
+        length = int(rng.integers(1, min(3, len(path)) + 1))
+        start = int(rng.integers(0, len(path) - length + 1))
+        # Keep the anchor stop of non-final days in place
+        if d < len(days) - 1 and start + length == len(path) and len(path) > 1:
+            start = max(start - 1, 0)
+            length = min(length, len(path) - 1 - start)
+        del path[start : start + length]
+        return days
+
+    def improve(self, days, max_stops, iterations, rng, deadline=None):
+        current = self.local_search([list(path) for path in days], max_stops)
+        if not self.feasible(current):
+            current = [list(path) for path in days]
+        best = current
+        best_key = current_key = self.rank(current)
+
+        for it in range(iterations):
+            if out_of_time(deadline, "improve"):
+                break
+            candidate = self.perturb([list(path) for path in current], rng)
+            candidate = self.local_search(candidate, max_stops)
+            if not self.feasible(candidate):
+                continue
+            candidate_key = self.rank(candidate)
+            if candidate_key >= current_key:
+                current, current_key = candidate, candidate_key
+            if candidate_key > best_key:
+                best, best_key = candidate, candidate_key
+            # Go back to the best tour every so often instead of drifting
+            if it % 50 == 49:
+                current, current_key = best, best_key
+        return best
+
+    def solve(
+        self,
+        tour_length,
+        max_stops=None,
+        iterations=200,
+        seed=0,
+        deadline=None,
+        noise=0.0,
+    ):
+        if max_stops is None:
+            max_stops = len(self.scores) - 1
+        rng = np.random.default_rng(seed)
+        # Half of the time budget goes to building a tour, the rest to improving it
+        build_deadline = None if deadline is None else deadline.child(0.5)
+        days = self.construct(tour_length, max_stops, build_deadline, rng, noise)
+        return self.improve(days, max_stops, iterations, rng, deadline)
+
+
+# Picks and orders amenities to maximize the total score over tour_length days
+# of visits. Returns the chosen rows in visiting order, like
+# find_nearest_amenities, with the planned day in a "tour_day" column.
+def orienteering_tour(
+    amenities,
+    start_coords,
+    tour_length,
+    speed_kmh,
+    max_stops=None,
+    score="tags",
+    iterations=200,
+    seed=0,
+    deadline=None,
+    **solver_options,
+):
+    candidates, scores = scored_candidates(amenities, score)
+    solver = TourSolver(
+        candidates["lat"].to_numpy(),
+        candidates["lon"].to_numpy(),
+        scores,
+        start_coords,
+        speed_kmh,
+        **solver_options,
+    )
+    days = solver.solve(tour_length, max_stops, iterations, seed, deadline)
+    return tour_to_frame(candidates, scores, days)
+
+
+# 2-opt pass over an already chosen route, such as the one from
+# find_nearest_amenities, to cut down on backtracking between stops
+def improve_route_order(route, start_coords, deadline=None):
+    if len(route) < 3:
+        return route
+    solver = TourSolver(
+        route["lat"].to_numpy(),
+        route["lon"].to_numpy(),
+        np.zeros(len(route)),
+        start_coords,
+        speed_kmh=1,
+    )
+    order = list(range(len(route)))
+    solver.two_opt(solver.origin, order, fixed_end=False, deadline=deadline)
+    return route.iloc[order]
+
+
+# Amenities worth visiting under the given score, with their scores
+def scored_candidates(amenities, score="tags"):
+    amenities = amenities.reset_index(drop=True)
+    scores = SCORES[score](amenities)
+    return amenities[scores > 0].reset_index(drop=True), scores[scores > 0]
+
+
+def tour_to_frame(candidates, scores, days):
+    order = [stop for path in days for stop in path]
+    result = candidates.iloc[order].copy()
+    result["tour_day"] = [day + 1 for day, path in enumerate(days) for _ in path]
+    result["score"] = scores[order]
+    return result
@@ -0,0 +1,113 @@
+# Parallel restarts of the orienteering solver
+#
+# Every restart builds and improves a tour from its own seed on a separate
+# core. The candidate coordinates and scores are copied into shared memory once
+# and each worker attaches to them when it starts, so tasks only carry a seed.
+# The best tour wins, with ties going to the lowest restart number, so the
+# result only depends on the seed and the number of restarts, never on the
+# number of workers or the order they finish in.
+#
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from deadline import Deadline
+from optimizer import TourSolver, scored_candidates, tour_to_frame
+
+RESTART_NOISE = 0.3  # How much restarts jitter the beam search ratios
+
+# Set up once per worker process by _init_worker
+_solver = None
+_blocks = []
+
+
+def _share(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach(name, shape, dtype):
+    # Workers share the parent's resource tracker, which unlinks the block
+    # only once the parent is done with it
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(specs, start_coords, speed_kmh, solver_options):
+    global _solver
+    arrays = []
+    for spec in specs:
+        shm, array = _attach(*spec)
+        _blocks.append(shm)  # Keep the mapping alive as long as the worker
+        arrays.append(array)
+    _solver = TourSolver(*arrays, start_coords, speed_kmh, **solver_options)
+
+
+def _run_restart(task):
+    restart, seed, tour_length, max_stops, iterations, seconds = task
+    deadline = Deadline(seconds)
+    # Restart 0 is the plain deterministic beam search, the others explore
+    noise = RESTART_NOISE if restart else 0.0
+    days = _solver.solve(tour_length, max_stops, iterations, seed, deadline, noise)
+    return restart, _solver.rank(days), days, deadline.truncated
+
+
+# Same result shape as optimizer.orienteering_tour, but runs `restarts`
+# independent searches over a process pool and keeps the best tour
+def parallel_orienteering_tour(
+    amenities,
+    start_coords,
+    tour_length,
+    speed_kmh,
+    max_stops=None,
+    score="tags",
+    iterations=200,
+    seed=0,
+    restarts=None,
+    workers=None,
+    deadline=None,
+    **solver_options,
+):
+    workers = workers or os.cpu_count() or 1
+    restarts = restarts or workers
+    candidates, scores = scored_candidates(amenities, score)
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    seconds = None
+    if deadline is not None and deadline.expires_at is not None:
+        seconds = deadline.remaining()
+
+    blocks = []
+    try:
+        specs = []
+        for array in (
+            candidates["lat"].to_numpy(dtype=float),
+            candidates["lon"].to_numpy(dtype=float),
+            np.asarray(scores, dtype=float),
+        ):
+            shm, spec = _share(array)
+            blocks.append(shm)
+            specs.append(spec)
+
+        tasks = [
+            (restart, seeds[restart], tour_length, max_stops, iterations, seconds)
+            for restart in range(restarts)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, restarts),
+            initializer=_init_worker,
+            initargs=(specs, start_coords, speed_kmh, solver_options),
+        ) as pool:
+            results = list(pool.map(_run_restart, tasks))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    best = max(results, key=lambda result: (result[1], -result[0]))
+    if deadline is not None:
+        for _, _, _, truncated in results:
+            for stage in truncated:
+                deadline.truncate(stage)
+    return tour_to_frame(candidates, scores, best[2])
@@ -0,0 +1,210 @@
+# Cache of finished tour plans
+#
+# Many requests ask for nearly the same tour (same theme and number of stops
+# from the same downtown hotel). Requests are normalized first: the start is
+# snapped to the centre of a small grid cell and options that can't change the
+# tour are dropped, so all of them share one key. Plans are kept in memory
+# (least recently used are evicted first) and optionally in a directory on
+# disk, both expiring after ttl_seconds. When the same key is requested again
+# while it is still being planned, the second caller waits for the first plan
+# instead of computing its own.
+#
+import dataclasses
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+CELL_DEG = 0.002  # About 220 m north-south, 150 m east-west in Vancouver
+
+
+# Same request with the start at the centre of its grid cell, and a rental
+# only when walking (the only mode that uses one)
+def normalize_request(request, cell_deg=CELL_DEG):
+    lat, lon = request.start_coords
+    snapped = (
+        round((int(lat // cell_deg) + 0.5) * cell_deg, 6),
+        round((int(lon // cell_deg) + 0.5) * cell_deg, 6),
+    )
+    return dataclasses.replace(
+        request,
+        start_coords=snapped,
+        want_rental=bool(request.want_rental and request.transportation == "walk"),
+        stay_hotel=bool(request.stay_hotel),
+    )
+
+
+# Everything that decides the tour. The deadline isn't part of it since
+# plans that ran out of time are not cached.
+def request_key(request, *extra):
+    request = normalize_request(request)
+    return (
+        request.start_coords,
+        request.theme,
+        request.num_amenities,
+        request.transportation,
+        request.want_rental,
+        request.stay_hotel,
+        request.tour_length,
+        request.solver,
+        request.score,
+        request.restarts,
+        request.use_travel_matrix,
+        request.schedule_only,
+        tuple(request.must_visit),
+    ) + extra
+
+
+class PlanCache:
+    def __init__(
+        self, max_entries=256, ttl_seconds=3600, cache_dir=None, max_disk_entries=4096
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}  # key -> Future of the plan being computed
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "entries": len(self._memory),
+            }
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def _get_memory(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _put_memory(self, key, value, now):
+        self._memory[key] = (now + self.ttl_seconds, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _get_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl_seconds < now:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return (pickle.load(f),)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    # Written to a temporary file first so a reader never sees half a plan.
+    # Past max_disk_entries the oldest files are removed.
+    def _put_disk(self, key, value):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+
+        files = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(".pkl")
+        ]
+        if len(files) > self.max_disk_entries:
+            files.sort(key=os.path.getmtime)
+            for old in files[: len(files) - self.max_disk_entries]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    # Cached value for key, or compute() run once for every caller waiting on
+    # the same key. Values keep() rejects are returned but not stored.
+    def get_or_compute(self, key, compute, keep=None):
+        now = time.time()
+        owner = False
+        with self._lock:
+            entry = self._get_memory(key, now)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            pending = self._in_flight.get(key)
+            if pending is not None:
+                self.coalesced += 1
+            else:
+                pending = self._in_flight[key] = Future()
+                owner = True
+        if not owner:
+            return pending.result()
+
+        try:
+            found = self._get_disk(key, now)
+            if found is not None:
+                value = found[0]
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, value, time.time())
+            else:
+                with self._lock:
+                    self.misses += 1
+                value = compute()
+                if keep is None or keep(value):
+                    with self._lock:
+                        self._put_memory(key, value, time.time())
+                    self._put_disk(key, value)
+            pending.set_result(value)
+            return value
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+
+# TourPlanner with the same plan() but answered from a PlanCache when an
+# equivalent tour was planned before
+class CachedPlanner:
+    def __init__(self, planner, cache=None):
+        self.planner = planner
+        self.cache = cache or PlanCache()
+
+    def __getattr__(self, name):
+        return getattr(self.planner, name)
+
+    def plan(self, request):
+        request = normalize_request(request)
+        return self.cache.get_or_compute(
+            request_key(request),
+            lambda: self.planner.plan(request),
+            keep=lambda itinerary: not itinerary.truncated,
+        )
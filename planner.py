@@ -0,0 +1,638 @@
+# Reusable tour planner
+#
+# TourPlanner holds everything that is slow to load (amenities, OpenStreetMap
+# downloads, street graphs, travel matrices), each loaded on first use and then
+# kept, and plans tours from it with plan(request) -> Itinerary. Planning does
+# no prompting, geocoding or file output, so the CLI, batch mode and the
+# planning service all share one warm instance and only differ in how they
+# get requests and what they do with the itinerary.
+#
+import dataclasses
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from coordinates import Coordinates
+from deadline import Deadline
+from instrument import stage
+from isochrone import reachable_mask, reachable_nodes, search_meters, start_node
+from main import (
+    SOLVERS,
+    SPEEDS,
+    THEMES,
+    TRANSPORT_MODES,
+    daily_schedule,
+    find_nearest_amenities,
+    get_lodging,
+    get_rental,
+    get_restaurants,
+    get_travel_matrix,
+    in_bounds,
+    load_amenities,
+    load_amenity_coordinates,
+    load_amenity_tags,
+    load_amenity_tile_index,
+    load_amenity_tiles,
+    leg_minutes,
+    minutes_to_rows,
+    load_street_graph,
+    plan_stops,
+    regions,
+    select_candidates,
+)
+from name_index import NameIndex
+from optimizer import SCORES
+from routing import StreetRouter
+
+END_OF_DAY = "Hotel (End of Day)"
+# Tours read the amenity tiles within this distance of the start first, and
+# twice as far each time there are fewer than CANDIDATES_PER_STOP candidates
+# per stop
+NEARBY_RADIUS_M = {"walk": 3_000, "bike": 8_000, "drive": 20_000}
+CANDIDATES_PER_STOP = 5
+# A must-visit name needs a match at least this similar (see NameIndex.search)
+MIN_NAME_SCORE = 0.4
+# Street network searches kept for later tours from the same start (see
+# reachable_candidates), the least recently used dropped first
+ISOCHRONES_KEPT = 64
+WIKIDATA_ID = re.compile(r"Q[0-9]+")
+DAY_ONE = datetime(2025, 1, 1, 9, 0)  # Same 9am start as daily_schedule
+
+
+@dataclass
+class TourRequest:
+    tour_length: int
+    theme: str
+    num_amenities: int
+    start_coords: tuple
+    transportation: str = "walk"
+    want_rental: bool = False
+    stay_hotel: bool = False
+    solver: str = "nearest"
+    score: str = "tags"
+    deadline_ms: int = None
+    restarts: int = 1
+    use_travel_matrix: bool = False
+    # Skip the street network: travel times are straight-line estimates (or
+    # read from the travel matrix) and the route is not drawn along streets
+    schedule_only: bool = False
+    # Places the tour has to visit: names, Wikidata ids ("Q...") or amenity
+    # indexes (see TourPlanner.must_visit)
+    must_visit: tuple = ()
+
+    # Raises ValueError for requests input_field() would not have accepted
+    def validate(self):
+        for name in ("tour_length", "num_amenities"):
+            if not isinstance(getattr(self, name), int) or getattr(self, name) <= 0:
+                raise ValueError(f"'{name}' must be a positive integer")
+        if self.theme not in THEMES:
+            raise ValueError(f"theme must be one of: {', '.join(THEMES)}")
+        if self.transportation not in TRANSPORT_MODES:
+            raise ValueError(
+                f"transportation must be one of: {', '.join(TRANSPORT_MODES)}"
+            )
+        if self.solver not in SOLVERS:
+            raise ValueError(f"solver must be one of: {', '.join(SOLVERS)}")
+        if self.score not in SCORES:
+            raise ValueError(f"score must be one of: {', '.join(sorted(SCORES))}")
+        for place in self.must_visit:
+            valid_id = isinstance(place, int) and not isinstance(place, bool)
+            if not valid_id and not (isinstance(place, str) and place.strip()):
+                raise ValueError("must_visit takes place names or ids")
+        if self.must_visit and self.solver == "orienteering":
+            raise ValueError("must_visit places need a nearest solver")
+        if not in_bounds(*self.start_coords):
+            raise ValueError(
+                f"start location {self.start_coords} is outside the allowed area"
+            )
+
+
+# A planned tour. Besides the schedule and route it keeps what they were
+# computed from, so an edit (drop_stop, swap_hotel, add_day) reschedules only
+# the days from the edit on and routes only legs the router hasn't seen. Edits
+# return a new Itinerary and leave this one as it was.
+@dataclass
+class Itinerary:
+    request: TourRequest
+    # One dict per stop with name, lat, lon, arrival, departure and the index
+    # of its route point
+    schedule: list
+    # [[lat, lon], ...] along the streets through every stop
+    route: list
+    # Planning stages that ran out of time and used their best result so far
+    truncated: list = field(default_factory=list)
+    route_points: list = field(default=None, repr=False)
+    amenities: pd.DataFrame = field(default=None, repr=False)
+    lodging: pd.DataFrame = field(default=None, repr=False)
+    router: StreetRouter = field(default=None, repr=False)
+    # The places the stops were picked from, for add_day
+    candidates: pd.DataFrame = field(default=None, repr=False)
+
+    # The router holds the street graph and the candidates can be most of a
+    # theme, neither worth pickling with every cached plan. Unpickled
+    # itineraries can't be edited.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["router"] = None
+        state["candidates"] = None
+        return state
+
+    # The stop order and times, as written to tour_schedule.csv
+    def to_frame(self):
+        frame = pd.DataFrame(self.schedule)
+        frame["arrival"] = frame["arrival"].dt.strftime("%H:%M")
+        frame["departure"] = frame["departure"].dt.strftime("%H:%M")
+        return frame[["name", "arrival", "departure"]]
+
+    def _speed(self):
+        return SPEEDS.get(self.request.transportation, 5)
+
+    # Lodging minus the hotels already slept in before day
+    def _free_lodging(self, day, schedule=None):
+        if self.lodging is None:
+            return None
+        used = {
+            (round(stop["lat"], 6), round(stop["lon"], 6))
+            for stop in (schedule or self.schedule)
+            if stop["name"] == END_OF_DAY and stop["day"] < day
+        }
+        keys = zip(self.lodging["lat"].round(6), self.lodging["lon"].round(6))
+        return self.lodging[[key not in used for key in keys]].copy()
+
+    # Where the tour stands on the morning of day: the route point to continue
+    # from and the last place visited. None if the tour ended before it.
+    def _morning(self, day, schedule):
+        if day == 1:
+            return 1, None
+        nights = [
+            stop
+            for stop in schedule
+            if stop["name"] == END_OF_DAY and stop["day"] == day - 1
+        ]
+        if not nights:
+            return None
+        visited = [
+            stop
+            for stop in schedule
+            if stop["day"] < day and stop["name"] != END_OF_DAY
+        ]
+        return nights[-1]["point"], [visited[-1]["lat"], visited[-1]["lon"]]
+
+    # Keeps the days before day from schedule and plans the rest again
+    def _reschedule(self, day, schedule=None, deadline=None):
+        if self.router is None:
+            raise ValueError("this itinerary has no router, plan it again to edit it")
+        schedule = self.schedule if schedule is None else schedule
+        deadline = deadline or Deadline()
+        self.router.deadline = deadline
+
+        kept = [stop for stop in schedule if stop["day"] < day]
+        morning = self._morning(day, schedule)
+        if morning is not None:
+            start_index, start_location = morning
+            with stage("daily_schedule") as s:
+                kept += daily_schedule(
+                    self.route_points,
+                    self.amenities,
+                    self.request.transportation,
+                    self.request.tour_length,
+                    self._free_lodging(day, schedule),
+                    deadline.child(0.6),
+                    self.router,
+                    first_day=day,
+                    start_index=start_index,
+                    start_location=start_location,
+                )
+                s.rows = len(kept)
+        with stage("get_street_route") as s:
+            route = self.router.route([[stop["lat"], stop["lon"]] for stop in kept])
+            s.rows = len(route)
+        return dataclasses.replace(
+            self, schedule=kept, route=route, truncated=deadline.truncated
+        )
+
+    # Removes the stop at this position of the schedule
+    def drop_stop(self, position, deadline_ms=None):
+        stop = self.schedule[position]
+        if stop["type"] == "start" or stop["name"] == END_OF_DAY:
+            raise ValueError("only visited places can be dropped from the tour")
+        point = stop["point"]
+        keep = [i for i in range(len(self.route_points)) if i != point]
+        edited = dataclasses.replace(
+            self,
+            route_points=[self.route_points[i] for i in keep],
+            amenities=self.amenities.iloc[[i for i in keep if i < len(self.amenities)]],
+        )
+        return edited._reschedule(
+            stop["day"], self.schedule, Deadline.from_ms(deadline_ms)
+        )
+
+    # The night at hotel at the end of day, after the last of visited, with
+    # the next day continuing from route point `point`
+    def _night(self, day, hotel, visited, point):
+        last = visited[-1]
+        # Leaves after the day's last visit, or in the morning if there was none
+        left_at = last["departure"]
+        if last["day"] != day:
+            left_at = DAY_ONE + timedelta(days=day - 1)
+        minutes = leg_minutes(
+            [last["lat"], last["lon"]],
+            [hotel["lat"], hotel["lon"]],
+            self._speed(),
+            self.router,
+        )
+        return {
+            "day": day,
+            "name": END_OF_DAY,
+            "type": "hotel",
+            "lat": float(hotel["lat"]),
+            "lon": float(hotel["lon"]),
+            "arrival": left_at + timedelta(minutes=minutes),
+            "departure": DAY_ONE + timedelta(days=day),
+            "travel_time": minutes,
+            "point": point,
+        }
+
+    # Sleeps at hotel (anything with lat and lon, e.g. a row of the lodging
+    # frame) at the end of day instead of the nearest free one
+    def swap_hotel(self, day, hotel, deadline_ms=None):
+        nights = [
+            position
+            for position, stop in enumerate(self.schedule)
+            if stop["name"] == END_OF_DAY and stop["day"] == day
+        ]
+        if not nights:
+            raise ValueError(f"day {day} doesn't end at a hotel")
+        position = nights[-1]
+        visited = [
+            stop for stop in self.schedule[:position] if stop["name"] != END_OF_DAY
+        ]
+        schedule = list(self.schedule)
+        schedule[position] = self._night(
+            day, hotel, visited, self.schedule[position]["point"]
+        )
+        return self._reschedule(day + 1, schedule, Deadline.from_ms(deadline_ms))
+
+    # One more day after the last one with stops, with the stops that didn't
+    # fit before and then as many new ones as the request has per day: the
+    # nearest of the candidates not in the tour yet. That last day now ends at
+    # the nearest free hotel (or the last place, like daily_schedule) if it
+    # didn't.
+    def add_day(self, deadline_ms=None):
+        if self.candidates is None:
+            raise ValueError(
+                "this itinerary has no candidates, plan it again to edit it"
+            )
+        schedule = [
+            stop for stop in self.schedule if stop["day"] <= self.request.tour_length
+        ]
+        last_day = schedule[-1]["day"]
+        visited = [stop for stop in schedule if stop["name"] != END_OF_DAY]
+        last = [visited[-1]["lat"], visited[-1]["lon"]]
+
+        in_tour = {(round(lat, 6), round(lon, 6)) for lat, lon in self.route_points}
+        keys = zip(self.candidates["lat"].round(6), self.candidates["lon"].round(6))
+        left = self.candidates[[key not in in_tour for key in keys]]
+        per_day = max(self.request.num_amenities // self.request.tour_length, 1)
+        added = left.iloc[:0]
+        if len(left):
+            added = find_nearest_amenities(left, last, per_day)
+        # Amenity rows line up with the route points (see daily_schedule), so
+        # points without one keep the name they were scheduled with
+        unnamed = range(len(self.amenities), len(self.route_points))
+        amenities = pd.concat(
+            [
+                self.amenities.iloc[: len(self.route_points)],
+                pd.DataFrame({"name": [f"Point {i}" for i in unnamed]}),
+                added,
+            ],
+            ignore_index=True,
+        )
+        edited = dataclasses.replace(
+            self,
+            request=dataclasses.replace(
+                self.request, tour_length=self.request.tour_length + 1
+            ),
+            route_points=self.route_points + added[["lat", "lon"]].values.tolist(),
+            amenities=amenities,
+        )
+
+        if schedule[-1]["name"] != END_OF_DAY:
+            hotel = {"lat": last[0], "lon": last[1]}
+            lodging = self._free_lodging(last_day, schedule)
+            if lodging is not None and not lodging.empty:
+                minutes = minutes_to_rows(last, lodging, self._speed(), self.router)
+                hotel = lodging.iloc[int(np.argmin(minutes))]
+            schedule.append(
+                edited._night(last_day, hotel, visited, len(self.route_points))
+            )
+        return edited._reschedule(last_day + 1, schedule, Deadline.from_ms(deadline_ms))
+
+
+def _rows(value):
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _name_index(amenities, tags):
+    rows = amenities.index.to_numpy()
+    official_names = tags.values("official_name")[rows]
+    return NameIndex.build(rows, amenities["name"].to_numpy(), official_names)
+
+
+class TourPlanner:
+    def __init__(self, amenities_path="amenities-vancouver.json.gz"):
+        self.amenities_path = amenities_path
+        self._loaded = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._isochrones = OrderedDict()  # (mode, node, meters) -> {node: meters}
+
+    # Runs loader once per key and keeps its result. Safe to call from several
+    # threads: a second caller waits for the load in progress instead of
+    # starting its own (see prefetch.py). A frame from an OpenStreetMap fetch
+    # that failed (fetch_failed, see get_hotels) is returned but not kept, so
+    # the next call tries again.
+    def _load(self, key, loader):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key in self._loaded:
+                return self._loaded[key]
+            name = key if isinstance(key, str) else ":".join(map(str, key))
+            with stage(f"load:{name}") as s:
+                value = loader()
+                s.rows = _rows(value)
+            if not getattr(value, "attrs", {}).get("fetch_failed"):
+                self._loaded[key] = value
+            return value
+
+    def is_loaded(self, key):
+        return key in self._loaded
+
+    # log gets the loaders' progress messages, for the first call that loads
+    def amenities(self, log=print):
+        return self._load("amenities", lambda: load_amenities(self.amenities_path, log))
+
+    # OSM tags of the amenities as a TagStore. tags().tags(i) rebuilds the
+    # dict of the amenity at index i, e.g. for a popup.
+    def tags(self):
+        return self._load("tags", lambda: load_amenity_tags(self.amenities_path))
+
+    # Coordinates the candidates of a theme are indexed into. For the amenity
+    # store's frames that is the store's, shared by every theme.
+    def coordinates(self, theme):
+        return self._load(
+            "coordinates", lambda: load_amenity_coordinates(self.amenities_path)
+        )
+
+    # Search index over the amenities' names and official names
+    def name_index(self):
+        return self._load(
+            "name_index", lambda: _name_index(self.amenities(), self.tags())
+        )
+
+    # Amenity rows of the request's must-visit places, None if it has none. An
+    # int is the index of an amenity, "Q..." the amenity with that Wikidata id
+    # and anything else a name, matched to the most similar one.
+    def must_visit(self, request):
+        if not request.must_visit:
+            return None
+        amenities = self.amenities()
+        rows = []
+        for place in request.must_visit:
+            if isinstance(place, int):
+                if place not in amenities.index:
+                    raise ValueError(f"no amenity with id {place}")
+                row = place
+            elif WIKIDATA_ID.fullmatch(place.strip()):
+                matches = amenities.index[amenities["wikidata_id"] == place.strip()]
+                if not len(matches):
+                    raise ValueError(f"no amenity with Wikidata id {place}")
+                row = matches[0]
+            else:
+                matches = self.name_index().search(place, limit=1)
+                if not matches or matches[0][2] < MIN_NAME_SCORE:
+                    raise ValueError(f"no place named like {place!r}")
+                row = matches[0][0]
+            if row not in rows:
+                rows.append(row)
+        return amenities.loc[rows]
+
+    def restaurants(self, log=print):
+        return self._load("restaurants", lambda: get_restaurants(regions, log))
+
+    def rentals(self, log=print):
+        return self._load("rentals", lambda: get_rental(regions, log))
+
+    def lodging(self, log=print):
+        return self._load("lodging", lambda: get_lodging(self.amenities(log), log))
+
+    def candidates(self, theme):
+        return self._load(
+            ("candidates", theme),
+            lambda: select_candidates(self.amenities(), theme),
+        )
+
+    def tile_index(self):
+        return self._load(
+            "tile_index", lambda: load_amenity_tile_index(self.amenities_path)
+        )
+
+    # Amenities of the tiles, each kept once read. The ones not read yet are
+    # read together.
+    def _tiles(self, tiles):
+        index = self.tile_index()
+        missing = [tile for tile in tiles if not self.is_loaded(("tile", tile))]
+        if missing:
+            data = load_amenity_tiles(missing, self.amenities_path, index)
+            for tile in missing:
+                start, end = index.offsets[tile], index.offsets[tile + 1]
+                part = data[(data.index >= start) & (data.index < end)]
+                self._load(("tile", tile), lambda part=part: part)
+        return pd.concat([self._loaded[("tile", tile)] for tile in tiles])
+
+    def _tile_candidates(self, theme, tiles):
+        return select_candidates(self._tiles(tiles), theme)
+
+    # Candidates for a theme near the start, read from the store's tiles
+    # around it only, so a tour doesn't load the whole region. Uses all of
+    # candidates(theme) when it is loaded already (e.g. after warm_up()).
+    def nearby_candidates(self, theme, start_coords, transportation, num_amenities):
+        if self.is_loaded(("candidates", theme)):
+            return self.candidates(theme)
+        index = self.tile_index()
+        radius = NEARBY_RADIUS_M.get(transportation, NEARBY_RADIUS_M["walk"])
+        while True:
+            tiles = index.within(start_coords[0], start_coords[1], radius)
+            if len(tiles) == len(index):
+                return self.candidates(theme)
+            if len(tiles):
+                candidates = self._tile_candidates(theme, tiles)
+                if len(candidates) >= CANDIDATES_PER_STOP * num_amenities:
+                    return candidates
+            radius *= 2
+
+    def graph(self, transportation, log=print):
+        return self._load(
+            ("graph", transportation),
+            lambda: load_street_graph(transportation, log),
+        )
+
+    # Candidates the request's tour can reach from its start, by a bounded
+    # search of the street network (see isochrone.py). All of them if none
+    # can, or if the deadline runs out first, so a start the network doesn't
+    # reach still gets a tour. The search is kept per mode and start node, so
+    # tours from the same place search once.
+    def reachable_candidates(self, request, candidates, deadline=None):
+        with stage("isochrone") as s:
+            G = self.graph(request.transportation)
+            start = start_node(G, *request.start_coords)
+            if start is None or len(candidates) == 0:
+                return candidates
+            node, snap = start
+            farthest = Coordinates.from_frame(candidates).distances_km(
+                *request.start_coords
+            )
+            meters = search_meters(
+                SPEEDS.get(request.transportation, 5), farthest.max() * 1000
+            )
+            key = (request.transportation, node, meters)
+            with self._lock:
+                reached = self._isochrones.get(key)
+                if reached is not None:
+                    self._isochrones.move_to_end(key)
+            if reached is None:
+                reached = reachable_nodes(G, node, meters, deadline)
+                if reached is None:
+                    return candidates
+                with self._lock:
+                    self._isochrones[key] = reached
+                    if len(self._isochrones) > ISOCHRONES_KEPT:
+                        self._isochrones.popitem(last=False)
+            keep = reachable_mask(
+                G, reached, snap, candidates["lat"], candidates["lon"], meters
+            )
+            if keep.any():
+                candidates = candidates[keep]
+            s.rows = len(candidates)
+        return candidates
+
+    # Loads everything tours in these modes can need, so the first request
+    # doesn't pay for it
+    def warm_up(self, modes=TRANSPORT_MODES):
+        for theme in THEMES:
+            self.candidates(theme)
+        self.restaurants()
+        self.rentals()
+        self.lodging()
+        for mode in modes:
+            self.graph(mode)
+        return self
+
+    # One matrix per mode and set of places, built (or read from the disk
+    # cache) the first time a request needs it. Two stops of a tour are at
+    # most twice the nearby radius apart, so travel times are only kept that
+    # far, allowing for detours like the isochrone.
+    def travel_matrix(self, request, rentals, lodging_points):
+        radius = NEARBY_RADIUS_M.get(request.transportation, NEARBY_RADIUS_M["walk"])
+        max_meters = search_meters(SPEEDS.get(request.transportation, 5), 2 * radius)
+        key = (
+            "travel_matrix",
+            request.transportation,
+            request.theme,
+            rentals is not None,
+            lodging_points is not None,
+        )
+        return self._load(
+            key,
+            lambda: get_travel_matrix(
+                self.graph(request.transportation),
+                request.transportation,
+                self.candidates(request.theme),
+                lodging_points,
+                rentals,
+                max_meters,
+            ),
+        )
+
+    def plan(self, request):
+        request.validate()
+        # Rentals are only offered to people walking
+        want_rental = request.want_rental and request.transportation == "walk"
+        rentals = self.rentals() if want_rental else None
+        lodging_points = self.lodging() if request.stay_hotel else None
+        travel = None
+        if request.use_travel_matrix:
+            travel = self.travel_matrix(request, rentals, lodging_points)
+        # Schedule-only tours don't load the street network, and the
+        # restaurants are only checked for any being found, which isn't worth
+        # an OpenStreetMap download for them
+        Graph = restaurants = None
+        if not request.schedule_only:
+            Graph = self.graph(request.transportation)
+            restaurants = self.restaurants()
+        pinned = self.must_visit(request)
+        coordinates = self.coordinates(request.theme)
+        if travel is not None:
+            # The matrix covers every candidate of the theme
+            candidates = self.candidates(request.theme)
+        else:
+            candidates = self.nearby_candidates(
+                request.theme,
+                request.start_coords,
+                request.transportation,
+                request.num_amenities,
+            )
+
+        # Everything is loaded by now, so the deadline only covers planning
+        deadline = Deadline.from_ms(request.deadline_ms)
+        # With a travel matrix this isn't needed, it already leaves out what
+        # the network can't reach
+        if travel is None and not request.schedule_only:
+            candidates = self.reachable_candidates(
+                request, candidates, deadline.child(0.2)
+            )
+
+        route_points, amenities = plan_stops(
+            candidates,
+            request.start_coords,
+            request.tour_length,
+            request.num_amenities,
+            request.transportation,
+            "yes" if want_rental else "no",
+            request.stay_hotel,
+            restaurants,
+            rentals,
+            lodging_points,
+            solver=request.solver,
+            score=request.score,
+            deadline=deadline,
+            restarts=request.restarts,
+            travel=travel,
+            coordinates=coordinates,
+            pinned=pinned,
+        )
+        # Scheduling, the map and later edits share one router, so every leg
+        # is routed once
+        router = StreetRouter(
+            Graph, SPEEDS.get(request.transportation, 5), matrix=travel
+        )
+        itinerary = Itinerary(
+            request,
+            [],
+            [],
+            route_points=route_points,
+            amenities=amenities,
+            lodging=lodging_points,
+            router=router,
+            candidates=candidates,
+        )
+        return itinerary._reschedule(1, [], deadline)
@@ -0,0 +1,100 @@
+# Background prefetch while the user answers the prompts
+#
+# input_field() waits on a person for a while, and every answer after the
+# first few doesn't change what has to be downloaded. Prefetcher starts
+# loading the amenities, restaurants, hotels and the most likely street
+# network in background threads at launch. As soon as the mode of
+# transportation is answered its street network jumps to the front of the
+# queue. TourPlanner loads everything at most once, so when planning starts
+# it just waits for whatever is still in progress. The loaders' progress
+# messages would land between the prompts, so the loads started here print
+# nothing. A fetch that fails isn't kept by TourPlanner, so planning tries it
+# again and reports the error.
+#
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+# Lower runs first
+URGENT = 0
+SOON = 1
+LATER = 2
+
+# Graph to start on before the mode is known
+LIKELY_MODE = "walk"
+
+
+# Passed to the loaders as log, in place of print
+def _quiet(message):
+    pass
+
+
+class Prefetcher:
+    # street_networks=False for tours planned without the street network,
+    # which don't need the restaurants either
+    def __init__(self, planner, workers=2, street_networks=True):
+        self.planner = planner
+        self.street_networks = street_networks
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._futures = {}
+        self._started = set()
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # Queues a load under name. Submitting a name again with a more urgent
+    # priority moves it forward if it hasn't started yet.
+    def submit(self, name, load, priority=LATER):
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                future = self._futures[name] = Future()
+            elif name in self._started:
+                return future
+            self._queue.put((priority, next(self._order), name, load))
+        return future
+
+    def _work(self):
+        while True:
+            _, _, name, load = self._queue.get()
+            with self._lock:
+                if name in self._started:
+                    continue
+                self._started.add(name)
+                future = self._futures[name]
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(load())
+            except Exception as e:
+                # Planning loads it again and reports the error itself
+                future.set_exception(e)
+
+    def start(self):
+        planner = self.planner
+        self.submit("amenities", lambda: planner.amenities(_quiet), URGENT)
+        if self.street_networks:
+            self.submit("restaurants", lambda: planner.restaurants(_quiet), SOON)
+        self.submit("lodging", lambda: planner.lodging(_quiet), SOON)
+        if self.street_networks:
+            self.submit(
+                f"graph-{LIKELY_MODE}",
+                lambda: planner.graph(LIKELY_MODE, _quiet),
+                LATER,
+            )
+        return self
+
+    # Passed to input_field() as on_transport
+    def on_transport(self, transportation):
+        if self.street_networks:
+            self.submit(
+                f"graph-{transportation}",
+                lambda: self.planner.graph(transportation, _quiet),
+                URGENT,
+            )
+        if transportation == "walk":
+            self.submit("rentals", lambda: self.planner.rentals(_quiet), LATER)
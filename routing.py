@@ -0,0 +1,125 @@
+# Street routing shared by scheduling and the map
+#
+# StreetRouter routes each leg once and keeps the result, so daily_schedule
+# can plan with real network travel times and the map draws the exact same
+# paths without routing them a second time. It works on a networkx graph or on
+# a CompactGraph shared between worker processes. Without a graph (G=None) it
+# routes nothing and the route is drawn as straight lines.
+#
+from compact_graph import CompactGraph
+from deadline import out_of_time
+
+
+class StreetRouter:
+    def __init__(self, G, speed_kmh=5, deadline=None, matrix=None):
+        self.G = G
+        self.speed_kmh = speed_kmh
+        self.deadline = deadline
+        # Optional TravelMatrix: when it covers a leg, scheduling reads the
+        # travel time from it and the path is only routed for the map
+        self.matrix = matrix
+        self._nodes = {}
+        self._legs = {}
+
+    @staticmethod
+    def _point_key(point):
+        return (round(float(point[0]), 6), round(float(point[1]), 6))
+
+    def nearest_node(self, point):
+        key = self._point_key(point)
+        node = self._nodes.get(key)
+        if node is None:
+            if isinstance(self.G, CompactGraph):
+                node = self.G.nearest_node(point[0], point[1])[0]
+            else:
+                import osmnx as ox
+
+                node = ox.distance.nearest_nodes(self.G, point[1], point[0])
+            self._nodes[key] = node
+        return node
+
+    # (meters, [[lat, lon], ...]) for the leg from a to b, or None when the
+    # network doesn't connect them. Once the deadline has passed only legs
+    # that were already routed are returned.
+    def leg(self, a, b):
+        if self.G is None:
+            return None
+        expired = out_of_time(self.deadline, "get_street_route")
+        if expired and not (
+            self._point_key(a) in self._nodes and self._point_key(b) in self._nodes
+        ):
+            return None
+        start, end = self.nearest_node(a), self.nearest_node(b)
+        if (start, end) in self._legs:
+            return self._legs[(start, end)]
+        if expired:
+            return None
+
+        if isinstance(self.G, CompactGraph):
+            result = self._compact_leg(start, end)
+            if result is None:
+                print(f"No route found between {a} and {b}. Skipping.")
+        else:
+            result = self._networkx_leg(a, b, start, end)
+        self._legs[(start, end)] = result
+        return result
+
+    def _compact_leg(self, start, end):
+        found = self.G.shortest_path(start, end)
+        if found is None:
+            return None
+        meters, path_nodes = found
+        return meters, self.G.coords(path_nodes)
+
+    def _networkx_leg(self, a, b, start, end):
+        import networkx as nx
+
+        try:
+            path_nodes = nx.shortest_path(self.G, start, end, weight="length")
+        except nx.NetworkXNoPath:
+            print(f"No route found between {a} and {b}. Skipping.")
+            return None
+        except Exception as e:
+            print(f"Error finding path between {a} and {b}: {e}")
+            return None
+        meters = nx.path_weight(self.G, path_nodes, weight="length")
+        path = [[self.G.nodes[n]["y"], self.G.nodes[n]["x"]] for n in path_nodes]
+        return meters, path
+
+    # Same interface as TravelMatrix.minutes, None when the leg can't be
+    # routed so the caller falls back to the straight-line estimate
+    def minutes(self, a, b):
+        if self.matrix is not None:
+            minutes = self.matrix.minutes(a, b)
+            if minutes is not None:
+                return minutes
+        leg = self.leg(a, b)
+        if leg is None:
+            return None
+        return max(leg[0] / 1000 / self.speed_kmh * 60, 1)
+
+    # Routing to every candidate would defeat the purpose, so picking the
+    # nearest of many places is left to the matrix or straight-line distance
+    def minutes_from(self, a, lats, lons):
+        if self.matrix is not None:
+            return self.matrix.minutes_from(a, lats, lons)
+        return None
+
+    # Full route through the points as one list of [lat, lon]. Legs that were
+    # not routed in time are drawn as straight lines, legs the network can't
+    # connect are skipped.
+    def route(self, points_list):
+        full_route = []
+        for i in range(len(points_list) - 1):
+            a, b = points_list[i], points_list[i + 1]
+            leg = self.leg(a, b)
+            if leg is not None:
+                segment = leg[1]
+            elif self.G is None or out_of_time(self.deadline, "get_street_route"):
+                segment = [list(a), list(b)]
+            else:
+                continue
+            if full_route and segment:
+                segment = segment[1:]
+            full_route.extend(segment)
+        return full_route
@@ -0,0 +1,201 @@
+# Planning service: a small HTTP API around the tour planner
+#
+# Everything slow to load (amenities, OpenStreetMap downloads, street graphs
+# for each mode) is loaded once at start-up. Requests are planned in a pool of
+# worker processes so the event loop keeps answering while tours are computed.
+#
+#   GET  /health  -> {"status": "ok"}
+#   GET  /stats   -> plan cache hits, misses and entries
+#   POST /plan    -> body is one tour request as in batch.py, plus optional
+#                    "solver", "score", "deadline_ms" and "include_map"
+#
+# Finished plans are cached by normalized request (see plan_cache.py), and
+# identical requests arriving together are planned once.
+#
+# Only listens on localhost.
+#
+import argparse
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from batch import parse_request
+from main import TRANSPORT_MODES, create_tour_map
+from plan_cache import PlanCache, normalize_request, request_key
+from planner import TourPlanner
+
+LOCALHOST = ("127.0.0.1", "localhost", "::1")
+MAX_BODY_BYTES = 1 << 20
+
+# Loaded before the worker pool starts so forked workers inherit it, or by
+# _init_worker on platforms that don't fork
+_planner = None
+
+
+def _init_worker(amenities_path, modes):
+    global _planner
+    if _planner is None:
+        _planner = TourPlanner(amenities_path).warm_up(modes)
+
+
+def schedule_to_json(schedule):
+    stops = []
+    for stop in schedule:
+        stop = dict(stop)
+        stop["arrival"] = stop["arrival"].strftime("%H:%M")
+        stop["departure"] = stop["departure"].strftime("%H:%M")
+        stops.append(stop)
+    return stops
+
+
+# Runs in a worker process
+def plan_json(request, include_map=False):
+    itinerary = _planner.plan(request)
+    result = {
+        "schedule": schedule_to_json(itinerary.schedule),
+        "truncated": itinerary.truncated,
+    }
+    if include_map:
+        tour_map = create_tour_map(itinerary.schedule, itinerary.route)
+        result["map_html"] = tour_map.get_root().render()
+    return result
+
+
+# Runs in a thread of the event loop: geocodes the start, then waits for the
+# cached plan or for a worker to plan it
+def cached_plan(pool, cache, body):
+    options = {
+        "solver": body.get("solver", "nearest"),
+        "score": body.get("score", "tags"),
+        "deadline_ms": body.get("deadline_ms"),
+    }
+    request = normalize_request(parse_request(body, options))
+    include_map = bool(body.get("include_map"))
+    return cache.get_or_compute(
+        request_key(request, include_map),
+        lambda: pool.submit(plan_json, request, include_map).result(),
+        keep=lambda result: not result["truncated"],
+    )
+
+
+class PlanningServer:
+    def __init__(self, pool, cache=None):
+        self.pool = pool
+        self.cache = cache or PlanCache()
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        body = json.dumps(payload, default=str).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    async def respond(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if len(request_line) != 3:
+            return HTTPStatus.BAD_REQUEST, {"error": "malformed request line"}
+        method, path, _ = request_line
+        path = path.split("?")[0]
+
+        if path == "/health" and method == "GET":
+            return HTTPStatus.OK, {"status": "ok"}
+        if path == "/stats" and method == "GET":
+            return HTTPStatus.OK, self.cache.stats()
+        if path != "/plan":
+            return HTTPStatus.NOT_FOUND, {"error": f"no such endpoint {path}"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "use POST"}
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "bad Content-Length"}
+        if length > MAX_BODY_BYTES:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "body must be JSON"}
+        if not isinstance(body, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "body must be a JSON object"}
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                None, cached_plan, self.pool, self.cache, body
+            )
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            print(f"Error planning tour: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "planning failed"}
+        return HTTPStatus.OK, result
+
+
+async def serve(host, port, pool, cache=None):
+    server = await asyncio.start_server(PlanningServer(pool, cache).handle, host, port)
+    print(f"Planning service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(
+    host="127.0.0.1",
+    port=8353,
+    workers=None,
+    modes=TRANSPORT_MODES,
+    plan_cache_dir=None,
+):
+    global _planner
+    if host not in LOCALHOST:
+        raise SystemExit("The planning service only runs on localhost")
+
+    amenities_path = "amenities-vancouver.json.gz"
+    print("Loading amenities, places and street networks...")
+    _planner = TourPlanner(amenities_path).warm_up(modes)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(amenities_path, modes),
+    ) as pool:
+        asyncio.run(serve(host, port, pool, PlanCache(cache_dir=plan_cache_dir)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tour planning service")
+    parser.add_argument("--host", default="127.0.0.1", choices=LOCALHOST)
+    parser.add_argument("--port", type=int, default=8353)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=TRANSPORT_MODES,
+        choices=TRANSPORT_MODES,
+        help="street networks to load at start-up",
+    )
+    parser.add_argument(
+        "--plan-cache",
+        default=None,
+        help="directory to also keep finished plans in across restarts",
+    )
+    args = parser.parse_args()
+    main(args.host, args.port, args.workers, args.modes, args.plan_cache)
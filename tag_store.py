@@ -0,0 +1,236 @@
+# Compact store for the OSM tags of every amenity
+#
+# The tags column of the amenities frame holds one dict per row, and those
+# dicts take more memory than every other column together. TagStore keeps the
+# same tags as a few arrays instead:
+#
+#   keys, values        every distinct key and value once (interned), values
+#                       as one UTF-8 byte array with offsets
+#   indptr              row i's tags are entries indptr[i]:indptr[i + 1]
+#   key_ids, value_ids  key and value of each entry
+#
+# Queries ("has key", "key equals", tag counts) work on the id arrays, so they
+# never build a dict. tags(row) rebuilds one row's dict when it is needed.
+# Saved as .npy files, the arrays can be memory-mapped like CompactGraph's.
+#
+import json
+import os
+
+import numpy as np
+
+ARRAYS = ["indptr", "key_ids", "value_ids", "value_bytes", "value_offsets"]
+
+
+class TagStore:
+    def __init__(self, keys, arrays):
+        self.keys = keys
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self._key_positions = {key: i for i, key in enumerate(keys)}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    # Builds the arrays from one tags dict (or NaN for no tags) per row
+    @classmethod
+    def from_dicts(cls, dicts):
+        builder = TagStoreBuilder()
+        builder.add(dicts)
+        return builder.build()
+
+    # TagStore of the given rows, in that order
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.diff(self.indptr)[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # Entries of output row i are indptr[i]:indptr[i + 1], taken from
+        # self.indptr[rows[i]] onwards
+        entries = np.repeat(self.indptr[rows] - indptr[:-1], counts) + np.arange(
+            indptr[-1]
+        )
+        arrays = {
+            "indptr": indptr,
+            "key_ids": np.asarray(self.key_ids)[entries],
+            "value_ids": np.asarray(self.value_ids)[entries],
+            "value_bytes": self.value_bytes,
+            "value_offsets": self.value_offsets,
+        }
+        return TagStore(self.keys, arrays)
+
+    # This store's rows followed by other's. Keys and values of other that
+    # this store already has keep this store's ids, the rest are added.
+    def concat(self, other):
+        key_positions = dict(self._key_positions)
+        key_map = np.array(
+            [key_positions.setdefault(key, len(key_positions)) for key in other.keys],
+            dtype=np.int32,
+        )
+        value_count = len(self.value_offsets) - 1
+        value_positions = {self.value_text(i): i for i in range(value_count)}
+        value_map = np.zeros(len(other.value_offsets) - 1, dtype=np.int32)
+        added = []
+        for i in range(len(value_map)):
+            text = other.value_text(i)
+            position = value_positions.get(text)
+            if position is None:
+                position = value_positions[text] = value_count + len(added)
+                added.append(text.encode())
+            value_map[i] = position
+
+        added_offsets = np.cumsum([len(value) for value in added], dtype=np.int64)
+        arrays = {
+            "indptr": np.r_[self.indptr, self.indptr[-1] + other.indptr[1:]],
+            "key_ids": np.r_[self.key_ids, key_map[other.key_ids]],
+            "value_ids": np.r_[self.value_ids, value_map[other.value_ids]],
+            "value_bytes": np.r_[
+                self.value_bytes, np.frombuffer(b"".join(added), dtype=np.uint8)
+            ],
+            "value_offsets": np.r_[
+                self.value_offsets, self.value_offsets[-1] + added_offsets
+            ],
+        }
+        return TagStore(list(key_positions), arrays)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "keys.json"), "w") as f:
+            json.dump(self.keys, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, "keys.json")) as f:
+            keys = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAYS
+        }
+        return cls(keys, arrays)
+
+    def value_text(self, value_id):
+        start, end = self.value_offsets[value_id], self.value_offsets[value_id + 1]
+        return bytes(self.value_bytes[start:end]).decode()
+
+    # Row of every entry, built on the first query that needs it
+    def _entry_rows(self):
+        if self._rows is None:
+            self._rows = np.repeat(
+                np.arange(len(self), dtype=np.int32), np.diff(self.indptr)
+            )
+        return self._rows
+
+    def _rows_mask(self, entries):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self._entry_rows()[entries]] = True
+        return mask
+
+    def _key_entries(self, key):
+        key_id = self._key_positions.get(key)
+        if key_id is None:
+            return np.zeros(len(self.key_ids), dtype=bool)
+        return np.asarray(self.key_ids) == key_id
+
+    # Rows that have the key
+    def has_key(self, key):
+        return self._rows_mask(self._key_entries(key))
+
+    # Rows with any key starting with prefix, e.g. "addr:"
+    def has_prefix(self, prefix):
+        key_ids = [i for i, key in enumerate(self.keys) if key.startswith(prefix)]
+        return self._rows_mask(np.isin(self.key_ids, key_ids))
+
+    # Rows where key is set to value. Only the distinct values of that key are
+    # decoded to find the matching value id.
+    def key_equals(self, key, value):
+        entries = self._key_entries(key)
+        value_ids = np.asarray(self.value_ids)[entries]
+        matching = [i for i in np.unique(value_ids) if self.value_text(i) == value]
+        entries[entries] = np.isin(value_ids, matching)
+        return self._rows_mask(entries)
+
+    # Number of tags of every row, or only of the given keys
+    def count(self, keys=None):
+        if keys is None:
+            return np.diff(self.indptr)
+        key_ids = [
+            self._key_positions[key] for key in keys if key in self._key_positions
+        ]
+        rows = self._entry_rows()[np.isin(self.key_ids, key_ids)]
+        return np.bincount(rows, minlength=len(self))
+
+    # Value id of key for every row, -1 where the row doesn't have it
+    def value_ids_of(self, key):
+        ids = np.full(len(self), -1, dtype=np.int32)
+        entries = self._key_entries(key)
+        ids[self._entry_rows()[entries]] = np.asarray(self.value_ids)[entries]
+        return ids
+
+    # Value of key for every row as categorical codes (-1 where missing) and
+    # the category names, in order of first appearance
+    def value_codes(self, key):
+        ids = self.value_ids_of(key)
+        present = ids >= 0
+        unique, codes = np.unique(ids[present], return_inverse=True)
+        result = np.full(len(self), -1, dtype=np.int32)
+        result[present] = codes
+        return result, [self.value_text(i) for i in unique]
+
+    # Value of key for every row, None where the row doesn't have it
+    def values(self, key):
+        codes, categories = self.value_codes(key)
+        lookup = np.array(categories + [None], dtype=object)
+        return lookup[codes]
+
+    # The original tags dict of one row
+    def tags(self, row):
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return {
+            self.keys[key_id]: self.value_text(value_id)
+            for key_id, value_id in zip(
+                self.key_ids[start:end], self.value_ids[start:end]
+            )
+        }
+
+
+# Builds a TagStore from rows added in batches, so the dicts of one batch can
+# be dropped before the next is read
+class TagStoreBuilder:
+    def __init__(self):
+        self._key_positions = {}
+        self._value_positions = {}
+        self._counts = []
+        self._key_ids = []
+        self._value_ids = []
+
+    def add(self, dicts):
+        key_positions = self._key_positions
+        value_positions = self._value_positions
+        for tags in dicts:
+            if not isinstance(tags, dict):
+                self._counts.append(0)
+                continue
+            self._counts.append(len(tags))
+            for key, value in tags.items():
+                self._key_ids.append(key_positions.setdefault(key, len(key_positions)))
+                value = str(value)
+                self._value_ids.append(
+                    value_positions.setdefault(value, len(value_positions))
+                )
+
+    def build(self):
+        encoded = [value.encode() for value in self._value_positions]
+        value_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=value_offsets[1:])
+        indptr = np.zeros(len(self._counts) + 1, dtype=np.int64)
+        np.cumsum(self._counts, out=indptr[1:])
+        arrays = {
+            "indptr": indptr,
+            "key_ids": np.array(self._key_ids, dtype=np.int32),
+            "value_ids": np.array(self._value_ids, dtype=np.int32),
+            "value_bytes": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "value_offsets": value_offsets,
+        }
+        return TagStore(list(self._key_positions), arrays)
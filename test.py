@@ -11,6 +11,8 @@ from datetime import datetime, timedelta
 
 def extract_wikidata_ids(amenities_df):
     """Extract Wikidata Q-numbers from tags column"""
+    if "wikidata_id" in amenities_df.columns:  # Already in the amenity store
+        return amenities_df
     if "tags" not in amenities_df.columns:
         return amenities_df
 
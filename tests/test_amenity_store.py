@@ -0,0 +1,203 @@
+import gzip
+import json
+import os
+
+import pandas as pd
+
+from amenity_store import (
+    CHAIN_MIN_LOCATIONS,
+    Brands,
+    StoreFilters,
+    build_store,
+    is_current,
+    load_or_build_store,
+    load_store,
+    load_tags,
+    read_chunks,
+    refresh_store,
+    store_path,
+)
+
+
+def place(i, name, brand=None, amenity="cafe", **fields):
+    tags = {"name": name}
+    if brand is not None:
+        tags["brand:wikidata"] = brand
+    return dict(
+        lat=49.28 + i * 0.001,
+        lon=-123.12,
+        timestamp="2024-01-01T00:00:00Z",
+        amenity=amenity,
+        name=name,
+        tags=tags,
+        **fields,
+    )
+
+
+def write_lines(path, places):
+    with gzip.open(path, "wt") as f:
+        for p in places:
+            f.write(json.dumps(p) + "\n")
+    return str(path)
+
+
+# A chain with a few places, one of them without a name (dropped), and a
+# brand seen once
+def extract(tmp_path):
+    places = [place(i, "Chain Cafe", "Q1") for i in range(CHAIN_MIN_LOCATIONS)]
+    places.append(place(10, None, "Q1"))
+    places.append(place(11, "Corner Cafe", "Q2"))
+    return write_lines(tmp_path / "extract.json.gz", places)
+
+
+def brands_json(directory):
+    with open(os.path.join(directory, "brands.json")) as f:
+        return json.load(f)
+
+
+def test_brands_count_stored_places_only(tmp_path):
+    directory = str(tmp_path / "store")
+    build_store(extract(tmp_path), directory)
+    assert brands_json(directory)["counts"] == {"Q1": CHAIN_MIN_LOCATIONS, "Q2": 1}
+
+
+def test_refresh_from_unchanged_extract_keeps_brands(tmp_path):
+    source = extract(tmp_path)
+    directory = str(tmp_path / "store")
+    build_store(source, directory)
+    before = brands_json(directory)
+    for _ in range(2):
+        refresh = refresh_store(directory, source)
+        assert refresh["added"] == refresh["removed"] == 0
+        assert brands_json(directory) == before
+
+
+def test_refresh_moves_brand_of_replaced_place(tmp_path):
+    source = extract(tmp_path)
+    directory = str(tmp_path / "store")
+    build_store(source, directory)
+    newer = place(0, "Chain Cafe", "Q3", deleted=False)
+    newer["timestamp"] = "2025-01-01T00:00:00Z"
+    gone = place(11, "Corner Cafe", "Q2", deleted=True)
+    gone["timestamp"] = "2025-01-01T00:00:00Z"
+    refresh_store(directory, write_lines(tmp_path / "diff.json.gz", [newer, gone]))
+    brands = Brands.load(os.path.join(directory, "brands.json"))
+    assert dict(brands.counts) == {"Q1": CHAIN_MIN_LOCATIONS - 1, "Q3": 1}
+
+
+# Chain names as they show up in the data: after a branch, with a suffix, or
+# on places without brand tags
+def chain_variants(tmp_path):
+    places = [
+        place(0, "Starbucks", "Q37158"),
+        place(1, "Starbucks - Whiterock"),
+        place(2, "Starbucks - Ocean Park"),
+        place(3, "Tim Hortons"),
+        place(4, "Tim Hortons Express"),
+        place(5, "Scotiabank", amenity="bank"),
+        place(6, "Scotiabank Theatre", amenity="theatre"),
+        place(7, "Corner Cafe"),
+    ]
+    places += [place(10 + i, "JJ Bean Coffee Roasters") for i in range(3)]
+    places += [place(20 + i, "Blenz Coffee") for i in range(CHAIN_MIN_LOCATIONS)]
+    return write_lines(tmp_path / "variants.json.gz", places)
+
+
+def chains_by_name(directory):
+    data = load_store(directory)
+    return dict(zip(data["name"], data["is_chain"]))
+
+
+def test_chain_variants_are_flagged(tmp_path):
+    directory = str(tmp_path / "store")
+    filters = StoreFilters(chain_names=("Starbucks", "Tim Hortons", "Scotiabank"))
+    build_store(chain_variants(tmp_path), directory, filters)
+    assert chains_by_name(directory) == {
+        "Starbucks - Whiterock": True,
+        "Starbucks - Ocean Park": True,
+        "Tim Hortons Express": True,
+        # A theatre isn't a place of the bank
+        "Scotiabank Theatre": False,
+        "Corner Cafe": False,
+        # Counted by name, having no brand tags
+        "JJ Bean Coffee Roasters": True,
+        "Blenz Coffee": True,
+    }
+
+
+# Places with the tags each derived column looks at, one outside the bounds
+# and one of an amenity type the filters don't keep
+def featured(tmp_path):
+    places = [
+        place(0, "Science World", "Q1"),
+        place(1, "Corner Cafe"),
+        place(2, "Sushi Bar", amenity="restaurant"),
+        place(3, "Far Away"),
+        place(4, "Bench", amenity="bench"),
+    ]
+    places[0]["tags"].update(wikidata="Q2", opening_hours="10:00-17:00")
+    places[2]["tags"].update({"cuisine": "sushi", "addr:street": "Robson St"})
+    places[3]["lat"] = 50.5
+    return write_lines(tmp_path / "featured.json.gz", places)
+
+
+FILTERS = StoreFilters(amenities=("cafe", "restaurant"), bounds=(49, 50, -124, -123))
+
+
+def test_store_derives_feature_columns_from_the_tags(tmp_path):
+    directory = str(tmp_path / "store")
+    meta = build_store(featured(tmp_path), directory, FILTERS)
+    assert (meta["rows_read"], meta["rows"]) == (5, 3)
+    data = load_store(directory).set_index("name")
+    assert list(data.index) == ["Science World", "Corner Cafe", "Sushi Bar"]
+    assert data["tag_count"].tolist() == [4, 1, 3]
+    assert data["has_wikidata"].tolist() == [True, False, False]
+    # The place's own wikidata tag wins over its brand's
+    assert data.loc["Science World", "wikidata_id"] == "Q2"
+    assert data["has_opening_hours"].tolist() == [True, False, False]
+    assert data["has_address"].tolist() == [False, False, True]
+    assert data.loc["Sushi Bar", "cuisine"] == "sushi"
+    assert data["cuisine"].isna().sum() == 2
+
+
+def test_store_is_rebuilt_when_the_filters_change(tmp_path):
+    source = featured(tmp_path)
+    store_dir = str(tmp_path / "stores")
+    assert len(load_or_build_store(source, store_dir, FILTERS)) == 3
+    assert is_current(source, store_path(source, store_dir), FILTERS)
+    cafes = StoreFilters(amenities=("cafe",), bounds=FILTERS.bounds)
+    assert not is_current(source, store_path(source, store_dir), cafes)
+    assert len(load_or_build_store(source, store_dir, cafes)) == 2
+
+
+# Chunks of any size build the same store as reading the file at once
+def test_store_is_the_same_whatever_the_chunk_size(tmp_path):
+    source = chain_variants(tmp_path)
+    filters = StoreFilters(chain_names=("Starbucks", "Tim Hortons", "Scotiabank"))
+    stores = []
+    for chunk_rows in (1, 4, 1000):
+        directory = str(tmp_path / f"store-{chunk_rows}")
+        build_store(source, directory, filters, chunk_rows=chunk_rows)
+        tags = load_tags(directory)
+        stores.append(
+            (
+                load_store(directory),
+                [tags.tags(row) for row in range(len(tags))],
+                brands_json(directory),
+            )
+        )
+    for data, tags, brands in stores[:2]:
+        pd.testing.assert_frame_equal(data, stores[-1][0])
+        assert tags == stores[-1][1]
+        assert brands == stores[-1][2]
+
+
+# Blank lines and a file without a trailing newline are read like any other
+def test_read_chunks_splits_lines_into_frames(tmp_path):
+    path = tmp_path / "extract.json"
+    lines = [json.dumps(place(i, f"Place {i}")) for i in range(5)]
+    path.write_text("\n".join(lines[:2] + [""] + lines[2:]))
+    chunks = list(read_chunks(str(path), chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1, 2]
+    names = pd.concat(chunks)["name"].tolist()
+    assert names == [f"Place {i}" for i in range(5)]
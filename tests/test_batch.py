@@ -0,0 +1,113 @@
+import json
+
+import pandas as pd
+import pytest
+
+import batch
+from batch import parse_request, read_requests
+
+GOOD = {
+    "tour_length": 1,
+    "theme": "food",
+    "num_amenities": 3,
+    "coordinates": [49.28, -123.12],
+    "transportation": "walk",
+}
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        [1, 2],
+        "a tour",
+        dict(GOOD, coordinates=[49.28, -123.12, 5]),
+        dict(GOOD, coordinates=[49.28]),
+        dict(GOOD, coordinates=49.28),
+        dict(GOOD, coordinates=["north", "west"]),
+        dict(GOOD, coordinates=[[49.28], -123.12]),
+        dict(GOOD, coordinates=[0.0, 0.0]),
+        dict(GOOD, tour_length=0),
+        dict(GOOD, num_amenities="many"),
+        dict(GOOD, theme="opera"),
+        dict(GOOD, transportation="boat"),
+        dict(GOOD, must_visit={"name": "x"}),
+        {k: v for k, v in GOOD.items() if k != "coordinates"},
+    ],
+)
+def test_parse_request_rejects_bad_input(raw):
+    with pytest.raises(ValueError):
+        parse_request(raw)
+
+
+def test_parse_request_rejects_address_that_is_not_a_string():
+    raw = {k: v for k, v in GOOD.items() if k != "coordinates"}
+    with pytest.raises(ValueError):
+        parse_request(dict(raw, address=["Main St"]))
+
+
+def test_parse_request_reads_a_good_request():
+    request = parse_request(dict(GOOD, rental="yes", must_visit="Q123"))
+    assert request.start_coords == (49.28, -123.12)
+    assert request.want_rental
+    assert request.must_visit == ("Q123",)
+
+
+def test_bad_lines_are_reported_and_skipped(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(batch, "locate", lambda address: (49.28, -123.12))
+    lines = [
+        json.dumps(dict(GOOD, id="a")),
+        "[1, 2]",
+        "not json",
+        json.dumps(dict(GOOD, id="b", coordinates=[49.28, -123.12, 5])),
+        "",
+        json.dumps({"id": "c", "tour_length": 2, "num_amenities": 4, "address": "x"}),
+    ]
+    path = tmp_path / "requests.jsonl"
+    path.write_text("\n".join(lines))
+    requests = read_requests(str(path))
+    assert [request_id for request_id, _ in requests] == ["a", "c"]
+    out = capsys.readouterr().out
+    for line_no in (2, 3, 4):
+        assert f"Skipping request on line {line_no}" in out
+
+
+# Parent side of a parallel batch: amenities, and must-visit names looked up
+# by exact match
+class Parent:
+    def __init__(self):
+        self.amenities_frame = pd.DataFrame(
+            {
+                "name": ["Science World", "The Orpheum", "Corner Cafe"],
+                "amenity": ["arts_centre", "theatre", "cafe"],
+                "lat": [49.273, 49.280, 49.285],
+                "lon": [-123.104, -123.120, -123.130],
+            },
+            index=[40, 7, 12],
+        )
+
+    def amenities(self):
+        return self.amenities_frame
+
+    def must_visit(self, request):
+        names = self.amenities_frame["name"]
+        if not all(names.eq(place).any() for place in request.must_visit):
+            raise ValueError("no place named like that")
+        return self.amenities_frame[names.isin(request.must_visit)]
+
+
+def test_workers_read_must_visit_places_from_the_parent(tmp_path, monkeypatch):
+    parent = Parent()
+    request = parse_request(dict(GOOD, must_visit=["The Orpheum", "Science World"]))
+    resolved = batch._resolve_must_visit(parent, request)
+    assert resolved.must_visit == (40, 7)
+    unknown = parse_request(dict(GOOD, must_visit=["Nowhere"]))
+    assert batch._resolve_must_visit(parent, unknown) is unknown
+
+    batch._share_must_visit(parent, [resolved], str(tmp_path))
+
+    def load_store(self, log=print):
+        raise AssertionError("a worker loaded the amenity store")
+
+    monkeypatch.setattr(batch.SharedPlanner, "amenities", load_store)
+    pinned = batch.SharedPlanner(str(tmp_path)).must_visit(resolved)
+    assert pinned["name"].tolist() == ["Science World", "The Orpheum"]
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from coordinates import Coordinates
+from main import find_nearest_amenities, haversine
+
+START = (49.28, -123.12)
+
+
+def places(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "name": [f"Place {i}" for i in range(n)],
+            "lat": START[0] + rng.uniform(-0.05, 0.05, n),
+            "lon": START[1] + rng.uniform(-0.08, 0.08, n),
+        }
+    )
+
+
+def test_distances_match_haversine():
+    frame = places()
+    coordinates = Coordinates.from_frame(frame)
+    expected = haversine(START[0], START[1], frame["lat"], frame["lon"])
+    np.testing.assert_allclose(coordinates.distances_km(*START), expected)
+    rows = np.array([5, 0, 17])
+    np.testing.assert_allclose(
+        coordinates.distances_km(*START, rows), np.asarray(expected)[rows]
+    )
+
+
+def test_saved_coordinates_are_memory_mapped(tmp_path):
+    assert Coordinates.load(str(tmp_path)) is None
+    frame = places()
+    Coordinates.from_frame(frame).save(str(tmp_path))
+    loaded = Coordinates.load(str(tmp_path))
+    assert isinstance(loaded.radians, np.memmap)
+    assert len(loaded) == len(frame)
+    np.testing.assert_allclose(np.degrees(loaded.radians[:, 0]), frame["lat"])
+    np.testing.assert_allclose(loaded.degrees[:, 1], frame["lon"], atol=1e-5)
+
+
+# A selection indexes into the coordinates of every place instead of copying
+# its rows, and the search picks the same stops either way
+@pytest.mark.parametrize("num_amenities", [1, 10, 40])
+def test_nearest_search_over_an_index_into_the_coordinates(num_amenities):
+    frame = places()
+    coordinates = Coordinates.from_frame(frame)
+    selection = frame.iloc[::3]
+    indexed = find_nearest_amenities(
+        selection, START, num_amenities, coordinates=coordinates
+    )
+    copied = find_nearest_amenities(
+        selection.reset_index(drop=True), START, num_amenities
+    )
+    assert indexed["name"].tolist() == copied["name"].tolist()
@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(ROOT, "benchmarks", "startup_budget.json")) as f:
+    LAZY_MODULES = json.load(f)["lazy_modules"]
+
+# A schedule-only tour over a few made-up candidates, printing the lazy
+# modules it imported and whether the restaurants were fetched
+SCHEDULE_ONLY = """
+import sys
+import pandas as pd
+from planner import TourPlanner, TourRequest
+
+places = pd.DataFrame(
+    {"name": ["A", "B", "C"], "amenity": "cafe",
+     "lat": [49.281, 49.282, 49.283], "lon": -123.12}
+)
+
+class Planner(TourPlanner):
+    def candidates(self, theme):
+        return places
+
+    def nearby_candidates(self, theme, start_coords, transportation, num_amenities):
+        return places
+
+    def coordinates(self, theme):
+        return None
+
+planner = Planner()
+planner.plan(TourRequest(1, "food", 3, (49.28, -123.12), schedule_only=True))
+print(planner.is_loaded("restaurants"))
+print(" ".join(sorted(m for m in sys.argv[1:] if m in sys.modules)))
+"""
+
+
+def run(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code, *LAZY_MODULES],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.splitlines()
+
+
+def test_entry_points_import_no_heavy_modules():
+    imported = run(
+        "import sys, main, planner, batch, server\n"
+        "print(' '.join(sorted(m for m in sys.argv[1:] if m in sys.modules)))"
+    )
+    assert imported == [""]
+
+
+def test_schedule_only_tour_loads_no_street_network_or_map():
+    restaurants_loaded, imported = run(SCHEDULE_ONLY)
+    assert restaurants_loaded == "False"
+    assert imported == ""
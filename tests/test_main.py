@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import (
+    CHAIN_BIT,
+    INTERESTING_BIT,
+    THEME_AMENITIES,
+    THEME_BITS,
+    THEMES,
+    amenity_bits,
+    daily_schedule,
+    filter_amenities_by_theme,
+    find_nearest_amenities,
+    interesting_amenities,
+    leg_minutes,
+    select_candidates,
+)
+from travel_matrix import TravelMatrix
+
+START = [49.28, -123.12]
+
+
+# More one-hour stops in a row than fit in one 9:00-21:00 day
+def route(n=30):
+    stops = pd.DataFrame(
+        {
+            "name": [f"Place {i}" for i in range(n)],
+            "amenity": "cafe",
+            "lat": [START[0] + 0.0005 * i for i in range(n)],
+            "lon": START[1],
+        }
+    )
+    return [START] + stops[["lat", "lon"]].values.tolist(), stops
+
+
+def test_daily_schedule_fills_every_day_of_the_tour():
+    route_points, stops = route()
+    for tour_length in (1, 2, 3):
+        schedule = daily_schedule(route_points, stops, "walk", tour_length, None)
+        assert max(stop["day"] for stop in schedule) == tour_length
+
+
+# A travel matrix over points from a table of meters, inf where the network
+# doesn't connect two of them
+def travel_matrix(points, meters, speed_kmh=5):
+    meters = np.asarray(meters, dtype=float)
+    rows, cols = np.nonzero(np.isfinite(meters))
+    indptr = np.searchsorted(rows, np.arange(len(points) + 1))
+    lats, lons = zip(*points)
+    return TravelMatrix(lats, lons, indptr, cols, meters[rows, cols], speed_kmh)
+
+
+# A pin 133 m south of the start and a candidate 217 m north
+def pin_and_candidate():
+    pin = pd.DataFrame({"name": ["Pin"], "lat": [START[0] - 0.0012], "lon": START[1]})
+    candidates = pd.DataFrame(
+        {"name": ["Candidate"], "lat": [START[0] + 0.00195], "lon": START[1]}
+    )
+    return pin, candidates
+
+
+def test_pin_missing_from_the_matrix_is_timed_at_the_modes_speed():
+    pin, candidates = pin_and_candidate()
+    points = [START, candidates[["lat", "lon"]].values[0].tolist()]
+    travel = travel_matrix(points, [[0, 217], [217, 0]])
+    tour = find_nearest_amenities(
+        candidates, START, 2, travel=travel, pinned=pin, speed_kmh=5
+    )
+    assert tour["name"].tolist() == ["Pin", "Candidate"]
+
+
+def test_pin_without_a_route_falls_back_to_straight_line():
+    pin, candidates = pin_and_candidate()
+    points = [START, pin[["lat", "lon"]].values[0].tolist()]
+    points.append(candidates[["lat", "lon"]].values[0].tolist())
+    inf = np.inf
+    travel = travel_matrix(points, [[0, inf, 217], [inf, 0, 350], [217, 350, 0]])
+    tour = find_nearest_amenities(
+        candidates, START, 2, travel=travel, pinned=pin, speed_kmh=5
+    )
+    assert tour["name"].tolist() == ["Pin", "Candidate"]
+
+
+# The start only reaches A, and B only from A: B is still picked after A
+def test_place_unreachable_from_the_start_is_picked_from_a_later_stop():
+    candidates = pd.DataFrame(
+        {
+            "name": ["A", "B"],
+            "lat": [START[0] + 0.001, START[0] + 0.002],
+            "lon": START[1],
+        }
+    )
+    points = [START] + candidates[["lat", "lon"]].values.tolist()
+    inf = np.inf
+    travel = travel_matrix(points, [[0, 111, inf], [111, 0, 111], [inf, 111, 0]])
+    tour = find_nearest_amenities(candidates, START, 2, travel=travel)
+    assert tour["name"].tolist() == ["A", "B"]
+
+
+# A matrix with no street between two of its points says so (inf), and
+# leg_minutes then times the leg by straight line like one it doesn't cover
+def test_leg_minutes_falls_back_to_straight_line():
+    a, b, c = START, [START[0] + 0.001, START[1]], [START[0] + 0.002, START[1]]
+    inf = np.inf
+    travel = travel_matrix([a, b], [[0, inf], [inf, 0]], speed_kmh=6)
+    assert travel.minutes(a, b) == inf
+    assert travel.minutes(a, c) is None
+    straight = leg_minutes(a, b, 6)
+    assert straight == pytest.approx(1.11, abs=0.01)
+    assert leg_minutes(a, b, 6, travel) == straight
+    assert leg_minutes(a, c, 6, travel) == leg_minutes(a, c, 6)
+    routed = travel_matrix([a, b], [[0, 500], [500, 0]], speed_kmh=6)
+    assert leg_minutes(a, b, 6, routed) == pytest.approx(5)
+
+
+# One place of every type some theme has, plus ones no theme has
+def typed_places():
+    types = sorted({t for members in THEME_AMENITIES.values() for t in members})
+    types += ["bench", "parking"]
+    return pd.DataFrame(
+        {
+            "name": [f"Place {i}" for i in range(len(types))],
+            "amenity": pd.Categorical(types),
+            "lat": START[0],
+            "lon": START[1],
+            "tag_count": 5,
+        }
+    )
+
+
+def test_amenity_bits_mark_themes_and_chains():
+    places = typed_places()
+    places["is_chain"] = places["amenity"] == "cafe"
+    bits = amenity_bits(places)
+    for theme, members in THEME_AMENITIES.items():
+        in_theme = (bits & THEME_BITS[theme]) != 0
+        assert in_theme.tolist() == places["amenity"].isin(members).tolist()
+    interesting = (bits & INTERESTING_BIT) != 0
+    assert (
+        interesting.tolist() == places["amenity"].isin(interesting_amenities).tolist()
+    )
+    assert ((bits & CHAIN_BIT) != 0).tolist() == places["is_chain"].tolist()
+
+
+# The bitmask picks the same places as comparing the amenity names
+def test_theme_filters_agree_with_and_without_bits():
+    places = typed_places()
+    with_bits = places.assign(amenity_bits=amenity_bits(places))
+    for theme in THEMES:
+        by_name = filter_amenities_by_theme(places, theme)
+        by_bits = filter_amenities_by_theme(with_bits, theme)
+        assert by_bits["name"].tolist() == by_name["name"].tolist()
+        assert (
+            select_candidates(with_bits, theme)["name"].tolist()
+            == select_candidates(places, theme)["name"].tolist()
+        )
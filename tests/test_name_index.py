@@ -0,0 +1,45 @@
+from name_index import NameIndex
+
+ROWS = [3, 8, 15, 21, 40]
+NAMES = ["Science World", "The Orpheum", "Orpheum Annex", "Bubble World", None]
+OFFICIAL_NAMES = [
+    "TELUS World of Science",
+    None,
+    None,
+    None,
+    "Vancouver Art Gallery",
+]
+
+
+def index():
+    return NameIndex.build(ROWS, NAMES, OFFICIAL_NAMES)
+
+
+def test_typos_and_case_still_find_the_place():
+    for query in ("Sience World", "science  world!", "SCIENCE WORLD"):
+        row, name, _ = index().search(query)[0]
+        assert (row, name) == (3, "Science World")
+
+
+def test_official_names_are_searched_too():
+    assert index().search("Telus World of Science")[0][:2] == (
+        3,
+        "TELUS World of Science",
+    )
+    assert index().search("vancouver art gallery")[0][0] == 40
+
+
+def test_exact_and_prefix_matches_rank_first():
+    results = index().search("Orpheum")
+    assert [row for row, _, _ in results[:2]] == [15, 8]
+    # One result per row, best first
+    rows = [row for row, _, _ in index().search("world")]
+    assert len(rows) == len(set(rows))
+    assert rows[0] in (3, 21)
+
+
+def test_nothing_found_for_unknown_or_empty_queries():
+    assert index().search("") == []
+    assert index().search("!!!") == []
+    assert index().search("zzq") == []
+    assert len(index().search("World", limit=1)) == 1
@@ -0,0 +1,33 @@
+import numpy as np
+
+from deadline import Deadline
+from optimizer import TourSolver
+
+START = (49.28, -123.12)
+
+
+def solver(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return TourSolver(
+        START[0] + rng.uniform(-0.02, 0.02, n),
+        START[1] + rng.uniform(-0.03, 0.03, n),
+        rng.integers(1, 10, n),
+        START,
+        speed_kmh=5,
+    )
+
+
+def test_solve_without_deadline_fills_the_days():
+    days = solver().solve(2, max_stops=12)
+    assert len(days) == 2
+    assert sum(len(day) for day in days) == 12
+
+
+# Out of time, building stops at once and improving only runs its first local
+# search, so a tour still comes back. Both report it in the deadline.
+def test_solve_stops_at_the_deadline():
+    deadline = Deadline(0)
+    days = solver().solve(2, max_stops=12, deadline=deadline)
+    assert sum(len(day) for day in days) >= 1
+    assert "improve" in deadline.truncated
+    assert "orienteering_tour" in deadline.truncated
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from parallel import parallel_orienteering_tour
+
+START = (49.28, -123.12)
+
+
+def amenities(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "name": [f"Place {i}" for i in range(n)],
+            "lat": START[0] + rng.uniform(-0.02, 0.02, n),
+            "lon": START[1] + rng.uniform(-0.03, 0.03, n),
+            "tag_count": rng.integers(1, 10, n),
+        }
+    )
+
+
+def tour(workers, seed=3):
+    return parallel_orienteering_tour(
+        amenities(),
+        START,
+        2,
+        speed_kmh=5,
+        max_stops=8,
+        iterations=50,
+        seed=seed,
+        restarts=4,
+        workers=workers,
+    )
+
+
+# The best restart wins whatever the number of workers and the order they
+# finish in
+@pytest.mark.parametrize("workers", [1, 3])
+def test_restarts_give_the_same_tour_for_a_seed(workers):
+    pd.testing.assert_frame_equal(tour(workers), tour(2))
+
+
+def test_tour_has_a_day_for_every_stop():
+    result = tour(2)
+    assert 0 < len(result) <= 8
+    assert set(result["tour_day"]) <= {1, 2}
+    assert result["name"].is_unique
@@ -0,0 +1,88 @@
+import dataclasses
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import plan_cache
+from plan_cache import PlanCache, request_key
+from planner import TourRequest
+
+START = (49.28, -123.12)
+
+
+def test_schedule_only_tours_have_their_own_key():
+    request = TourRequest(1, "food", 5, START)
+    schedule_only = dataclasses.replace(request, schedule_only=True)
+    assert request_key(request) != request_key(schedule_only)
+
+
+def test_least_recently_used_plan_is_evicted_first():
+    cache = PlanCache(max_entries=2)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    assert cache.get_or_compute("a", lambda: -1) == 1
+    cache.get_or_compute("c", lambda: 3)
+    # "b" went, "a" was used more recently
+    assert cache.get_or_compute("a", lambda: -1) == 1
+    assert cache.get_or_compute("b", lambda: 20) == 20
+    assert cache.stats()["entries"] == 2
+
+
+def test_plans_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(plan_cache.time, "time", lambda: now[0])
+    cache = PlanCache(ttl_seconds=60)
+    cache.get_or_compute("a", lambda: 1)
+    now[0] += 59
+    assert cache.get_or_compute("a", lambda: 2) == 1
+    now[0] += 2
+    assert cache.get_or_compute("a", lambda: 2) == 2
+
+
+def test_plans_keep_rejects_are_returned_but_not_cached():
+    cache = PlanCache()
+    assert cache.get_or_compute("a", lambda: None, keep=bool) is None
+    assert cache.get_or_compute("a", lambda: 1, keep=bool) == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_disk_cache_survives_a_new_cache(tmp_path):
+    PlanCache(cache_dir=str(tmp_path)).get_or_compute("a", lambda: {"stops": 3})
+    cache = PlanCache(cache_dir=str(tmp_path))
+    assert cache.get_or_compute("a", lambda: None) == {"stops": 3}
+    assert cache.stats()["disk_hits"] == 1
+
+
+# Callers asking for a key that is being planned wait for that plan
+def test_concurrent_requests_are_planned_once():
+    cache = PlanCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "plan"
+
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(cache.get_or_compute, "a", compute)
+        started.wait(5)
+        others = [pool.submit(cache.get_or_compute, "a", compute) for _ in range(3)]
+        while cache.stats()["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [first.result()] + [other.result() for other in others]
+    assert results == ["plan"] * 4
+    assert len(calls) == 1
+
+
+# Requests that normalize the same way share a key
+def test_nearby_starts_share_a_key():
+    request = TourRequest(1, "food", 5, START)
+    nearby = dataclasses.replace(request, start_coords=(49.2801, -123.1201))
+    driving = dataclasses.replace(request, transportation="drive", want_rental=True)
+    assert request_key(request) == request_key(nearby)
+    assert request_key(driving) == request_key(
+        dataclasses.replace(driving, want_rental=False)
+    )
@@ -0,0 +1,164 @@
+import pandas as pd
+import pytest
+
+from name_index import NameIndex
+from planner import END_OF_DAY, Itinerary, TourPlanner, TourRequest
+from routing import StreetRouter
+
+START = (49.28, -123.12)
+
+
+def candidates(n=12):
+    return pd.DataFrame(
+        {
+            "name": [f"Place {i}" for i in range(n)],
+            "amenity": "cafe",
+            "lat": [START[0] + 0.001 * (i + 1) for i in range(n)],
+            "lon": [START[1]] * n,
+        }
+    )
+
+
+# A tour of the first num_amenities candidates, planned like TourPlanner.plan()
+# without a street network
+def itinerary(tour_length=1, num_amenities=4, lodging=None):
+    places = candidates()
+    request = TourRequest(
+        tour_length, "food", num_amenities, START, "walk", schedule_only=True
+    )
+    stops = places.iloc[:num_amenities]
+    return Itinerary(
+        request,
+        [],
+        [],
+        route_points=[list(START)] + stops[["lat", "lon"]].values.tolist(),
+        amenities=stops,
+        lodging=lodging,
+        router=StreetRouter(None, 5),
+        candidates=places,
+    )._reschedule(1, [])
+
+
+def days(itinerary):
+    return sorted({stop["day"] for stop in itinerary.schedule})
+
+
+def test_add_day_adds_a_day_of_new_stops():
+    tour = itinerary()
+    assert days(tour) == [1]
+    longer = tour.add_day()
+    assert days(longer) == [1, 2]
+    assert longer.request.tour_length == 2
+    day_two = [stop for stop in longer.schedule if stop["day"] == 2]
+    assert len(day_two) == 4
+    assert not {stop["name"] for stop in day_two} & set(tour.amenities["name"])
+    # The first day is kept and now ends with a night
+    assert longer.schedule[: len(tour.schedule)] == tour.schedule
+    assert longer.schedule[len(tour.schedule)]["name"] == END_OF_DAY
+
+
+def test_add_day_sleeps_at_the_nearest_hotel():
+    hotels = pd.DataFrame(
+        {"name": ["Far", "Near"], "lat": [49.2, 49.285], "lon": START[1]}
+    )
+    longer = itinerary(lodging=hotels).add_day()
+    night = next(stop for stop in longer.schedule if stop["name"] == END_OF_DAY)
+    assert (night["day"], night["lat"]) == (1, 49.285)
+
+
+def test_add_day_twice():
+    assert days(itinerary().add_day().add_day()) == [1, 2, 3]
+
+
+# An OpenStreetMap fetch that failed isn't kept, the next call fetches again
+def test_failed_fetch_is_loaded_again():
+    fetches = []
+
+    def fetch():
+        frame = pd.DataFrame()
+        frame.attrs["fetch_failed"] = len(fetches) == 0
+        fetches.append(frame)
+        return frame
+
+    planner = TourPlanner()
+    assert planner._load("restaurants", fetch).attrs["fetch_failed"]
+    assert not planner.is_loaded("restaurants")
+    kept = planner._load("restaurants", fetch)
+    assert planner._load("restaurants", fetch) is kept
+    assert len(fetches) == 2
+
+
+# TourPlanner over the candidates above instead of the amenity store
+class Planner(TourPlanner):
+    def candidates(self, theme):
+        return self._load(("candidates", theme), candidates)
+
+    def nearby_candidates(self, theme, start_coords, transportation, num_amenities):
+        return self.candidates(theme)
+
+    def coordinates(self, theme):
+        return None
+
+
+def test_plan_returns_a_scheduled_tour():
+    request = TourRequest(1, "food", 4, START, "walk", schedule_only=True)
+    tour = Planner().plan(request)
+    # The four nearest candidates after the start, in visiting order
+    expected = candidates().iloc[:4][["lat", "lon"]].values.tolist()
+    assert tour.route_points == [list(START)] + expected
+    assert len(tour.schedule) == 5
+    assert not tour.truncated
+    names = [stop["name"] for stop in tour.schedule]
+    frame = tour.to_frame()
+    assert len(frame) == len(tour.schedule)
+    assert list(frame["name"]) == names
+
+
+def test_plan_rejects_a_bad_request_before_loading_anything():
+    planner = Planner()
+    for request in (
+        TourRequest(0, "food", 4, START),
+        TourRequest(1, "opera", 4, START),
+        TourRequest(1, "food", 4, START, "teleport"),
+        TourRequest(1, "food", 4, (0.0, 0.0)),
+    ):
+        with pytest.raises(ValueError):
+            planner.plan(request)
+    assert not planner._loaded
+
+
+# TourPlanner over a few named amenities, one linked to Wikidata
+class NamedPlanner(TourPlanner):
+    def amenities(self, log=print):
+        return pd.DataFrame(
+            {
+                "name": ["Science World", "The Orpheum", "Corner Cafe"],
+                "wikidata_id": ["Q1", None, None],
+                "lat": [49.273, 49.280, 49.285],
+                "lon": [-123.104, -123.120, -123.130],
+            },
+            index=[40, 7, 12],
+        )
+
+    def name_index(self):
+        amenities = self.amenities()
+        return NameIndex.build(amenities.index.to_numpy(), amenities["name"])
+
+
+def must_visit(*places):
+    return NamedPlanner().must_visit(
+        TourRequest(1, "food", 4, START, must_visit=places)
+    )
+
+
+def test_must_visit_finds_names_wikidata_ids_and_indexes():
+    found = must_visit("Sience World", "Q1", 7, "corner cafe")
+    # Science World only once, in the order asked for
+    assert found.index.tolist() == [40, 7, 12]
+    assert must_visit() is None
+
+
+def test_must_visit_rejects_places_it_cant_find():
+    for place in ("Q99", 99, "Stadium of Light"):
+        with pytest.raises(ValueError):
+            must_visit(place)
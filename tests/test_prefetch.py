@@ -0,0 +1,32 @@
+import sys
+
+from prefetch import Prefetcher
+
+
+# Loads like TourPlanner's, printing their progress unless given another log
+class Planner:
+    def amenities(self, log=print):
+        log("Preprocessing amenities...")
+
+    def restaurants(self, log=print):
+        log("Retrieving restaurants...")
+
+    def lodging(self, log=print):
+        log("Retrieving hotels...")
+
+    def rentals(self, log=print):
+        log("Retrieving rentals...")
+
+    def graph(self, transportation, log=print):
+        log("Downloading street network...")
+
+
+def test_prefetch_loads_print_nothing_and_leave_stdout_alone(capsys):
+    stdout, stderr = sys.stdout, sys.stderr
+    prefetcher = Prefetcher(Planner()).start()
+    prefetcher.on_transport("walk")
+    for future in list(prefetcher._futures.values()):
+        future.result(timeout=10)
+    assert sys.stdout is stdout and sys.stderr is stderr
+    print("prompt")
+    assert capsys.readouterr().out == "prompt\n"
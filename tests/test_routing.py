@@ -0,0 +1,59 @@
+import networkx as nx
+import pytest
+
+from compact_graph import CompactGraph
+from routing import StreetRouter
+
+START = (49.28, -123.12)
+STEP = 0.001  # About 111 m north-south
+
+
+# Three intersections in a row going north, and two more that no street
+# connects to them
+def graph():
+    G = nx.MultiGraph()
+    for i in range(3):
+        G.add_node(i, y=START[0] + i * STEP, x=START[1])
+    G.add_edge(0, 1, length=111.0)
+    G.add_edge(1, 2, length=111.0)
+    G.add_node(10, y=START[0], x=START[1] + 0.01)
+    G.add_node(11, y=START[0] + STEP, x=START[1] + 0.01)
+    G.add_edge(10, 11, length=111.0)
+    return CompactGraph.from_networkx(G)
+
+
+def point(i):
+    return [START[0] + i * STEP, START[1]]
+
+
+def test_each_leg_is_routed_once(monkeypatch):
+    G = graph()
+    calls = []
+    shortest_path = G.shortest_path
+    monkeypatch.setattr(
+        G, "shortest_path", lambda *nodes: calls.append(nodes) or shortest_path(*nodes)
+    )
+    router = StreetRouter(G, speed_kmh=6)
+    assert router.minutes(point(0), point(2)) == pytest.approx(2.22)
+    meters, path = router.leg(point(0), point(2))
+    assert meters == pytest.approx(222)
+    assert path == [point(0), point(1), point(2)]
+    # The map draws the legs the schedule routed
+    assert router.route([point(0), point(2)]) == path
+    assert len(calls) == 1
+
+
+def test_unconnected_leg_has_no_minutes():
+    router = StreetRouter(graph())
+    assert router.minutes(point(0), [START[0], START[1] + 0.01]) is None
+    assert router.route([point(0), [START[0], START[1] + 0.01]]) == []
+
+
+def test_without_a_graph_the_route_is_straight():
+    router = StreetRouter(None)
+    assert router.minutes(point(0), point(2)) is None
+    assert router.route([point(0), point(1), point(2)]) == [
+        point(0),
+        point(1),
+        point(2),
+    ]
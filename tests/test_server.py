@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import json
+from concurrent.futures import Future
+from http import HTTPStatus
+
+import server
+from plan_cache import PlanCache
+
+TOUR = {
+    "tour_length": 1,
+    "theme": "food",
+    "num_amenities": 3,
+    "coordinates": [49.28, -123.12],
+}
+
+
+# Plans in the calling thread instead of a worker process
+class Pool:
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class Itinerary:
+    truncated = []
+    schedule = [
+        {
+            "name": "Start Location",
+            "arrival": datetime.datetime(2025, 1, 1, 9, 0),
+            "departure": datetime.datetime(2025, 1, 1, 9, 0),
+        }
+    ]
+
+
+class Planner:
+    def __init__(self):
+        self.requests = []
+
+    def plan(self, request):
+        self.requests.append(request)
+        return Itinerary()
+
+
+def respond(planning_server, method, path, body=None):
+    data = b"" if body is None else body.encode()
+    head = f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n"
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(head.encode() + data)
+        reader.feed_eof()
+        return await planning_server.respond(reader)
+
+    return asyncio.run(run())
+
+
+def test_plan_is_answered_from_the_cache(monkeypatch):
+    planner = Planner()
+    monkeypatch.setattr(server, "_planner", planner)
+    planning_server = server.PlanningServer(Pool(), PlanCache())
+    for _ in range(2):
+        status, result = respond(planning_server, "POST", "/plan", json.dumps(TOUR))
+        assert status == HTTPStatus.OK
+        assert result["schedule"][0]["arrival"] == "09:00"
+    assert len(planner.requests) == 1
+    status, stats = respond(planning_server, "GET", "/stats")
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_bad_requests_are_rejected(monkeypatch):
+    monkeypatch.setattr(server, "_planner", Planner())
+    planning_server = server.PlanningServer(Pool(), PlanCache())
+    assert respond(planning_server, "GET", "/health")[0] == HTTPStatus.OK
+    assert respond(planning_server, "GET", "/tours")[0] == HTTPStatus.NOT_FOUND
+    assert respond(planning_server, "GET", "/plan")[0] == HTTPStatus.METHOD_NOT_ALLOWED
+    for body in ("{", "[1, 2]", json.dumps(dict(TOUR, tour_length=0))):
+        status, result = respond(planning_server, "POST", "/plan", body)
+        assert status == HTTPStatus.BAD_REQUEST
+        assert result["error"]
@@ -0,0 +1,57 @@
+import numpy as np
+
+from tag_store import TagStore
+
+DICTS = [
+    {"name": "Science World", "wikidata": "Q1", "addr:street": "Quebec St"},
+    float("nan"),
+    {"name": "Blenz", "cuisine": "coffee_shop", "brand": "Blenz"},
+    {"name": "The Orpheum", "amenity": "theatre", "wikidata": "Q2"},
+    {},
+]
+
+
+def as_dicts(store):
+    return [store.tags(row) for row in range(len(store))]
+
+
+def expected(dicts):
+    return [tags if isinstance(tags, dict) else {} for tags in dicts]
+
+
+def test_tags_round_trip_through_the_arrays(tmp_path):
+    store = TagStore.from_dicts(DICTS)
+    assert as_dicts(store) == expected(DICTS)
+    store.save(str(tmp_path))
+    loaded = TagStore.load(str(tmp_path))
+    assert isinstance(loaded.key_ids, np.memmap)
+    assert as_dicts(loaded) == expected(DICTS)
+
+
+def test_take_and_concat_keep_every_rows_tags():
+    store = TagStore.from_dicts(DICTS)
+    assert as_dicts(store.take([3, 0, 3])) == expected([DICTS[3], DICTS[0], DICTS[3]])
+    more = [{"name": "Blenz", "opening_hours": "24/7"}, {"wikidata": "Q3"}]
+    combined = store.concat(TagStore.from_dicts(more))
+    assert as_dicts(combined) == expected(DICTS + more)
+    # Keys and values both stores have are interned once
+    assert len(combined.keys) == len(set(combined.keys))
+    values = [combined.value_text(i) for i in range(len(combined.value_offsets) - 1)]
+    assert len(values) == len(set(values))
+
+
+def test_queries_match_the_dicts():
+    store = TagStore.from_dicts(DICTS)
+    assert store.has_key("wikidata").tolist() == [True, False, False, True, False]
+    assert store.has_prefix("addr:").tolist() == [True, False, False, False, False]
+    assert store.key_equals("name", "Blenz").tolist() == [
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+    assert store.count().tolist() == [3, 0, 3, 3, 0]
+    assert store.count(["name", "brand"]).tolist() == [1, 0, 2, 1, 0]
+    assert store.values("wikidata").tolist() == ["Q1", None, None, "Q2", None]
+    assert not store.has_key("no such key").any()
@@ -0,0 +1,222 @@
+# Network travel-time matrix between candidate stops
+#
+# Amenity selection and daily_schedule estimate travel with straight-line
+# distance, which is badly off across water (Bowen Island) or around inlets.
+# This builds a many-to-many table of street network distances for a fixed set
+# of points (filtered amenities, hotels, rentals) for one mode of travel, and
+# keeps it compressed on disk so that planning reads travel times from the
+# table instead of routing.
+#
+# A tour never travels between places on opposite ends of the region, so
+# each search is cut off at max_meters and only the pairs it reached are kept,
+# in CSR form like TagStore:
+#
+#   indptr    the pairs of row i are indices/meters[indptr[i]:indptr[i + 1]]
+#   indices   column of every pair, sorted within each row
+#   meters    network distance of every pair
+#
+# Pairs that aren't there are further apart than max_meters, or not
+# connected at all.
+#
+import hashlib
+import math
+import os
+import numpy as np
+
+from compact_graph import CompactGraph
+
+CACHE_DIR = "travel_cache"
+DAY_MINUTES = 12 * 60
+
+# Points further than this from the street network (e.g. snapped across the
+# water from Bowen Island) are treated as unreachable rather than guessed
+MAX_SNAP_METERS = 500
+METERS_PER_DEG = 111_195
+
+
+class TravelMatrix:
+    def __init__(self, lats, lons, indptr, indices, meters, speed_kmh):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.indptr = indptr
+        self.indices = indices
+        self.meters = meters
+        self.speed_kmh = speed_kmh
+        self.index = {
+            (round(lat, 6), round(lon, 6)): i
+            for i, (lat, lon) in enumerate(zip(self.lats, self.lons))
+        }
+
+    def __len__(self):
+        return len(self.lats)
+
+    def lookup(self, lat, lon):
+        return self.index.get((round(float(lat), 6), round(float(lon), 6)))
+
+    def _to_minutes(self, meters):
+        return np.maximum(meters / 1000 / self.speed_kmh * 60, 1)
+
+    # Meters from row i to every point, inf where the table has no pair
+    def _row(self, i):
+        start, end = self.indptr[i], self.indptr[i + 1]
+        row = np.full(len(self), np.inf)
+        row[self.indices[start:end]] = self.meters[start:end]
+        return row
+
+    # Minutes between two [lat, lon] points, inf if the network doesn't connect
+    # them within the table's distance, None if either point isn't in the table
+    def minutes(self, a, b):
+        i = self.lookup(a[0], a[1])
+        j = self.lookup(b[0], b[1])
+        if i is None or j is None:
+            return None
+        if i == j:
+            return 1.0
+        start, end = self.indptr[i], self.indptr[i + 1]
+        k = start + np.searchsorted(self.indices[start:end], j)
+        if k == end or self.indices[k] != j:
+            return float("inf")
+        return float(self._to_minutes(float(self.meters[k])))
+
+    # Minutes from one point to many, None if any of them isn't in the table
+    def minutes_from(self, a, lats, lons):
+        i = self.lookup(a[0], a[1])
+        cols = [self.lookup(lat, lon) for lat, lon in zip(lats, lons)]
+        if i is None or any(j is None for j in cols):
+            return None
+        return self._to_minutes(self._row(i)[cols])
+
+    # Written to a temporary file first, so parallel workers building the same
+    # matrix never see a half-written one
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            lats=self.lats,
+            lons=self.lons,
+            indptr=self.indptr,
+            indices=self.indices,
+            meters=self.meters,
+            speed_kmh=self.speed_kmh,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["lats"],
+                data["lons"],
+                data["indptr"],
+                data["indices"],
+                data["meters"],
+                float(data["speed_kmh"]),
+            )
+
+
+# Network node nearest to every point and the distance to it in meters. With
+# near_meters, a CompactGraph only searches its grid that far around each point
+# before comparing every node, which is faster when most points are that close.
+def snap_points(G, lats, lons, near_meters=None):
+    if isinstance(G, CompactGraph):
+        max_rings = 50
+        if near_meters is not None:
+            max_rings = math.ceil(near_meters / (G.cell_lat * METERS_PER_DEG)) + 1
+        nodes, snap = G.nearest_nodes(lats, lons, max_rings)
+    else:
+        import osmnx as ox
+
+        nodes, snap = ox.distance.nearest_nodes(G, lons, lats, return_dist=True)
+    return np.asarray(nodes), np.asarray(snap, dtype=float)
+
+
+# {node: meters} for every node within cutoff meters of source. Only a
+# CompactGraph search can stop early when deadline expires.
+def lengths_from(G, source, cutoff, deadline=None):
+    if isinstance(G, CompactGraph):
+        return G.single_source_lengths(source, cutoff, deadline)
+    import networkx as nx
+
+    return nx.single_source_dijkstra_path_length(
+        G, source, cutoff=cutoff, weight="length"
+    )
+
+
+# Runs one bounded Dijkstra search per distinct network node the points snap
+# to, and fills the rows for every point sharing that node at once. Each
+# search is cut off at max_minutes of travel, or max_meters when that is
+# shorter.
+def build_travel_matrix(
+    G, lats, lons, speed_kmh, max_minutes=DAY_MINUTES, max_meters=None
+):
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+    # (columns, meters) of every row, each point 0 m from itself
+    rows = [(np.array([i]), np.zeros(1)) for i in range(n)]
+    if n:
+        nodes, snap = snap_points(G, lats, lons)
+        on_network = np.flatnonzero(snap <= MAX_SNAP_METERS)
+        points_at = {}
+        for point in on_network.tolist():
+            points_at.setdefault(int(nodes[point]), []).append(point)
+        cutoff = speed_kmh * 1000 / 60 * max_minutes
+        if max_meters is not None:
+            cutoff = min(cutoff, max_meters)
+
+        for source, sources in points_at.items():
+            lengths = lengths_from(G, source, cutoff)
+            # Whichever is smaller is walked, the other looked up
+            if len(lengths) < len(points_at):
+                reached = [node for node in lengths if node in points_at]
+            else:
+                reached = [node for node in points_at if node in lengths]
+            cols = np.array([p for node in reached for p in points_at[node]])
+            # Walking to and from the network counts towards the distance
+            col_meters = np.array(
+                [lengths[node] for node in reached for _ in points_at[node]]
+            )
+            col_meters = col_meters + snap[cols]
+            order = np.argsort(cols)
+            cols, col_meters = cols[order], col_meters[order]
+            for point in sources:
+                meters = col_meters + snap[point]
+                meters[cols == point] = 0
+                rows[point] = (cols, meters)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(cols) for cols, _ in rows], out=indptr[1:])
+    indices = np.concatenate([cols for cols, _ in rows] + [np.zeros(0)])
+    meters = np.concatenate([meters for _, meters in rows] + [np.zeros(0)])
+    return TravelMatrix(
+        lats,
+        lons,
+        indptr,
+        indices.astype(np.int32),
+        meters.astype(np.float32),
+        speed_kmh,
+    )
+
+
+def matrix_cache_path(lats, lons, mode, cache_dir=CACHE_DIR, max_meters=None):
+    coords = np.round(np.column_stack([lats, lons]).astype(float), 6)
+    key = hashlib.sha1(
+        f"{mode}:{max_meters}:sparse".encode() + coords.tobytes()
+    ).hexdigest()
+    return os.path.join(cache_dir, f"{mode}-{key}.npz")
+
+
+# Reads the matrix for exactly these points, mode and max_meters from the
+# cache, building and saving it first if it isn't there yet
+def load_or_build_travel_matrix(
+    G, lats, lons, mode, speed_kmh, cache_dir=CACHE_DIR, max_meters=None
+):
+    path = matrix_cache_path(lats, lons, mode, cache_dir, max_meters)
+    if os.path.exists(path):
+        return TravelMatrix.load(path)
+
+    print(f"Building {mode} travel matrix for {len(lats)} places...")
+    matrix = build_travel_matrix(G, lats, lons, speed_kmh, max_meters=max_meters)
+    matrix.save(path)
+    return matrix